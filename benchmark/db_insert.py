@@ -0,0 +1,86 @@
+"""
+数据库写入基准
+db_insert.py: 比较 bulk_insert_window_activities 在不同连接方式下的写入吞吐
+- legacy: 每次调用新建连接, SQLite 默认的 DELETE 日志和 synchronous=FULL
+- persistent: 常驻连接, 默认日志模式
+- tuned: 常驻连接, WAL + synchronous=NORMAL + 页缓存 + mmap
+每种方式写入一个独立的临时数据库, 每次调用写入一分钟的聚合结果。
+
+运行: python -m benchmark.db_insert [--minutes 60] [--windows 50] [--processes 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from db.connection import ConnectionManager
+
+MODES = {
+    "legacy": dict(journal_mode=None, synchronous=None, cache_size_kb=None, mmap_size_mb=None),
+    "persistent": dict(journal_mode=None, synchronous=None, cache_size_kb=None, mmap_size_mb=None),
+    "tuned": dict(journal_mode="WAL", synchronous="NORMAL", cache_size_kb=8192, mmap_size_mb=64),
+}
+
+
+def build_minute(windows, processes, ticks=12):
+    """用合成后端生成一分钟的 WindowSorted 聚合结果"""
+    from data import backend as platform_backend
+    from data.collect import WindowsData, KeyMouseData
+    import data.format as fm
+
+    backend = platform_backend.SyntheticBackend(windows=windows, processes=processes,
+                                                pids_per_window=max(1, -(-processes // windows)))
+    win_datas = WindowsData(5, backend=backend)
+    km_datas = KeyMouseData(backend=backend, foreground=win_datas.foreground)
+    sorted_datas = fm.SortedDatas(1, km_datas, win_datas)
+    for _ in range(ticks):
+        win_datas.collect_window()
+    sorted_datas.merge_data()
+    return sorted_datas.windows
+
+
+def bench_mode(mode, window_dict, minutes, directory):
+    import db.sqlite
+
+    path = os.path.join(directory, f"{mode}.db")
+    rows = sum(1 + len(window.processInfos) for window in window_dict.values()) * minutes
+    manager = ConnectionManager(path, **MODES[mode])
+    db.sqlite.create_window_activity_table(manager)
+    if mode == "legacy":
+        manager.close()
+
+    started = time.perf_counter()
+    for _ in range(minutes):
+        if mode == "legacy":
+            manager = ConnectionManager(path, **MODES[mode])
+        db.sqlite.bulk_insert_window_activities(window_dict, manager)
+        if mode == "legacy":
+            manager.close()
+    elapsed = time.perf_counter() - started
+    manager.close()
+    return {"rows": rows, "seconds": elapsed, "rows_per_sec": rows / elapsed,
+            "ms_per_minute_flush": elapsed / minutes * 1000}
+
+
+def run(minutes=60, windows=50, processes=200):
+    window_dict = build_minute(windows, processes)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in MODES:
+            results[mode] = bench_mode(mode, window_dict, minutes, directory)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--minutes", type=int, default=60)
+    parser.add_argument("--windows", type=int, default=50)
+    parser.add_argument("--processes", type=int, default=200)
+    args = parser.parse_args()
+    for mode, result in run(args.minutes, args.windows, args.processes).items():
+        print(f"{mode:>10}: {result['rows_per_sec']:>10,.0f} rows/s, "
+              f"{result['ms_per_minute_flush']:7.2f} ms per minute flush")
+
+
+if __name__ == "__main__":
+    main()
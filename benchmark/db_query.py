@@ -0,0 +1,125 @@
+"""
+报表查询基准
+db_query.py: 在一个月的分钟级数据上运行 db.query 中的各个报表
+先用合成后端生成一分钟的聚合结果, 按分钟平移 which_minute 写入临时数据库,
+然后对整个范围运行每个报表: 先只读明细, 再运行 RollupEngine 汇总后读小时表/天表,
+报告两种情况的耗时、行数和查询计划。
+
+运行: python -m benchmark.db_query [--days 30] [--windows 10] [--processes 30] [--plan]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from db.connection import ConnectionManager
+
+REPORTS = ("time_per_app", "foreground_time_per_window", "input_intensity_per_hour",
+           "top_processes_memory", "top_processes_io", "top_keys_per_app")
+
+
+def populate(manager, days, windows, processes, start=datetime(2025, 1, 1)):
+    """写入 days 天、每分钟 windows 个窗口的活动"""
+    import db.sqlite
+    from benchmark.db_insert import build_minute
+
+    window_dict = build_minute(windows, processes)
+    db.sqlite.create_window_activity_table(manager)
+    batch = []
+    for minute in range(days * 24 * 60):
+        which_minute = (start + timedelta(minutes=minute)).strftime("%Y-%m-%d %H:%M")
+        # 每一批使用各自的副本, 只替换 which_minute
+        batch.append({hwnd: _at_minute(window, which_minute) for hwnd, window in window_dict.items()})
+        if len(batch) == 60:
+            db.sqlite.insert_window_batches(batch, manager)
+            batch = []
+    if batch:
+        db.sqlite.insert_window_batches(batch, manager)
+    manager.checkpoint()
+    return start, start + timedelta(days=days)
+
+
+def _at_minute(window, which_minute):
+    import copy
+    window = copy.copy(window)
+    window.whichMinute = which_minute
+    return window
+
+
+def _sql(name, start, end, watermarks):
+    """报表的 SQL 和完整参数; 分层报表按给定水位拆段, 水位为空时全部读明细"""
+    from db import query
+    if name in query.TIERED_REPORTS:
+        sql, params = query.build(name, start, end, watermarks)
+        if name.startswith("top_processes"):
+            params += (10,)
+        return sql, params
+    sql = {"foreground_time_per_window": query.SQL_FOREGROUND_PER_WINDOW,
+           "top_keys_per_app": query.SQL_TOP_KEYS_PER_APP}[name]
+    return sql, (query.to_minute(start), query.to_minute(end))
+
+
+def _time_reports(manager, start, end, watermarks, plan):
+    from db import query
+    results = {}
+    for name in REPORTS:
+        sql, params = _sql(name, start, end, watermarks)
+        started = time.perf_counter()
+        count = sum(1 for _ in query.rows(query.stream(sql, params, manager=manager)))
+        result = {"rows": count, "seconds": time.perf_counter() - started}
+        if plan:
+            with manager.reader() as conn:
+                result["plan"] = query._explain(conn, sql, params)
+        results[name] = result
+    return results
+
+
+def run(days=30, windows=10, processes=30, plan=False):
+    """
+    :return: {"raw": 只读明细的各报表耗时, "rollup": 汇总后按水位拆段的各报表耗时, ...}
+    """
+    from db import query, rollup
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        manager = ConnectionManager(os.path.join(directory, "query.db"))
+        started = time.perf_counter()
+        start, end = populate(manager, days, windows, processes)
+        results["populate_seconds"] = time.perf_counter() - started
+        with manager.reader() as conn:
+            results["window_rows"] = conn.execute("SELECT COUNT(*) FROM window_activity").fetchone()[0]
+            results["process_rows"] = conn.execute("SELECT COUNT(*) FROM process_snapshots").fetchone()[0]
+        results["raw"] = _time_reports(manager, start, end, {}, plan)
+
+        engine = rollup.RollupEngine(manager, raw_retention_days=None, hourly_retention_days=None)
+        started = time.perf_counter()
+        engine.rollup(now=end + timedelta(hours=1))
+        results["rollup_seconds"] = time.perf_counter() - started
+        results["rollup"] = _time_reports(manager, start, end, query._watermarks(manager), plan)
+        manager.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--windows", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=30)
+    parser.add_argument("--plan", action="store_true", help="同时输出查询计划")
+    args = parser.parse_args()
+    results = run(args.days, args.windows, args.processes, args.plan)
+    print(f"populated {results['window_rows']:,} window rows, {results['process_rows']:,} process rows "
+          f"in {results['populate_seconds']:.1f} s, rollup in {results['rollup_seconds']:.1f} s")
+    for name in REPORTS:
+        raw, rolled = results["raw"][name], results["rollup"][name]
+        print(f"{name:>28}: raw {raw['seconds'] * 1000:8.1f} ms, rollup {rolled['seconds'] * 1000:8.1f} ms, "
+              f"{rolled['rows']:>6} rows")
+        for label, result in (("raw", raw), ("rollup", rolled)):
+            if "plan" in result:
+                print(f"  [{label}]")
+                print(result["plan"])
+
+
+if __name__ == "__main__":
+    main()
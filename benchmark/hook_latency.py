@@ -0,0 +1,121 @@
+"""
+钩子延迟基准
+hook_latency.py: 在整理和落库负载较重时, 比较进程内采集与进程外采集(data.collect.worker)的键鼠钩子延迟
+- inproc: 钩子线程、采样、merge_data 和 SQLite 提交在同一个解释器里
+- worker: 钩子线程和采样在工作进程里, 主进程只做整理和落库
+延迟取自 SyntheticBackend 的 hook_latency_seconds: 一批合成事件应当发出的时间到回调全部返回的时间,
+钩子线程抢不到 GIL 时变长。为放大整理和落库的负载, 关闭流式整理、向量化和写线程, 每分钟在调度线程里同步合并和提交。
+两种模式各在一个子进程中运行, 运行时长应覆盖至少一次落库。分位数取直方图桶的上界。
+
+运行: python -m benchmark.hook_latency [--seconds 70] [--windows 300] [--processes 2000] [--events 1000] [--out hook.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("inproc", "worker")
+
+
+def _quantile(histogram, q):
+    """直方图中第 q 分位所在桶的上界(毫秒)"""
+    target = histogram["count"] * q
+    total = 0
+    for bound, count in histogram["buckets"].items():
+        total += count
+        if total >= target:
+            return float(bound) * 1000
+    return float("inf")
+
+
+def measure(mode, seconds, windows, processes, events, db_dir):
+    import config.config as conf
+    settings = conf.settings
+    collect_conf = settings['data']['collect']
+    collect_conf['backend']['name'] = 'synthetic'
+    collect_conf['backend']['synthetic'].update(windows=windows, processes=processes, events_per_second=events,
+                                                pids_per_window=max(1, -(-processes // windows)))
+    collect_conf.setdefault('worker', {})['enabled'] = mode == "worker"
+    collect_conf.setdefault('change_detection', {})['enabled'] = False
+    collect_conf.setdefault('adaptive', {})['enabled'] = False
+    settings['data']['runtime'] = 'threads'
+    settings['data']['format'].update(streaming=False, vectorized=False)
+    settings['data'].setdefault('metrics', {}).update(enabled=True, file_name=None)
+    settings['db']['file_name'] = os.path.join(db_dir, f"{mode}.db")
+    settings['db'].setdefault('writer', {})['enabled'] = False
+    settings['db'].setdefault('rollup', {})['enabled'] = False
+
+    from data.main import DataCollector
+    import db.sqlite
+
+    collector = DataCollector()
+    started = time.perf_counter()
+    collector.start()
+    time.sleep(seconds)
+    collector.stop()
+    wall = time.perf_counter() - started
+
+    snapshot = collector.metrics()
+    source = snapshot.get("worker", snapshot) if mode == "worker" else snapshot
+    histogram = source["histograms"].get("hook_latency_seconds", {}).get("synthetic")
+    stages = snapshot["histograms"].get("stage_duration_seconds", {})
+    with db.sqlite.get_db_manager().reader() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM window_activity").fetchone()[0]
+    result = {"mode": mode, "seconds": wall, "batches": 0, "window_activity_rows": rows}
+    if histogram:
+        result.update(batches=histogram["count"], avg_ms=histogram["avg_ms"],
+                      p50_ms=_quantile(histogram, 0.50), p99_ms=_quantile(histogram, 0.99),
+                      p999_ms=_quantile(histogram, 0.999))
+    for stage in ("merge_data", "db_insert"):
+        if stage in stages:
+            result[f"{stage}_avg_ms"] = stages[stage]["avg_ms"]
+    return result
+
+
+def _run_child(mode, args, db_dir):
+    command = [sys.executable, "-m", "benchmark.hook_latency", "--child", mode, "--db-dir", db_dir,
+               "--seconds", str(args.seconds), "--windows", str(args.windows),
+               "--processes", str(args.processes), "--events", str(args.events)]
+    output = subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=70, help="每种模式的运行秒数, 至少覆盖一次落库")
+    parser.add_argument("--windows", type=int, default=300)
+    parser.add_argument("--processes", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=1000, help="合成键鼠事件的每秒数量")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--out", help="结果写入的 JSON 文件")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--db-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measure(args.child, args.seconds, args.windows, args.processes, args.events, args.db_dir)
+        print(json.dumps(result))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as db_dir:
+        for mode in args.modes:
+            results.append(_run_child(mode, args, db_dir))
+
+    print(f"{'mode':<8}{'batches':>9}{'avg ms':>9}{'p50 ms':>9}{'p99 ms':>9}{'p99.9 ms':>10}{'merge ms':>10}{'rows':>8}")
+    for result in results:
+        print(f"{result['mode']:<8}{result['batches']:>9}{result.get('avg_ms', 0):>9.2f}"
+              f"{result.get('p50_ms', 0):>9.1f}{result.get('p99_ms', 0):>9.1f}{result.get('p999_ms', 0):>10.1f}"
+              f"{result.get('merge_data_avg_ms', 0):>10.1f}{result['window_activity_rows']:>8}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump({"windows": args.windows, "processes": args.processes, "events_per_second": args.events,
+                       "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+键鼠计数基准
+input_events.py: 测量 KeyMouseData 回调每秒能处理多少事件
+- 单线程: 连续调用回调, 得到每个事件的开销和理论上限
+- 并发: 键盘、鼠标两个钩子线程同时写入, 另一个线程每 10ms 调用一次 get_and_reset
+钩子线程处理一个事件的时间超过事件间隔时就会积压, 因此可承受的最大速率 = 1 / 单事件开销。
+
+运行: python -m benchmark.input_events [--events N]
+"""
+import argparse
+import threading
+import time
+
+from data import backend as platform_backend
+from data.collect import KeyMouseData
+
+
+class LegacyKeyMouseData:
+    """改造前的实现: 每个事件一次 setdefault(KeyMouseInfo(...)), 每个 KeyMouseInfo 一把锁"""
+
+    class _Info:
+        def __init__(self, window_id):
+            self.lock = threading.Lock()
+            self.keyPressNum = 0
+            self.keyPressList = {}
+            self.mouseMoveNum = 0
+            self.mouseScrollNum = 0
+            self.mouseClickNum = 0
+            self.activeWindowId = window_id
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.windowsActivity = {}
+        self.activityCounters = 0
+
+    def get_and_reset(self):
+        with self.lock:
+            windows_activity = self.windowsActivity
+            activity_counters = self.activityCounters
+            self.windowsActivity = {}
+            self.activityCounters = 0
+        return windows_activity, activity_counters
+
+    def key_on_press(self, key):
+        hwnd = self.backend.get_foreground_window()
+        with self.lock:
+            self.activityCounters += 1
+        info = self.windowsActivity.setdefault(hwnd, self._Info(hwnd))
+        with info.lock:
+            info.keyPressNum += 1
+            key_str = str(key)
+            info.keyPressList[key_str] = info.keyPressList.get(key_str, 0) + 1
+
+    def mouse_on_move(self, x, y):
+        hwnd = self.backend.get_foreground_window()
+        with self.lock:
+            self.activityCounters += 1
+            info = self.windowsActivity.setdefault(hwnd, self._Info(hwnd))
+            with info.lock:
+                info.mouseMoveNum += 1
+
+    def mouse_on_click(self, x, y, button, pressed):
+        if pressed:
+            hwnd = self.backend.get_foreground_window()
+            with self.lock:
+                self.activityCounters += 1
+            info = self.windowsActivity.setdefault(hwnd, self._Info(hwnd))
+            with info.lock:
+                info.mouseClickNum += 1
+
+    def mouse_on_scroll(self, x, y, dx, dy):
+        hwnd = self.backend.get_foreground_window()
+        info = self.windowsActivity.setdefault(hwnd, self._Info(hwnd))
+        with info.lock:
+            info.mouseScrollNum += 1
+
+
+def _callbacks(data):
+    return data.key_on_press, data.mouse_on_move, data.mouse_on_click, data.mouse_on_scroll
+
+
+def bench_single(data, backend, events):
+    """单线程吞吐, 返回 (事件/秒, 每事件微秒)"""
+    started = time.perf_counter()
+    backend.emit_events(events, *_callbacks(data))
+    elapsed = time.perf_counter() - started
+    data.get_and_reset()
+    return events / elapsed, elapsed / events * 1e6
+
+
+def bench_concurrent(data, events):
+    """键盘线程和鼠标线程同时写入, 读取线程不断 get_and_reset, 返回 (事件/秒, 计数是否无丢失)"""
+    stop = threading.Event()
+    counted = [0]
+
+    def reader():
+        while not stop.wait(0.01):
+            counted[0] += data.get_and_reset()[1]
+
+    def keyboard_thread():
+        for i in range(events // 2):
+            data.key_on_press("'a'")
+
+    def mouse_thread():
+        for i in range(events // 2):
+            data.mouse_on_move(i, i)
+
+    reader_thread = threading.Thread(target=reader)
+    writers = [threading.Thread(target=keyboard_thread), threading.Thread(target=mouse_thread)]
+    reader_thread.start()
+    started = time.perf_counter()
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    reader_thread.join()
+    counted[0] += data.get_and_reset()[1]
+    return (events // 2 * 2) / elapsed, counted[0] == events // 2 * 2
+
+
+def run(events=200_000, windows=30):
+    results = {}
+    for name, factory in (("legacy", LegacyKeyMouseData), ("counters", KeyMouseData)):
+        backend = platform_backend.SyntheticBackend(windows=windows, processes=windows, seed=0)
+        data = factory(backend=backend)
+        rate, cost = bench_single(data, backend, events)
+        concurrent_rate, exact = bench_concurrent(data, events)
+        results[name] = {
+            "single_events_per_sec": rate,
+            "single_us_per_event": cost,
+            "concurrent_events_per_sec": concurrent_rate,
+            "concurrent_exact": exact,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--windows", type=int, default=30)
+    args = parser.parse_args()
+    for name, result in run(args.events, args.windows).items():
+        print(f"{name:>9}: {result['single_events_per_sec']:>12,.0f} events/s "
+              f"({result['single_us_per_event']:.2f} us/event), "
+              f"concurrent {result['concurrent_events_per_sec']:>12,.0f} events/s, "
+              f"exact={result['concurrent_exact']}")
+
+
+if __name__ == "__main__":
+    main()
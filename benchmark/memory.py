@@ -0,0 +1,113 @@
+"""
+内存基准
+memory.py: 一分钟的快照和聚合对象在 N 个窗口 / M 个进程时占用多少内存
+- slots: 当前使用 __slots__ 的记录类型
+- dict: 去掉 __slots__ 的同名类, 即改造前基于 __dict__ 的普通对象
+两种形式各在一个子进程中运行, 报告 tracemalloc 统计的对象内存和进程常驻内存(RSS)。
+
+运行: python -m benchmark.memory [--windows 300] [--processes 1000] [--ticks 12]
+"""
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+# 采集与聚合中的记录类型
+RECORD_CLASSES = {
+    "data.collect": ("ProcessInfo", "MemUsage", "IOUsage", "WindowInfo", "KeyBoardInfo", "MouseInfo", "KeyMouseInfo"),
+    "data.format": ("MemorySorted", "IOSorted", "ProcesSorted", "KeyBoardInfo", "MouseInfo", "WindowSorted"),
+}
+
+
+def _rss():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _without_slots(cls):
+    """同名同方法、但实例使用 __dict__ 的类"""
+    skip = set(cls.__slots__) | {"__slots__", "__dict__", "__weakref__"}
+    namespace = {key: value for key, value in vars(cls).items() if key not in skip}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+
+def measure(variant, windows, processes, ticks):
+    import importlib
+    if variant == "dict":
+        for module_name, names in RECORD_CLASSES.items():
+            module = importlib.import_module(module_name)
+            for name in names:
+                setattr(module, name, _without_slots(getattr(module, name)))
+
+    from data import backend as platform_backend
+    from data.collect import WindowsData, KeyMouseData
+    import data.format as fm
+
+    pids_per_window = max(1, -(-processes // windows))
+    backend = platform_backend.SyntheticBackend(windows=windows, processes=processes,
+                                                pids_per_window=pids_per_window)
+    win_datas = WindowsData(5, backend=backend)
+    km_datas = KeyMouseData(backend=backend, foreground=win_datas.foreground)
+    sorted_datas = fm.SortedDatas(1, km_datas, win_datas)
+
+    gc.collect()
+    rss_before = _rss()
+    tracemalloc.start()
+    for _ in range(ticks):
+        win_datas.collect_window()
+    snapshots_bytes = tracemalloc.get_traced_memory()[0]
+    sorted_datas.merge_data()
+    gc.collect()
+    aggregates_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "variant": variant,
+        "windows": windows,
+        "processes": processes,
+        "ticks": ticks,
+        "snapshots_bytes": snapshots_bytes,
+        "aggregates_bytes": aggregates_bytes,
+        "peak_bytes": peak_bytes,
+        "rss_delta_bytes": _rss() - rss_before,
+    }
+
+
+def run(windows=300, processes=1000, ticks=12):
+    results = {}
+    for variant in ("dict", "slots"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmark.memory", "--child", variant,
+             "--windows", str(windows), "--processes", str(processes), "--ticks", str(ticks)],
+            check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout
+        results[variant] = json.loads(output.strip().splitlines()[-1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--windows", type=int, default=300)
+    parser.add_argument("--processes", type=int, default=1000)
+    parser.add_argument("--ticks", type=int, default=12)
+    parser.add_argument("--child", choices=("dict", "slots"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure(args.child, args.windows, args.processes, args.ticks)))
+        return
+    for variant, result in run(args.windows, args.processes, args.ticks).items():
+        print(f"{variant:>5}: snapshots {result['snapshots_bytes'] / 1e6:8.2f} MB, "
+              f"aggregates {result['aggregates_bytes'] / 1e6:8.2f} MB, "
+              f"peak {result['peak_bytes'] / 1e6:8.2f} MB, "
+              f"rss +{result['rss_delta_bytes'] / 1e6:8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+组件基准套件
+run.py: 用合成后端在任意平台上测量采集、整理和落库的热点路径, 结果写成 JSON, 可与之前的结果对比
+- collect.pids_info: ProcessInfo.collect_pids_info 逐个采样 N 个进程
+- collect.snapshot: ProcessSnapshot 批量采样 + 静态属性缓存, 每个 tick 采样 N 个进程
+- collect.window_tick: 一次完整的 WindowsData.collect_window, 分别测量全量采样和变化检测模式
+- collect.key_mouse: KeyMouseData 回调在合成事件风暴下每个事件的开销
+- format.fold_tick: 流式模式下每个 tick 并入 WindowSorted 的开销
+- format.merge_data: 一分钟 12 个 tick 的 SortedDatas.merge_data
+- metrics.overhead: 指标启用/关闭时 N 次 inc + timer 埋点的开销
+- db.bulk_insert: 一次 bulk_insert_window_activities 写入 W 个窗口
+- startup.import: 在新的解释器里导入各模块的耗时, startup.collector 为导入 data.main 并构造 DataCollector
+- db.insert: 一次事务写入 K 个周期(每周期 W 个窗口)的 insert_window_batches
+每个用例重复若干次, 记录每次的耗时, 报告中位数和最小值; 单位见各用例的 unit。
+
+运行: python -m benchmark.run [--quick] [--filter db.] [--out results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from data import backend as platform_backend
+
+# 对比时中位数变慢超过该比例视为回退
+DEFAULT_THRESHOLD = 0.10
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 冷启动时导入的模块, 按依赖从轻到重
+STARTUP_MODULES = ("config.config", "data.collect", "data.format", "db.sqlite", "db.query", "data.main")
+
+
+def _synthetic(windows, processes, seed=0):
+    return platform_backend.SyntheticBackend(windows=windows, processes=processes, seed=seed,
+                                             pids_per_window=max(1, -(-processes // windows)))
+
+
+def _all_pids(backend):
+    pids = []
+    for hwnd, _ in backend.get_all_windows():
+        pids.extend(backend.get_window_pids(hwnd))
+    return list(dict.fromkeys(pids))
+
+
+def _repeat(setup, measure, repeats):
+    """每次重复先 setup() 再计时 measure(state), 返回每次的秒数"""
+    samples = []
+    for _ in range(repeats):
+        state = setup()
+        started = time.perf_counter()
+        measure(state)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_pids_info(processes, repeats):
+    from data.collect import ProcessInfo
+    backend = _synthetic(max(1, processes // 4), processes)
+    pids = _all_pids(backend)
+    samples = _repeat(lambda: None, lambda _: ProcessInfo.collect_pids_info(pids, backend), repeats)
+    return samples, len(pids)
+
+
+def bench_snapshot(processes, repeats):
+    from data.collect import ProcessSnapshot
+    backend = _synthetic(max(1, processes // 4), processes)
+    pids = _all_pids(backend)
+    snapshot = ProcessSnapshot(backend)
+
+    def tick(_):
+        snapshot.begin_tick()
+        snapshot.prefetch(pids)
+        snapshot.collect(pids)
+        snapshot.end_tick()
+
+    # 第一次 tick 填充静态属性缓存, 之后测量的是稳定状态
+    tick(None)
+    return _repeat(lambda: None, tick, repeats), len(pids)
+
+
+def bench_key_mouse(events, repeats):
+    from data.collect import KeyMouseData
+    backend = _synthetic(30, 30)
+    data = KeyMouseData(backend=backend)
+    callbacks = (data.key_on_press, data.mouse_on_move, data.mouse_on_click, data.mouse_on_scroll)
+
+    def storm(_):
+        backend.emit_events(events, *callbacks)
+        data.get_and_reset()
+
+    return _repeat(lambda: None, storm, repeats), events
+
+
+def _format_setup(windows, processes, streaming, vectorized=False):
+    from data.collect import WindowsData, KeyMouseData
+    import data.format as fm
+    backend = _synthetic(windows, processes)
+    win_datas = WindowsData(5, backend=backend)
+    km_datas = KeyMouseData(backend=backend, foreground=win_datas.foreground)
+    sorted_datas = fm.SortedDatas(1, km_datas, win_datas, streaming=streaming, vectorized=vectorized)
+    return backend, win_datas, km_datas, sorted_datas
+
+
+def bench_window_tick(windows, processes, change_threshold, repeats):
+    from data.collect import WindowsData
+    backend = _synthetic(windows, processes)
+    win_datas = WindowsData(5, backend=backend, change_threshold=change_threshold)
+    win_datas.set_sink(lambda windows_list: None)
+    # 第一次 tick 填充缓存和上一 tick 的窗口集合
+    win_datas.collect_window()
+    return _repeat(lambda: None, lambda _: win_datas.collect_window(), repeats), windows
+
+
+def bench_fold_tick(windows, processes, repeats):
+    _, win_datas, _, sorted_datas = _format_setup(windows, processes, streaming=True)
+    # 采集与并入分开计时: 先关掉下沉, 采集后手动并入
+    win_datas.set_sink(None)
+
+    def setup():
+        win_datas.collect_window()
+        return win_datas.window_infos.pop()
+
+    return _repeat(setup, sorted_datas.fold_windows, repeats), windows
+
+
+def bench_merge_data(windows, processes, repeats, ticks=12):
+    backend, win_datas, km_datas, sorted_datas = _format_setup(windows, processes, streaming=False)
+
+    def setup():
+        for _ in range(ticks):
+            win_datas.collect_window()
+        backend.emit_events(ticks * 100, km_datas.key_on_press, km_datas.mouse_on_move,
+                            km_datas.mouse_on_click, km_datas.mouse_on_scroll)
+
+    def merge(_):
+        sorted_datas.merge_data()
+        sorted_datas.windows = {}
+
+    return _repeat(setup, merge, repeats), windows
+
+
+def bench_bulk_insert(windows, repeats, processes_per_window=4):
+    import db.sqlite
+    from benchmark.db_insert import build_minute
+    from db.connection import ConnectionManager
+
+    window_dict = build_minute(windows, windows * processes_per_window)
+    with tempfile.TemporaryDirectory() as directory:
+        manager = ConnectionManager(os.path.join(directory, "bench.db"))
+        db.sqlite.create_window_activity_table(manager)
+        samples = _repeat(lambda: None, lambda _: db.sqlite.bulk_insert_window_activities(window_dict, manager),
+                          repeats)
+        manager.close()
+    return samples, windows
+
+
+def bench_insert(windows, batch, repeats, processes_per_window=4):
+    import db.sqlite
+    from benchmark.db_insert import build_minute
+    from db.connection import ConnectionManager
+
+    window_dict = build_minute(windows, windows * processes_per_window)
+    with tempfile.TemporaryDirectory() as directory:
+        manager = ConnectionManager(os.path.join(directory, "bench.db"))
+        db.sqlite.create_window_activity_table(manager)
+        batches = [window_dict] * batch
+        samples = _repeat(lambda: None, lambda _: db.sqlite.insert_window_batches(batches, manager), repeats)
+        manager.close()
+    return samples, windows * batch
+
+
+def bench_metrics(calls, enabled, repeats):
+    from data.metrics import Registry
+    registry = Registry(enabled=enabled)
+
+    def instrumented(_):
+        for _ in range(calls):
+            with registry.timer("bench"):
+                registry.inc("windows_total", 3)
+
+    return _repeat(lambda: None, instrumented, repeats), calls
+
+
+def _cold(code, repeats):
+    """每次在新的解释器里执行 code, code 把计时结果(秒)打印在最后一行"""
+    samples = []
+    for _ in range(repeats):
+        completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT, check=True)
+        samples.append(float(completed.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def bench_import(module, repeats):
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    return _cold(code, repeats), 1
+
+
+def bench_collector_startup(repeats):
+    code = ("import time; started = time.perf_counter()\n"
+            "from data.main import DataCollector\n"
+            "from data.backend import SyntheticBackend\n"
+            "DataCollector(SyntheticBackend())\n"
+            "print(time.perf_counter() - started)")
+    return _cold(code, repeats), 1
+
+
+def cases(quick=False):
+    """
+    :return: [(用例名, 参数, 单位说明, 调用)]; 调用返回 (每次重复的秒数, 每次处理的条目数)
+    """
+    scale = 0.25 if quick else 1.0
+    repeats = 3 if quick else 7
+    items = []
+    for processes in (50, 200, 1000):
+        items.append((f"collect.pids_info[{processes}]", {"processes": processes}, "ms per call",
+                      lambda p=processes: bench_pids_info(p, repeats)))
+        items.append((f"collect.snapshot[{processes}]", {"processes": processes}, "ms per tick",
+                      lambda p=processes: bench_snapshot(p, repeats)))
+    events = int(100_000 * scale)
+    for windows, processes in ((50, 200), (200, 1000)):
+        for mode, threshold in (("full", None), ("change", 0.05)):
+            items.append((f"collect.window_tick[{windows}x{processes} {mode}]",
+                          {"windows": windows, "processes": processes, "change_threshold": threshold}, "ms per tick",
+                          lambda w=windows, p=processes, t=threshold: bench_window_tick(w, p, t, repeats)))
+    items.append((f"collect.key_mouse[{events}]", {"events": events}, "ms per storm",
+                  lambda: bench_key_mouse(events, repeats)))
+    for windows, processes in ((10, 50), (50, 200), (200, 1000)):
+        params = {"windows": windows, "processes": processes}
+        items.append((f"format.fold_tick[{windows}x{processes}]", params, "ms per tick",
+                      lambda w=windows, p=processes: bench_fold_tick(w, p, repeats)))
+        items.append((f"format.merge_data[{windows}x{processes}]", params, "ms per minute",
+                      lambda w=windows, p=processes: bench_merge_data(w, p, repeats)))
+    for module in STARTUP_MODULES:
+        items.append((f"startup.import[{module}]", {"module": module}, "ms per import",
+                      lambda m=module: bench_import(m, repeats)))
+    items.append(("startup.collector", {}, "ms to construct", lambda: bench_collector_startup(repeats)))
+    calls = int(100_000 * scale)
+    for enabled in (False, True):
+        state = "on" if enabled else "off"
+        items.append((f"metrics.overhead[{state}]", {"calls": calls, "enabled": enabled}, "ms per batch",
+                      lambda e=enabled: bench_metrics(calls, e, repeats)))
+    for windows in (10, 50, 200):
+        items.append((f"db.bulk_insert[{windows}w]", {"windows": windows}, "ms per call",
+                      lambda w=windows: bench_bulk_insert(w, repeats)))
+    for windows in (10, 50):
+        for batch in (1, 8, 32):
+            items.append((f"db.insert[{windows}w x {batch}]", {"windows": windows, "batch": batch},
+                          "ms per commit", lambda w=windows, b=batch: bench_insert(w, b, repeats)))
+    return items
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=ROOT).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(quick=False, name_filter=None):
+    results = {}
+    for name, params, unit, call in cases(quick):
+        if name_filter and name_filter not in name:
+            continue
+        samples, items = call()
+        results[name] = {
+            "params": params,
+            "unit": unit,
+            "items": items,
+            "median_ms": statistics.median(samples) * 1000,
+            "min_ms": min(samples) * 1000,
+            "samples_ms": [sample * 1000 for sample in samples],
+            "us_per_item": statistics.median(samples) / max(items, 1) * 1e6,
+        }
+        print(f"{name:>32}: median {results[name]['median_ms']:9.3f} ms, min {results[name]['min_ms']:9.3f} ms "
+              f"({results[name]['us_per_item']:8.2f} us/item)", flush=True)
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    按中位数对比两次结果。
+    :return: 回退的用例名列表
+    """
+    regressions = []
+    print(f"\ncompare with {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}), "
+          f"threshold {threshold:.0%}")
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:>32}: new")
+            continue
+        change = result["median_ms"] / before["median_ms"] - 1 if before["median_ms"] else 0.0
+        mark = ""
+        if change > threshold:
+            mark = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            mark = "  improved"
+        print(f"{name:>32}: {before['median_ms']:9.3f} -> {result['median_ms']:9.3f} ms ({change:+7.1%}){mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--quick", action="store_true", help="更小的规模和更少的重复次数")
+    parser.add_argument("--filter", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--out", help="结果 JSON 的输出路径")
+    parser.add_argument("--compare", help="与之前的结果 JSON 对比, 有回退时退出码为 1")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    current = run(args.quick, args.filter)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump(current, file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if compare(current, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
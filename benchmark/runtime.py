@@ -0,0 +1,115 @@
+"""
+运行时对比
+runtime.py: 用合成后端分别以线程运行时和 asyncio 运行时运行 DataCollector, 比较 CPU 时间和线程数
+- threads: APScheduler 线程池 + 前台轮询线程 + 落库线程
+- asyncio: 一个事件循环线程 + max_workers 个执行阻塞调用的线程
+两种运行时各在一个子进程中运行相同的时长, 数据库写到临时目录, 窗口采集间隔和落库周期不变。
+报告进程 CPU 时间(用户态 + 内核态)、每秒 CPU 占用、采样得到的平均和峰值线程数, 以及运行期间写入的窗口活动行数。
+
+运行: python -m benchmark.runtime [--seconds 130] [--windows 30] [--processes 100] [--events 200] [--out runtime.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNTIMES = ("threads", "asyncio")
+
+
+def measure(runtime, seconds, windows, processes, events, db_dir):
+    import config.config as conf
+    settings = conf.settings
+    settings['data']['runtime'] = runtime
+    settings['data']['collect']['backend']['name'] = 'synthetic'
+    settings['data']['collect']['backend']['synthetic'].update(windows=windows, processes=processes,
+                                                                events_per_second=events)
+    settings['db']['file_name'] = os.path.join(db_dir, f"{runtime}.db")
+    # 单独比较运行时, 不做汇总维护, 也不写指标文件
+    settings['db'].setdefault('rollup', {})['enabled'] = False
+    settings['data'].setdefault('metrics', {})['file_name'] = None
+
+    from data.main import DataCollector
+    import db.sqlite
+
+    collector = DataCollector()
+    thread_counts = []
+    sampling = threading.Event()
+
+    def sample_threads():
+        while not sampling.wait(0.5):
+            thread_counts.append(threading.active_count())
+
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    collector.start()
+    sampler = threading.Thread(target=sample_threads, name="bench-sampler", daemon=True)
+    sampler.start()
+    time.sleep(seconds)
+    # 统计线程数时不计入采样线程本身
+    sampling.set()
+    sampler.join()
+    collector.stop()
+    cpu = time.process_time() - started_cpu
+    wall = time.perf_counter() - started
+
+    with db.sqlite.get_db_manager().reader() as conn:
+        rows = conn.execute("SELECT COUNT(*) FROM window_activity").fetchone()[0]
+    counts = [count - 1 for count in thread_counts] or [0]
+    return {
+        "runtime": runtime,
+        "seconds": wall,
+        "cpu_seconds": cpu,
+        "cpu_percent": cpu / wall * 100,
+        "threads_avg": sum(counts) / len(counts),
+        "threads_max": max(counts),
+        "window_activity_rows": rows,
+    }
+
+
+def _run_child(runtime, args, db_dir):
+    command = [sys.executable, "-m", "benchmark.runtime", "--child", runtime, "--db-dir", db_dir,
+               "--seconds", str(args.seconds), "--windows", str(args.windows),
+               "--processes", str(args.processes), "--events", str(args.events)]
+    output = subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=130, help="每种运行时的运行秒数, 至少覆盖两次落库")
+    parser.add_argument("--windows", type=int, default=30)
+    parser.add_argument("--processes", type=int, default=100)
+    parser.add_argument("--events", type=int, default=200, help="合成键鼠事件的每秒数量")
+    parser.add_argument("--runtimes", nargs="+", default=list(RUNTIMES), choices=RUNTIMES)
+    parser.add_argument("--out", help="结果写入的 JSON 文件")
+    parser.add_argument("--child", choices=RUNTIMES, help=argparse.SUPPRESS)
+    parser.add_argument("--db-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = measure(args.child, args.seconds, args.windows, args.processes, args.events, args.db_dir)
+        print(json.dumps(result))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as db_dir:
+        for runtime in args.runtimes:
+            results.append(_run_child(runtime, args, db_dir))
+
+    print(f"{'runtime':<10}{'cpu s':>10}{'cpu %':>10}{'threads avg':>14}{'threads max':>14}{'rows':>8}")
+    for result in results:
+        print(f"{result['runtime']:<10}{result['cpu_seconds']:>10.2f}{result['cpu_percent']:>10.2f}"
+              f"{result['threads_avg']:>14.1f}{result['threads_max']:>14}{result['window_activity_rows']:>8}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as file:
+            json.dump({"windows": args.windows, "processes": args.processes, "events_per_second": args.events,
+                       "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
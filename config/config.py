@@ -1,6 +1,6 @@
 import os
 import re
-import yaml
+import threading
 import logging
 
 # 使用标准 logging，而不是我们自定义的 logger，因为配置模块应该是最先加载的
@@ -37,6 +37,7 @@ def _load_config_with_env(path='config.yaml'):
         # 优先使用环境变量，否则使用默认值
         return os.getenv(env_var_name, default_value)
 
+    import yaml
     loader = yaml.SafeLoader
     loader.add_constructor('!ENV', env_constructor)
 
@@ -52,8 +53,24 @@ def _load_config_with_env(path='config.yaml'):
 
 
 # ---- 关键部分在这里 ----
-# 在模块被导入时，立即执行加载函数，并将结果存储在一个全局变量中
-# 这个代码块在整个应用的生命周期中只会执行一次！
-settings = _load_config_with_env(_config_file_path)
+# 配置在第一次访问 config.settings 时才加载, 只导入数据模型的工具和测试不必解析 YAML
+# 加载在整个应用的生命周期中只会执行一次！
+_settings_lock = threading.Lock()
 
-log.info("应用配置加载成功。")
\ No newline at end of file
+
+def get_settings():
+    """加载并缓存配置, 之后 config.settings 是普通的模块属性"""
+    global settings
+    with _settings_lock:
+        loaded = globals().get('settings')
+        if loaded is None:
+            loaded = settings = _load_config_with_env(_config_file_path)
+            log.info("应用配置加载成功。")
+        return loaded
+
+
+def __getattr__(name):
+    # 只在 settings 还不是模块属性时调用
+    if name == 'settings':
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
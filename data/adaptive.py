@@ -0,0 +1,66 @@
+"""
+自适应采样
+adaptive.py: 按键鼠活动调整窗口采样间隔
+- AdaptiveSampler: 有活动时按基础间隔采样, 连续空闲时每次采样后间隔翻倍, 直到上限;
+  空闲期间一出现键鼠活动就立刻恢复基础间隔
+"""
+import time
+
+
+class AdaptiveSampler:
+    """
+    调度器仍按基础间隔触发, 未到期的 tick 只做一次判断就返回。
+    到期时间对齐到当前间隔的整数倍, 间隔为 60 秒时每次采样都落在整分上。
+    每次采样的权重是距上一次采样的实际时长(取整到基础间隔), 供 WindowSorted 累加各项时间。
+    """
+    def __init__(self, base_second, max_second=60, activity=None):
+        """
+        :param base_second: 基础间隔, 即 data.collect.window_second
+        :param max_second: 空闲时的最长间隔
+        :param activity: 返回当前周期键鼠事件总数的函数(KeyMouseData.activityCounters),
+                         为 None 时始终按基础间隔采样
+        """
+        self.baseSecond = base_second
+        self.maxSecond = max(max_second, base_second)
+        self.activity = activity
+        self.interval = base_second
+        self._last_activity = 0
+        self._last_sample = None
+        self._due = 0.0
+
+    def _new_activity(self):
+        """上一次采样以来是否有键鼠事件; 计数在每个统计周期结束时清零"""
+        if self.activity is None:
+            return True
+        total = self.activity()
+        return total > self._last_activity or (total < self._last_activity and total > 0)
+
+    def due(self, now=None):
+        """本 tick 是否需要采样"""
+        now = time.time() if now is None else now
+        # 调度器的触发时间有毫秒级抖动, 提前半个基础间隔以内都算到期
+        if now >= self._due - self.baseSecond / 2:
+            return True
+        return self.interval > self.baseSecond and self._new_activity()
+
+    def begin(self, now=None):
+        """
+        开始一次采样, 更新下一次的间隔。
+        :return: 本次采样代表的秒数
+        """
+        now = time.time() if now is None else now
+        base = self.baseSecond
+        # 对齐到基础间隔的网格, 消除调度抖动
+        now = round(now / base) * base
+        if self._last_sample is None:
+            weight = base
+        else:
+            # 错过的 tick 和休眠恢复后的长间隔最多按 maxSecond 计
+            weight = min(max(now - self._last_sample, base), self.maxSecond)
+        active = self._new_activity()
+        if self.activity is not None:
+            self._last_activity = self.activity()
+        self.interval = base if active else min(self.interval * 2, self.maxSecond)
+        self._due = (int(now // self.interval) + 1) * self.interval
+        self._last_sample = now
+        return weight
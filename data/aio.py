@@ -0,0 +1,229 @@
+"""
+asyncio 运行时
+aio.py: 采集、整理和落库作为协程跑在同一个事件循环上, 取代 APScheduler 的任务线程
+- InputQueue: 键鼠钩子线程只把 (计数器, 前台 hwnd, 按键) 放进线程安全的队列, 由事件循环批量并入计数
+- AsyncCollectorRuntime: 事件循环在一个线程里运行, 周期任务对齐到整点边界;
+  窗口快照、SQLite 写入、汇总维护和指标文件等阻塞调用交给一个显式的小线程池
+与线程运行时相比不再需要调度器线程池、前台轮询线程和落库线程, 线程数固定为 1 + max_workers + 钩子线程。
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from data import counter
+from data import metrics
+from data.collect import click_slot
+from data.schedule import LatenessTracker, aligned_start
+
+log = logging.getLogger(__name__)
+
+
+class InputQueue:
+    """
+    钩子回调只做一次入队, 不碰计数数组, 计数只在事件循环上修改。
+    事件携带入队时的前台 hwnd, 延后并入不会把事件记到切换后的窗口上。
+    """
+    def __init__(self, km_datas):
+        self.kmDatas = km_datas
+        self.foreground = km_datas.foreground
+        self._queue = queue.SimpleQueue()
+
+    def start(self):
+        self.kmDatas.backend.start_input_listeners(
+            on_press=self.key_on_press,
+            on_move=self.mouse_on_move,
+            on_click=self.mouse_on_click,
+            on_scroll=self.mouse_on_scroll)
+        self.kmDatas.listening = True
+
+    def stop(self):
+        if self.kmDatas.listening:
+            self.kmDatas.backend.stop_input_listeners()
+            self.kmDatas.listening = False
+
+    def drain(self):
+        """
+        把队列中的事件并入 KeyMouseData 的计数
+        :return: 本次并入的事件数
+        """
+        counters = self.kmDatas.counters
+        get = self._queue.get_nowait
+        drained = 0
+        while True:
+            try:
+                slot, hwnd, key = get()
+            except queue.Empty:
+                return drained
+            if slot == counter.KEY_PRESS:
+                counters.add_key(hwnd, key)
+            else:
+                counters.add(hwnd, slot)
+            drained += 1
+
+    # 钩子线程上的回调
+    def key_on_press(self, key):
+        self._queue.put((counter.KEY_PRESS, self.foreground.hwnd, key))
+
+    def mouse_on_move(self, x, y):
+        self._queue.put((counter.MOUSE_MOVE, self.foreground.hwnd, None))
+
+    def mouse_on_click(self, x, y, button, pressed):
+        if pressed:
+            self._queue.put((click_slot(button), self.foreground.hwnd, None))
+
+    def mouse_on_scroll(self, x, y, dx, dy):
+        self._queue.put((counter.MOUSE_SCROLL, self.foreground.hwnd, None))
+
+
+class AsyncCollectorRuntime:
+    """
+    周期任务与 SchedulerRuntime 的语义一致: 对齐到整点边界, 迟到超过间隔的 misfire_grace_ratio 时跳过这一次,
+    积压的多次执行合并为一次, 同一任务不并发。
+    """
+    def __init__(self, win_datas, km_datas, sorted_datas, rollup=None, rollup_minutes=10, exporter=None,
+                 max_workers=2, input_drain_ms=100, misfire_grace_ratio=0.5):
+        """
+        :param win_datas: WindowsData
+        :param km_datas: KeyMouseData, 钩子事件经 InputQueue 并入
+        :param sorted_datas: SortedDatas, 不应带 writer, 落库在线程池中同步执行
+        :param rollup: RollupEngine, 为 None 时不做汇总维护
+        :param exporter: MetricsExporter, 不启动它的线程, 由事件循环按其间隔调用 write
+        :param max_workers: 执行阻塞调用的线程数
+        :param input_drain_ms: 把钩子事件并入计数的间隔(毫秒)
+        """
+        self.winDatas = win_datas
+        self.kmDatas = km_datas
+        self.sortedDatas = sorted_datas
+        self.foreground = win_datas.foreground
+        self.rollup = rollup
+        self.rollupMinutes = rollup_minutes
+        self.exporter = exporter
+        self.maxWorkers = max(int(max_workers), 1)
+        self.drainSecond = max(input_drain_ms, 10) / 1000
+        self.misfireGraceRatio = misfire_grace_ratio
+        self.inputs = InputQueue(km_datas)
+        self._lateness = LatenessTracker()
+        self._executor = None
+        self._loop = None
+        self._stopping = None
+        self._thread = None
+        self._started = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def lateness(self):
+        """:return: {job_id: {"last_ms", "max_ms"}}"""
+        return self._lateness.report()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(self.maxWorkers, thread_name_prefix="collector-io")
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run, name="collector-loop", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        self.inputs.start()
+
+    def stop(self):
+        """停止各周期任务, 把未满一个周期的数据落库后关闭事件循环和线程池"""
+        if self._thread is None:
+            return
+        self.inputs.stop()
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join()
+        self._thread = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def _run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop.set_default_executor(self._executor)
+        self._stopping = asyncio.Event()
+        self.foreground.start(own_thread=False)
+        self._started.set()
+
+        second = self.winDatas.second
+        # 与线程运行时相同: 在整分前半个采集间隔落库, 每个周期正好包含同一个 whichMinute 的 tick
+        jobs = [
+            self._every("window_collect", second, self._collect),
+            self._every("merge_data", self.sortedDatas.minute * 60, self._flush, offset=-second / 2),
+            self._every("foreground", self.foreground.pollSecond, self._refresh_foreground, track=False),
+            self._every("input_drain", self.drainSecond, self._drain, track=False),
+        ]
+        if self.rollup is not None:
+            jobs.append(self._every("rollup", self.rollupMinutes * 60, self._blocking(self.rollup.run)))
+        if self.exporter is not None:
+            jobs.append(self._every("metrics_export", self.exporter.interval, self._blocking(self.exporter.write)))
+        tasks = [asyncio.create_task(job) for job in jobs]
+
+        await self._stopping.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await self._flush()
+        except Exception as e:
+            log.warning(f"停止时落库失败: {e}")
+        self.foreground.stop()
+
+    async def _every(self, job_id, period, func, offset=0.0, track=True):
+        """
+        每 period 秒执行一次 await func(), 对齐到整点边界后偏移 offset 秒。
+        :param track: 是否记录开始延迟; 亚秒级的轮询任务不记录
+        """
+        grace = max(period * self.misfireGraceRatio, 0.05)
+        due = aligned_start(period, offset).timestamp()
+        while True:
+            delay = due - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = time.time()
+            lateness = now - due
+            if lateness > grace:
+                if track:
+                    log.warning(f"定时任务 {job_id} 错过了 {due:.3f} 的执行")
+                    metrics.inc("scheduler_misfires_total", labels={"job": job_id})
+            else:
+                if track:
+                    self._lateness.record(job_id, lateness)
+                try:
+                    await func()
+                except Exception as e:
+                    log.warning(f"定时任务 {job_id} 执行失败: {e}")
+            # 积压的多次执行合并为一次, 下一次对齐到当前时间之后的边界
+            due += period
+            now = time.time()
+            if due <= now:
+                due += ((now - due) // period + 1) * period
+
+    def _blocking(self, func):
+        async def run():
+            await self._loop.run_in_executor(self._executor, func)
+        return run
+
+    async def _collect(self):
+        # 快照在线程池中采样, 并入统计在事件循环上进行
+        windows = await self._loop.run_in_executor(self._executor, self.winDatas.snapshot_windows)
+        if windows is not None:
+            self.winDatas.update_window_infos(windows)
+
+    async def _flush(self):
+        self.inputs.drain()
+        windows = self.sortedDatas.take_period()
+        if windows is not None:
+            await self._loop.run_in_executor(self._executor, self.sortedDatas.store, windows)
+
+    async def _refresh_foreground(self):
+        self.foreground.refresh()
+
+    async def _drain(self):
+        self.inputs.drain()
@@ -0,0 +1,162 @@
+"""
+音频会话
+audio.py: 查询正在播放/录制音频的进程
+- AudioSessions: 一次枚举的结果, 播放与录制的 pid 及其父进程 pid
+- AudioSessionProvider: Windows 实现, COM 每个线程只初始化一次, 会话管理器常驻, 结果按 ttl 缓存
+- FakeAudioProvider: 不依赖声卡的实现, 用于测试和基准
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# AudioSessionStateActive
+_SESSION_ACTIVE = 1
+
+
+class AudioSessions:
+    def __init__(self):
+        # 播放 (Render)
+        self.mediaPids = set()
+        self.mediaPpids = set()
+        # 录制 (Capture/Microphone)
+        self.microPids = set()
+        self.microPpids = set()
+
+
+class AudioSessionProvider:
+    """
+    播放和录制会话在一次调用中枚举, ttl 内的重复调用直接返回缓存结果。
+    COM 对象属于创建它的线程, 所以初始化状态和会话管理器都按线程保存。
+    """
+    def __init__(self, parent_pid, ttl_ms=2000):
+        """
+        :param parent_pid: pid -> 父进程 pid 的函数, 查不到时返回 0
+        :param ttl_ms: 结果缓存时间(毫秒), 0 表示每次都重新枚举
+        """
+        self._parent_pid = parent_pid
+        self.ttlSecond = ttl_ms / 1000
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cached = None
+        self._cached_at = 0.0
+        # pid -> ppid, 只保留上一次枚举中仍在使用音频的 pid
+        self._ppids = {}
+        self.enumerations = 0
+
+    def get_sessions(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._cached is not None and now - self._cached_at < self.ttlSecond:
+                return self._cached
+            try:
+                sessions = self._collect(self._enumerate())
+            except Exception as e:
+                # 默认设备变化等情况会让缓存的会话管理器失效, 下次重新激活
+                log.log(1, f"enumerate audio sessions failed: {e}")
+                self.invalidate()
+                sessions = self._cached if self._cached is not None else AudioSessions()
+            self._cached = sessions
+            self._cached_at = now
+            self.enumerations += 1
+            return sessions
+
+    def invalidate(self):
+        """丢弃当前线程的会话管理器和缓存结果"""
+        self._local.managers = None
+        self._cached = None
+
+    def _collect(self, active_sessions):
+        sessions = AudioSessions()
+        ppids = {}
+        for pid, capture in active_sessions:
+            pids, parents = (sessions.microPids, sessions.microPpids) if capture \
+                else (sessions.mediaPids, sessions.mediaPpids)
+            pids.add(pid)
+            ppid = ppids.get(pid)
+            if ppid is None:
+                ppid = self._ppids.get(pid)
+                if ppid is None:
+                    ppid = self._parent_pid(pid)
+                ppids[pid] = ppid
+            if ppid != 0:
+                parents.add(ppid)
+        self._ppids = ppids
+        return sessions
+
+    def _managers(self):
+        managers = getattr(self._local, 'managers', None)
+        if managers is not None:
+            return managers
+        import comtypes
+        from comtypes import CoInitialize
+        from pycaw.pycaw import AudioUtilities, IAudioSessionManager2
+
+        if not getattr(self._local, 'com_initialized', False):
+            CoInitialize()
+            self._local.com_initialized = True
+        managers = {}
+        for capture, devices in ((False, AudioUtilities.GetSpeakers()), (True, AudioUtilities.GetMicrophone())):
+            if not devices:
+                continue
+            interface = devices.Activate(IAudioSessionManager2._iid_, comtypes.CLSCTX_ALL, None)
+            managers[capture] = interface.QueryInterface(IAudioSessionManager2)
+        self._local.managers = managers
+        return managers
+
+    def _enumerate(self):
+        """返回活动会话 [(pid, capture), ...]"""
+        from pycaw.pycaw import IAudioSessionControl2
+
+        active_sessions = []
+        for capture, manager in self._managers().items():
+            enumerator = manager.GetSessionEnumerator()
+            for i in range(enumerator.GetCount()):
+                session = enumerator.GetSession(i)
+                if not session:
+                    continue
+                control = session.QueryInterface(IAudioSessionControl2)
+                if control.GetState() != _SESSION_ACTIVE:
+                    continue
+                pid = control.GetProcessId()
+                if pid != 0:  # 排除系统声音等没有明确PID的会话
+                    active_sessions.append((pid, capture))
+        return active_sessions
+
+    def close(self):
+        """释放当前线程的 COM 资源"""
+        self._local.managers = None
+        if getattr(self._local, 'com_initialized', False):
+            from comtypes import CoUninitialize
+            CoUninitialize()
+            self._local.com_initialized = False
+
+
+class FakeAudioProvider(AudioSessionProvider):
+    """
+    假的音频会话: 会话列表由调用方设置, 其余缓存与父进程逻辑与真实实现相同。
+    """
+    def __init__(self, sessions=(), parents=None, ttl_ms=0):
+        """
+        :param sessions: [(pid, capture), ...] 活动会话
+        :param parents: {pid: ppid}
+        """
+        parents = dict(parents or {})
+        super().__init__(parent_pid=lambda pid: parents.get(pid, 0), ttl_ms=ttl_ms)
+        self._sessions = list(sessions)
+        self._parents = parents
+
+    def set_sessions(self, sessions, parents=None):
+        with self._lock:
+            self._sessions = list(sessions)
+            if parents is not None:
+                self._parents.clear()
+                self._parents.update(parents)
+            self._cached = None
+
+    def _enumerate(self):
+        return list(self._sessions)
+
+    def close(self):
+        pass
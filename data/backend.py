@@ -0,0 +1,742 @@
+"""
+平台后端
+backend.py: 把窗口枚举、前台窗口、音频会话、进程采样和键鼠钩子从采集逻辑中剥离出来
+- PlatformBackend: 后端接口, collect.py 只通过它访问平台
+- WindowsBackend: 基于 win32gui/pycaw/pynput/psutil 的真实实现
+- X11Backend: Linux 桌面(X11 / XWayland)上基于 python-xlib/pynput 的真实实现, 进程采样默认读 /proc
+- SyntheticBackend: 确定性的合成负载(N 个窗口, M 个进程, 每秒 K 个键鼠事件), 用于压测
+- RecordingBackend/ReplayBackend: 录制真实负载为轨迹文件, 并在任意平台上回放
+"""
+import importlib.util
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from data import metrics
+from data.audio import AudioSessionProvider, AudioSessions, FakeAudioProvider
+
+log = logging.getLogger(__name__)
+
+# 鼠标按键, 由后端把平台相关的按键对象归一成这三个值
+BUTTON_LEFT = "left"
+BUTTON_RIGHT = "right"
+BUTTON_OTHER = "other"
+
+# 进程采样结果的字段, 所有后端返回同样结构的 dict
+PROCESS_SAMPLE_FIELDS = (
+    'pid', 'name', 'exe', 'username', 'create_time', 'status',
+    'rss', 'vms', 'peak_wset', 'num_page_faults', 'memory_percent',
+    'read_count', 'write_count', 'read_bytes', 'write_bytes',
+)
+
+
+class ProcessUnavailable(Exception):
+    """进程已消失或无权访问, 属于预期内的情况"""
+
+
+class PlatformBackend:
+    """
+    平台后端接口。
+    窗口句柄、进程 id 均为 int; 键鼠回调签名与 pynput 保持一致,
+    只是 on_click 的 button 被归一为 BUTTON_LEFT/BUTTON_RIGHT/BUTTON_OTHER。
+    """
+    name = "base"
+
+    def get_all_windows(self):
+        """返回所有可见且有标题的窗口 [(hwnd, title), ...]"""
+        raise NotImplementedError
+
+    def get_foreground_window(self):
+        """返回当前前台窗口的 hwnd"""
+        raise NotImplementedError
+
+    def get_window_pids(self, hwnd):
+        """返回窗口所属的进程 id 元组"""
+        raise NotImplementedError
+
+    def get_audio_sessions(self):
+        """
+        :return: AudioSessions, 正在播放/录制音频的 pid 及其父进程 pid
+        """
+        raise NotImplementedError
+
+    def sample_process(self, pid, with_static=True):
+        """
+        采样单个进程, 返回包含 PROCESS_SAMPLE_FIELDS 的 dict。
+        with_static=False 时调用方已缓存 name/exe/username, 后端可以省略这三个字段,
+        但 create_time 必须返回, 用于识别 pid 复用。
+        进程不存在或无权访问时抛出 ProcessUnavailable。
+        """
+        raise NotImplementedError
+
+    def sample_processes(self, requests):
+        """
+        批量采样, 默认逐个调用 sample_process, 有批量读取能力的后端可以覆盖。
+        :param requests: [(pid, with_static), ...]
+        :return: {pid: sample}, 已消失或无权访问的进程不出现在结果中
+        """
+        samples = {}
+        for pid, with_static in requests:
+            try:
+                samples[pid] = self.sample_process(pid, with_static)
+            except ProcessUnavailable:
+                log.log(1, f"Process with PID {pid} no longer exists or access is denied. Skipping.")
+        return samples
+
+    def probe_processes(self, pids):
+        """
+        变化检测用的轻量探测, 只读取识别进程和判断变化所需的字段。
+        默认退化为不含静态属性的完整采样, 有更便宜读取方式的后端可以覆盖。
+        :return: {pid: (create_time, rss)}, 已消失或无权访问的进程不出现在结果中
+        """
+        samples = self.sample_processes([(pid, False) for pid in pids])
+        return {pid: (sample['create_time'], sample['rss']) for pid, sample in samples.items()}
+
+    def start_input_listeners(self, on_press, on_move, on_click, on_scroll):
+        """启动键鼠监听"""
+        raise NotImplementedError
+
+    def stop_input_listeners(self):
+        """停止键鼠监听"""
+        raise NotImplementedError
+
+
+class PsutilProcessSampler:
+    """
+    基于 psutil 的进程采样, 只读取所有平台都有的字段, Windows 独有字段缺失时记为 0。
+    所有属性在一个 oneshot() 块里读取, 底层系统调用只做一次。
+    """
+
+    def __init__(self):
+        import psutil
+        self._psutil = psutil
+
+    def _optional(self, getter):
+        # 与 as_dict 一致: 单个属性无权访问时记为 None, 不丢弃整个进程
+        try:
+            return getter()
+        except self._psutil.AccessDenied:
+            return None
+
+    def sample(self, pid, with_static=True):
+        psutil = self._psutil
+        try:
+            ps = psutil.Process(pid)
+            with ps.oneshot():
+                mem_info = ps.memory_info()
+                sample = {
+                    'pid': pid,
+                    'create_time': ps.create_time(),
+                    'status': ps.status(),
+                    'rss': mem_info.rss,
+                    'vms': mem_info.vms,
+                    'peak_wset': getattr(mem_info, 'peak_wset', 0),
+                    'num_page_faults': getattr(mem_info, 'num_page_faults', 0),
+                    'memory_percent': ps.memory_percent(),
+                }
+                io_info = self._optional(ps.io_counters)
+                sample['read_count'] = getattr(io_info, 'read_count', 0)
+                sample['write_count'] = getattr(io_info, 'write_count', 0)
+                sample['read_bytes'] = getattr(io_info, 'read_bytes', 0)
+                sample['write_bytes'] = getattr(io_info, 'write_bytes', 0)
+                if with_static:
+                    sample['name'] = ps.name()
+                    sample['exe'] = self._optional(ps.exe)
+                    sample['username'] = self._optional(ps.username)
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess) as e:
+            raise ProcessUnavailable(pid) from e
+        return sample
+
+    def sample_many(self, requests):
+        samples = {}
+        for pid, with_static in requests:
+            try:
+                samples[pid] = self.sample(pid, with_static)
+            except ProcessUnavailable:
+                log.log(1, f"Process with PID {pid} no longer exists or access is denied. Skipping.")
+        return samples
+
+    def probe_many(self, pids):
+        """:return: {pid: (create_time, rss)}, 只读取内存信息"""
+        psutil = self._psutil
+        probes = {}
+        for pid in pids:
+            try:
+                ps = psutil.Process(pid)
+                probes[pid] = (ps.create_time(), ps.memory_info().rss)
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                log.log(1, f"Process with PID {pid} no longer exists or access is denied. Skipping.")
+        return probes
+
+    def parent_pid(self, pid):
+        try:
+            return self._psutil.Process(pid).ppid()
+        except (self._psutil.NoSuchProcess, self._psutil.AccessDenied, self._psutil.ZombieProcess):
+            return 0
+
+
+class _NativeBackend(PlatformBackend):
+    """真实平台后端的公共部分: 进程采样交给采样器, 键鼠钩子使用 pynput"""
+
+    def __init__(self, sampler=None):
+        self.sampler = sampler or PsutilProcessSampler()
+        self._listeners = []
+
+    def sample_process(self, pid, with_static=True):
+        return self.sampler.sample(pid, with_static)
+
+    def sample_processes(self, requests):
+        return self.sampler.sample_many(requests)
+
+    def probe_processes(self, pids):
+        return self.sampler.probe_many(pids)
+
+    def start_input_listeners(self, on_press, on_move, on_click, on_scroll):
+        from pynput import mouse, keyboard
+
+        def click(x, y, button, pressed):
+            if button == mouse.Button.left:
+                button = BUTTON_LEFT
+            elif button == mouse.Button.right:
+                button = BUTTON_RIGHT
+            else:
+                button = BUTTON_OTHER
+            on_click(x, y, button, pressed)
+
+        self._listeners = [
+            mouse.Listener(on_move=on_move, on_click=click, on_scroll=on_scroll),
+            keyboard.Listener(on_press=on_press),
+        ]
+        for listener in self._listeners:
+            listener.start()
+
+    def stop_input_listeners(self):
+        for listener in self._listeners:
+            if listener.running:
+                listener.stop()
+        self._listeners = []
+
+
+class WindowsBackend(_NativeBackend):
+    """真实的 Windows 后端, 平台依赖只在构造时导入"""
+    name = "windows"
+
+    def __init__(self, sampler=None, audio_ttl_ms=2000):
+        import win32gui
+        import win32process
+        super().__init__(sampler)
+        self._win32gui = win32gui
+        self._win32process = win32process
+        self.audio = AudioSessionProvider(self.sampler.parent_pid, ttl_ms=audio_ttl_ms)
+
+    def get_all_windows(self):
+        win32gui = self._win32gui
+        hwnd_list = []
+
+        # EnumWindows函数需要一个回调函数作为参数
+        # 这个回调函数被调用时，会传入两个参数：窗口句柄(hwnd)和自定义参数(lParam)
+        def callback(hwnd, lParam):
+            # IsWindowVisible判断窗口是否可见
+            # GetWindowText获取窗口标题
+            if win32gui.IsWindowVisible(hwnd):
+                title = win32gui.GetWindowText(hwnd)
+                if title:
+                    hwnd_list.append((hwnd, title))
+            return True  # 返回True以继续枚举下一个窗口
+
+        win32gui.EnumWindows(callback, None)
+        return hwnd_list
+
+    def get_foreground_window(self):
+        return self._win32gui.GetForegroundWindow()
+
+    def get_window_pids(self, hwnd):
+        # GetWindowThreadProcessId 返回 (线程id, 进程id), 线程id 不是进程
+        _, pid = self._win32process.GetWindowThreadProcessId(hwnd)
+        return (pid,)
+
+    def get_audio_sessions(self):
+        return self.audio.get_sessions()
+
+
+class X11Backend(_NativeBackend):
+    """
+    Linux 桌面后端, 窗口信息来自窗口管理器维护的 EWMH 属性:
+    _NET_CLIENT_LIST(窗口列表), _NET_ACTIVE_WINDOW(前台窗口), _NET_WM_PID(所属进程), _NET_WM_NAME(标题)。
+    hwnd 为 X 窗口 id。Display 连接不是线程安全的, 采集线程与前台轮询线程通过一把锁共用。
+    Linux 上没有对应 pycaw 的音频会话接口, 音频/麦克风时间记为 0。
+    """
+    name = "x11"
+
+    def __init__(self, sampler=None, display=None):
+        """
+        :param display: X 显示名, 为 None 时使用环境变量 DISPLAY
+        """
+        from Xlib import X, display as xdisplay, error as xerror
+        super().__init__(sampler or create_sampler('procfs'))
+        self._X = X
+        self._errors = (xerror.XError,)
+        self._display = xdisplay.Display(display)
+        self._root = self._display.screen().root
+        self._lock = threading.Lock()
+        intern = self._display.intern_atom
+        self._client_list = intern('_NET_CLIENT_LIST')
+        self._active_window = intern('_NET_ACTIVE_WINDOW')
+        self._wm_pid = intern('_NET_WM_PID')
+        self._wm_name = intern('_NET_WM_NAME')
+        self._utf8 = intern('UTF8_STRING')
+
+    def _property(self, window, atom, kind=None):
+        prop = window.get_full_property(atom, self._X.AnyPropertyType if kind is None else kind)
+        return prop.value if prop is not None else None
+
+    def _window(self, hwnd):
+        return self._display.create_resource_object('window', hwnd)
+
+    def _title(self, window):
+        title = self._property(window, self._wm_name, self._utf8)
+        if title:
+            return title.decode('utf-8', 'replace') if isinstance(title, bytes) else title
+        # 不支持 EWMH 标题的旧程序只有 WM_NAME
+        title = window.get_wm_name()
+        return title.decode('latin-1') if isinstance(title, bytes) else title
+
+    def get_all_windows(self):
+        hwnd_list = []
+        with self._lock:
+            hwnds = self._property(self._root, self._client_list) or ()
+            for hwnd in hwnds:
+                try:
+                    title = self._title(self._window(hwnd))
+                except self._errors:
+                    # 枚举期间窗口已关闭
+                    continue
+                if title:
+                    hwnd_list.append((int(hwnd), title))
+        return hwnd_list
+
+    def get_foreground_window(self):
+        with self._lock:
+            value = self._property(self._root, self._active_window)
+        return int(value[0]) if value else 0
+
+    def get_window_pids(self, hwnd):
+        with self._lock:
+            try:
+                value = self._property(self._window(hwnd), self._wm_pid)
+            except self._errors:
+                return ()
+        return (int(value[0]),) if value else ()
+
+    def get_audio_sessions(self):
+        return AudioSessions()
+
+
+class SyntheticBackend(PlatformBackend):
+    """
+    确定性的合成后端, 相同参数和种子产生完全相同的负载。
+    每次 get_all_windows 视为一个 tick, 窗口标题、前台窗口和进程指标随 tick 推进而变化。
+    """
+    name = "synthetic"
+
+    # 合成事件的构成比例: 移动/按键/点击/滚轮
+    EVENT_MIX = (("move", 0.70), ("press", 0.20), ("click", 0.07), ("scroll", 0.03))
+    KEYS = tuple("'%s'" % c for c in "abcdefghijklmnopqrstuvwxyz0123456789") + (
+        "Key.space", "Key.enter", "Key.backspace", "Key.shift", "Key.ctrl_l", "Key.tab")
+
+    def __init__(self, windows=30, processes=100, events_per_second=0, seed=0, pids_per_window=1):
+        self.windowCount = max(int(windows), 1)
+        self.processCount = max(int(processes), 1)
+        # 每个窗口关联的进程数, 大于 1 时窗口之间错开, 可以让 N 个窗口覆盖 M>N 个进程
+        self.pidsPerWindow = max(int(pids_per_window), 1)
+        self.eventsPerSecond = max(int(events_per_second), 0)
+        self.seed = seed
+        self._tick = 0
+        self._rng = random.Random(seed)
+        self._event_rng = random.Random(seed + 1)
+        self._base_pid = 1000
+        self._hwnds = [0x10000 + i * 4 for i in range(self.windowCount)]
+        self._window_pids = {
+            hwnd: tuple(self._base_pid + (i * self.pidsPerWindow + j) % self.processCount
+                        for j in range(self.pidsPerWindow))
+            for i, hwnd in enumerate(self._hwnds)
+        }
+        # 每个进程的初始内存与 io 速率, 由种子决定
+        self._process_base = {}
+        for i in range(self.processCount):
+            pid = self._base_pid + i
+            self._process_base[pid] = (
+                self._rng.randint(8, 800) * 1024 * 1024,
+                self._rng.randint(1, 50),
+                1_700_000_000.0 + self._rng.randint(0, 86400),
+            )
+        self._listener_thread = None
+        self._listener_stop = threading.Event()
+        self._callbacks = None
+        # 每 10 个进程有一个在播放, 每 25 个进程有一个在录制, 父进程都是第一个进程
+        sessions = [(pid, capture) for capture, step in ((False, 10), (True, 25))
+                    for pid in self._process_base if (pid - self._base_pid) % step == 0]
+        self.audio = FakeAudioProvider(sessions, parents={pid: self._base_pid for pid, _ in sessions})
+
+    @property
+    def pids(self):
+        return list(self._process_base)
+
+    def get_all_windows(self):
+        self._tick += 1
+        tick = self._tick
+        return [(hwnd, "Synthetic Window %d - doc %d" % (i, tick // (5 + i % 11)))
+                for i, hwnd in enumerate(self._hwnds)]
+
+    def get_foreground_window(self):
+        return self._hwnds[(self._tick // 3) % self.windowCount]
+
+    def get_window_pids(self, hwnd):
+        return self._window_pids.get(hwnd, ())
+
+    def get_audio_sessions(self):
+        return self.audio.get_sessions()
+
+    def sample_process(self, pid, with_static=True):
+        base = self._process_base.get(pid)
+        if base is None:
+            raise ProcessUnavailable(pid)
+        rss, io_rate, create_time = base
+        tick = self._tick
+        rss += (tick * io_rate * 4096) % (64 * 1024 * 1024)
+        index = pid - self._base_pid
+        return {
+            'pid': pid,
+            'name': "synthetic_%d.exe" % (index % 40),
+            'exe': "C:\\Synthetic\\synthetic_%d.exe" % (index % 40),
+            'username': "synthetic",
+            'create_time': create_time,
+            'status': "running" if tick % 7 else "sleeping",
+            'rss': rss,
+            'vms': rss * 2,
+            'peak_wset': rss + 1024 * 1024,
+            'num_page_faults': tick * io_rate * 10,
+            'memory_percent': rss / (16 * 1024 ** 3) * 100,
+            'read_count': tick * io_rate,
+            'write_count': tick * io_rate // 2,
+            'read_bytes': tick * io_rate * 4096,
+            'write_bytes': tick * io_rate * 2048,
+        }
+
+    def probe_processes(self, pids):
+        probes = {}
+        tick = self._tick
+        for pid in pids:
+            base = self._process_base.get(pid)
+            if base is not None:
+                rss, io_rate, create_time = base
+                probes[pid] = (create_time, rss + (tick * io_rate * 4096) % (64 * 1024 * 1024))
+        return probes
+
+    def emit_events(self, count, on_press, on_move, on_click, on_scroll):
+        """同步产生 count 个事件, 基准测试可以直接驱动回调而不经过线程"""
+        rng = self._event_rng
+        keys = self.KEYS
+        for _ in range(count):
+            r = rng.random()
+            if r < 0.70:
+                on_move(rng.randint(0, 1920), rng.randint(0, 1080))
+            elif r < 0.90:
+                on_press(keys[rng.randrange(len(keys))])
+            elif r < 0.97:
+                button = (BUTTON_LEFT, BUTTON_LEFT, BUTTON_RIGHT, BUTTON_OTHER)[rng.randrange(4)]
+                on_click(0, 0, button, True)
+                on_click(0, 0, button, False)
+            else:
+                on_scroll(0, 0, 0, rng.choice((-1, 1)))
+
+    def start_input_listeners(self, on_press, on_move, on_click, on_scroll):
+        self._callbacks = (on_press, on_move, on_click, on_scroll)
+        if not self.eventsPerSecond:
+            return
+        self._listener_stop.clear()
+        self._listener_thread = threading.Thread(target=self._run_events, name="synthetic-input", daemon=True)
+        self._listener_thread.start()
+
+    def _run_events(self):
+        # 每 10ms 发出一批事件, 按累计误差补齐, 保证长期速率为 eventsPerSecond
+        interval = 0.01
+        started = time.monotonic()
+        emitted = 0
+        batch = 0
+        while True:
+            batch += 1
+            scheduled = started + batch * interval
+            if self._listener_stop.wait(max(scheduled - time.monotonic(), 0)):
+                return
+            due = int((time.monotonic() - started) * self.eventsPerSecond) - emitted
+            if due > 0:
+                self.emit_events(due, *self._callbacks)
+                emitted += due
+            # 钩子延迟: 本批事件应当发出的时间到回调全部返回, 钩子线程抢不到 GIL 时变长
+            now = time.monotonic()
+            metrics.observe("synthetic", now - scheduled, name="hook_latency_seconds")
+            # 落后时不补发空批次, 从当前时间重新对齐
+            batch = max(batch, int((now - started) / interval))
+
+    def stop_input_listeners(self):
+        self._listener_stop.set()
+        if self._listener_thread is not None:
+            self._listener_thread.join()
+            self._listener_thread = None
+
+
+class RecordingBackend(PlatformBackend):
+    """
+    包装另一个后端, 把每次调用的结果按行写入 NDJSON 轨迹文件, 供 ReplayBackend 回放。
+    """
+    name = "recording"
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+        self._started = time.monotonic()
+
+    def _record(self, op, result, **extra):
+        entry = {"op": op, "t": round(time.monotonic() - self._started, 4), "result": result}
+        entry.update(extra)
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def get_all_windows(self):
+        windows = self.inner.get_all_windows()
+        self._record("windows", [list(w) for w in windows])
+        return windows
+
+    def get_foreground_window(self):
+        hwnd = self.inner.get_foreground_window()
+        self._record("foreground", hwnd)
+        return hwnd
+
+    def get_window_pids(self, hwnd):
+        pids = self.inner.get_window_pids(hwnd)
+        self._record("pids", list(pids), hwnd=hwnd)
+        return pids
+
+    def get_audio_sessions(self):
+        sessions = self.inner.get_audio_sessions()
+        self._record("audio", [sorted(sessions.mediaPids), sorted(sessions.mediaPpids),
+                               sorted(sessions.microPids), sorted(sessions.microPpids)])
+        return sessions
+
+    def sample_process(self, pid, with_static=True):
+        # 录制时总是采集完整字段, 回放端不依赖调用方的缓存
+        try:
+            sample = self.inner.sample_process(pid)
+        except ProcessUnavailable:
+            self._record("process", None, pid=pid)
+            raise
+        self._record("process", sample, pid=pid)
+        return sample
+
+    def start_input_listeners(self, on_press, on_move, on_click, on_scroll):
+        def press(key):
+            self._record("event", ["press", str(key)])
+            on_press(key)
+
+        def move(x, y):
+            self._record("event", ["move", x, y])
+            on_move(x, y)
+
+        def click(x, y, button, pressed):
+            self._record("event", ["click", x, y, button, pressed])
+            on_click(x, y, button, pressed)
+
+        def scroll(x, y, dx, dy):
+            self._record("event", ["scroll", x, y, dx, dy])
+            on_scroll(x, y, dx, dy)
+
+        self.inner.start_input_listeners(press, move, click, scroll)
+
+    def stop_input_listeners(self):
+        self.inner.stop_input_listeners()
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ReplayBackend(PlatformBackend):
+    """
+    回放 RecordingBackend 录制的轨迹。
+    每种调用各自按录制顺序取值, 轨迹耗尽后从头循环(loop=True)或一直返回最后一个值。
+    键鼠事件按录制时的时间间隔除以 speed 回放。
+    """
+    name = "replay"
+
+    def __init__(self, path, speed=1.0, loop=True):
+        self.speed = speed if speed and speed > 0 else 1.0
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._cursors = {}
+        self._events = []
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                op = entry["op"]
+                if op == "event":
+                    self._events.append((entry["t"], entry["result"]))
+                    continue
+                if op == "pids":
+                    key = (op, entry["hwnd"])
+                elif op == "process":
+                    key = (op, entry["pid"])
+                else:
+                    key = (op,)
+                self._entries.setdefault(key, []).append(entry["result"])
+        self._listener_thread = None
+        self._listener_stop = threading.Event()
+
+    def _next(self, key, default):
+        values = self._entries.get(key)
+        if not values:
+            return default
+        with self._lock:
+            cursor = self._cursors.get(key, 0)
+            if cursor >= len(values):
+                cursor = 0 if self.loop else len(values) - 1
+            self._cursors[key] = cursor + 1
+        return values[cursor]
+
+    def get_all_windows(self):
+        return [tuple(w) for w in self._next(("windows",), [])]
+
+    def get_foreground_window(self):
+        return self._next(("foreground",), 0)
+
+    def get_window_pids(self, hwnd):
+        return tuple(self._next(("pids", hwnd), ()))
+
+    def get_audio_sessions(self):
+        sessions = AudioSessions()
+        media_pids, media_ppids, micro_pids, micro_ppids = self._next(("audio",), ([], [], [], []))
+        sessions.mediaPids.update(media_pids)
+        sessions.mediaPpids.update(media_ppids)
+        sessions.microPids.update(micro_pids)
+        sessions.microPpids.update(micro_ppids)
+        return sessions
+
+    def sample_process(self, pid, with_static=True):
+        sample = self._next(("process", pid), None)
+        if sample is None:
+            raise ProcessUnavailable(pid)
+        return sample
+
+    def start_input_listeners(self, on_press, on_move, on_click, on_scroll):
+        if not self._events:
+            return
+        callbacks = {"press": on_press, "move": on_move, "click": on_click, "scroll": on_scroll}
+        self._listener_stop.clear()
+        self._listener_thread = threading.Thread(target=self._run_events, args=(callbacks,),
+                                                 name="replay-input", daemon=True)
+        self._listener_thread.start()
+
+    def _run_events(self, callbacks):
+        while True:
+            started = time.monotonic()
+            first = self._events[0][0]
+            for t, (kind, *args) in self._events:
+                delay = (t - first) / self.speed - (time.monotonic() - started)
+                if delay > 0 and self._listener_stop.wait(delay):
+                    return
+                if self._listener_stop.is_set():
+                    return
+                callbacks[kind](*args)
+            if not self.loop:
+                return
+
+    def stop_input_listeners(self):
+        self._listener_stop.set()
+        if self._listener_thread is not None:
+            self._listener_thread.join()
+            self._listener_thread = None
+
+
+def create_sampler(name=None):
+    """
+    创建真实进程的采样器。
+    :param name: auto / psutil / procfs, auto 在 Linux 上使用 procfs, 其他平台使用 psutil
+    """
+    name = name or 'auto'
+    if name == 'auto':
+        name = 'procfs' if sys.platform.startswith('linux') else 'psutil'
+    if name == 'procfs':
+        from data.procfs import ProcfsProcessSampler
+        return ProcfsProcessSampler()
+    if name == 'psutil':
+        return PsutilProcessSampler()
+    raise ValueError(f"Unknown process sampler: {name}")
+
+
+def _auto_backend_name():
+    """
+    auto 只选择原生后端; 没有时直接报错, synthetic / replay 只在配置中显式指定时使用,
+    避免合成数据被当作真实活动写进数据库。
+    """
+    if sys.platform == 'win32':
+        return 'windows'
+    if sys.platform.startswith('linux') and os.environ.get('DISPLAY'):
+        if importlib.util.find_spec('Xlib') is not None:
+            return 'x11'
+        raise RuntimeError("没有安装 python-xlib, 无法使用 x11 后端; 请安装 python-xlib, "
+                           "或在 data.collect.backend.name 中显式指定后端")
+    raise RuntimeError(f"平台 {sys.platform} 没有原生后端(Linux 需要 X11 桌面, 即设置了 DISPLAY); "
+                       f"测试或压测请在 data.collect.backend.name 中显式指定 synthetic 或 replay")
+
+
+def create_backend(settings):
+    """根据配置 data.collect.backend 创建后端"""
+    backend_conf = (settings.get('data', {}).get('collect', {}) or {}).get('backend') or {}
+    name = backend_conf.get('name') or 'auto'
+    if name == 'auto':
+        name = _auto_backend_name()
+
+    if name == 'windows':
+        backend = WindowsBackend(sampler=create_sampler(backend_conf.get('process_sampler')),
+                                 audio_ttl_ms=backend_conf.get('audio_ttl_ms', 2000))
+    elif name == 'x11':
+        backend = X11Backend(sampler=create_sampler(backend_conf.get('process_sampler')))
+    elif name == 'synthetic':
+        backend = SyntheticBackend(**(backend_conf.get('synthetic') or {}))
+    elif name == 'replay':
+        replay_conf = backend_conf.get('replay') or {}
+        backend = ReplayBackend(replay_conf['trace'], speed=replay_conf.get('speed', 1.0),
+                                loop=replay_conf.get('loop', True))
+    else:
+        raise ValueError(f"Unknown backend: {name}")
+
+    record_path = backend_conf.get('record')
+    if record_path:
+        backend = RecordingBackend(backend, record_path)
+    return backend
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+def get_backend():
+    """进程内共享的默认后端, 第一次调用时按配置创建"""
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            from config import config
+            _default_backend = create_backend(config.settings)
+        return _default_backend
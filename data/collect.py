@@ -6,28 +6,31 @@ collect.py:采集基本信息，后续交由format.py整理
 - WindowsData:一个二维切片，一维切片为某一时刻各个窗口以及对应进程状态
 - KeyMouseData: 一个数字用于记录键鼠操作数量，一个切片将键鼠操作 对应到对应窗口
 """
-import atexit
 import logging
 
 import threading
 from datetime import datetime
 
-import comtypes
-from comtypes import  CoInitialize, CoUninitialize
-from pycaw.pycaw import AudioUtilities, IAudioSessionManager2, IAudioSessionControl2
-import win32gui
-from win32gui import GetForegroundWindow
-import win32process
-import psutil
-from pynput import mouse, keyboard
-
 from data import schedule
+from data import counter
+from data import metrics
+from data import backend as platform_backend
+from data.counter import InputCounters
+from data.foreground import ForegroundTracker
+from data.timeline import ActivityTimeline
 
 """
 按时统计窗口信息
 """
+# 采样被跳过的原因, 作为 processes_dropped_total 的标签
+_UNAVAILABLE = {"reason": "unavailable"}
+_ERROR = {"reason": "error"}
+
+
 # 进程信息
 class ProcessInfo:
+    __slots__ = ('pid', 'name', 'path', 'username', 'status', 'cpuUsage', 'startTime', 'memoryUsage',
+                 'ioUsage')
     def __init__(self):
         self.pid = None
         self.name = None
@@ -39,114 +42,215 @@ class ProcessInfo:
         self.memoryUsage = MemUsage()
         self.ioUsage = IOUsage()
 
+    @staticmethod
+    def from_sample(sample):
+        """由后端返回的采样 dict 构造 ProcessInfo"""
+        process_info = ProcessInfo()
+        process_info.pid = sample['pid']
+        process_info.name = sample['name']
+        process_info.path = sample['exe']
+        process_info.startTime = sample['create_time']
+        process_info.status = sample['status']
+        process_info.username = sample['username']
+
+        # memory_usage
+        process_info.memoryUsage.rss = sample['rss']
+        process_info.memoryUsage.vms = sample['vms']
+        process_info.memoryUsage.peakWSet = sample['peak_wset']
+        process_info.memoryUsage.numPageFault = sample['num_page_faults']
+        process_info.memoryUsage.memoryPercent = sample['memory_percent']
+
+        # io_usage
+        process_info.ioUsage.RCallNum = sample['read_count']
+        process_info.ioUsage.WCallNum = sample['write_count']
+        process_info.ioUsage.RByteNum = sample['read_bytes']
+        process_info.ioUsage.WByteNum = sample['write_bytes']
+        return process_info
+
     # 返回传入进程id列表 的进程状态列表
     @staticmethod
-    def collect_pids_info(pids):
+    def collect_pids_info(pids, backend):
         process_infos = []
         for pid in pids:
 
             try:
-                # 尝试获取进程对象
-                ps = psutil.Process(pid)
-
-                process = ps.as_dict(
-                    attrs=['pid', 'name', 'create_time', 'exe', 'io_counters', 'memory_info', 'memory_percent',
-                           'status', 'username'])
-                mem_info = process.get('memory_info')
-                io_info = process.get('io_counters')
-                process_info = ProcessInfo()
-                process_info.pid = process.get('pid')
-                process_info.name = process.get('name')
-                process_info.path = process.get('exe')
-                process_info.startTime = process.get('create_time')
-                process_info.status = process.get('status')
-                process_info.username = process.get('username')
-
-                # memory_usage
-                process_info.memoryUsage.rss = mem_info.rss
-                process_info.memoryUsage.vms = mem_info.vms
-                process_info.memoryUsage.peakWSet = mem_info.peak_wset
-                process_info.memoryUsage.numPageFault = mem_info.num_page_faults
-                process_info.memoryUsage.percent = process.get('memory_percent')
-
-                # io_usage
-                process_info.ioUsage.RCallNum = io_info.read_count
-                process_info.ioUsage.WCallNum = io_info.write_count
-                process_info.ioUsage.RByteNum = io_info.read_bytes
-                process_info.ioUsage.WByteNum = io_info.write_bytes
-
-                process_infos.append(process_info)
+                process_infos.append(ProcessInfo.from_sample(backend.sample_process(pid)))
 
             # 捕获所有可能在进程消失或无权访问时发生的异常
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            except platform_backend.ProcessUnavailable:
                 # 当进程在我们检查它之前就消失了，或者我们没有权限访问它
                 # 这是一种完全正常且预期内的情况，不是一个程序错误。
-                # 你可以选择静默处理，或者打印一条信息然后继续。
                 logging.log(1,f"Process with PID {pid} no longer exists or access is denied. Skipping.")
-                # 这里什么都不做，优雅地跳过这个已消失的进程。
+                metrics.inc("processes_dropped_total", labels=_UNAVAILABLE)
 
             except Exception as e:
                 # 捕获任何其他意料之外的错误，方便调试
                 logging.log(1,f"An unexpected error occurred while processing PID {pid}: {e}")
+                metrics.inc("processes_dropped_total", labels=_ERROR)
 
         return process_infos
 
 
 
+class ProcessSnapshot:
+    """
+    每个 tick 的进程快照: 同一 pid 在一个 tick 内只采样一次, 结果由所属的所有窗口共享。
+    name/exe/username 跨 tick 缓存, 以 (pid, create_time) 为键, pid 被复用时自然失效。
+    变化检测模式下先用 probe_processes 轻量探测, create_time 相同、rss 变化不超过阈值且完整采样
+    不超过 max_age_ticks 个 tick 的进程直接复用上一次的 ProcessInfo, 只完整采样其余进程。
+    """
+    def __init__(self, backend, max_idle_ticks=12, change_threshold=None, max_age_ticks=12):
+        """
+        :param change_threshold: rss 相对上一次完整采样的变化比例阈值, 为 None 时关闭变化检测
+        :param max_age_ticks: 变化检测模式下每个进程至少每隔这么多 tick 完整采样一次
+        """
+        self.backend = backend
+        self.changeThreshold = change_threshold
+        self.maxAgeTicks = max_age_ticks
+        # 超过 max_idle_ticks 个 tick 没见到的 pid, 从静态缓存里清掉
+        self.maxIdleTicks = max_idle_ticks
+        self._tick = 0
+        # pid -> ProcessInfo, 采样失败记为 None, 只在当前 tick 内有效
+        self._current = {}
+        # (pid, create_time) -> (name, exe, username)
+        self._static = {}
+        # pid -> (create_time, 最后一次见到的 tick)
+        self._known = {}
+        # 变化检测: pid -> (create_time, rss, 完整采样的 tick, ProcessInfo)
+        self._fingerprints = {}
+
+    def begin_tick(self):
+        self._tick += 1
+        self._current = {}
+
+    def end_tick(self):
+        metrics.inc("processes_total", len(self._current))
+        if self._tick % self.maxIdleTicks:
+            return
+        expired = [pid for pid, (_, seen) in self._known.items() if self._tick - seen > self.maxIdleTicks]
+        for pid in expired:
+            create_time, _ = self._known.pop(pid)
+            self._static.pop((pid, create_time), None)
+            self._fingerprints.pop(pid, None)
+
+    def prefetch(self, pids):
+        """一次批量采样本 tick 还没采样过的 pid, 后续 collect 直接命中"""
+        current = self._current
+        pending = [pid for pid in dict.fromkeys(pids) if pid not in current]
+        if pending and self.changeThreshold is not None:
+            pending = self._reuse_unchanged(pending)
+        if not pending:
+            return
+        known = self._known
+        try:
+            samples = self.backend.sample_processes([(pid, pid not in known) for pid in pending])
+        except Exception as e:
+            logging.log(1,f"An unexpected error occurred while sampling processes: {e}")
+            return
+        dropped = 0
+        for pid in pending:
+            sample = samples.get(pid)
+            if sample is None:
+                dropped += 1
+                current[pid] = None
+            else:
+                current[pid] = self._resolve(pid, sample)
+        if dropped:
+            metrics.inc("processes_dropped_total", dropped, labels=_UNAVAILABLE)
 
-
-    @staticmethod
-    def use_audio_process(capture=False):
+    def _reuse_unchanged(self, pids):
         """
-        获取所有正在使用音频的会话。
-        :param capture: False=播放 (Render), True=录制 (Capture/Microphone)
-        :return: 正在使用音频的进程PID列表
+        探测 pids, 没有变化的进程在本 tick 复用上一次的 ProcessInfo。
+        :return: 需要完整采样的 pid 列表
         """
-        active_pids = set()
-        active_ppids = set()
-        CoInitialize()
-        atexit.register(CoUninitialize)
-        # devices = AudioUtilities.GetSpeakers() # 获取默认播放设备
-        # 如果要检查麦克风，请使用 GetMicrophone()
-        if capture:
-            devices = AudioUtilities.GetMicrophone()
+        try:
+            probes = self.backend.probe_processes(pids)
+        except Exception as e:
+            logging.log(1,f"An unexpected error occurred while probing processes: {e}")
+            return pids
+        current = self._current
+        fingerprints = self._fingerprints
+        threshold = self.changeThreshold
+        oldest = self._tick - self.maxAgeTicks
+        changed = []
+        dropped = 0
+        for pid in pids:
+            probe = probes.get(pid)
+            if probe is None:
+                current[pid] = None
+                dropped += 1
+                continue
+            fingerprint = fingerprints.get(pid)
+            if (fingerprint is not None and fingerprint[0] == probe[0] and fingerprint[2] > oldest
+                    and abs(probe[1] - fingerprint[1]) <= fingerprint[1] * threshold):
+                current[pid] = fingerprint[3]
+                self._known[pid] = (probe[0], self._tick)
+            else:
+                changed.append(pid)
+        if dropped:
+            metrics.inc("processes_dropped_total", dropped, labels=_UNAVAILABLE)
+        metrics.inc("processes_unchanged_total", len(pids) - len(changed) - dropped)
+        return changed
+
+    def collect(self, pids):
+        """返回 pids 对应的 ProcessInfo 列表, 已在本 tick 采样过的 pid 直接复用"""
+        process_infos = []
+        current = self._current
+        for pid in pids:
+            if pid in current:
+                process_info = current[pid]
+            else:
+                process_info = current[pid] = self._sample(pid)
+            if process_info is not None:
+                process_infos.append(process_info)
+        return process_infos
+
+    def _sample(self, pid):
+        try:
+            sample = self.backend.sample_process(pid, with_static=pid not in self._known)
+            return self._resolve(pid, sample)
+
+        except platform_backend.ProcessUnavailable:
+            logging.log(1,f"Process with PID {pid} no longer exists or access is denied. Skipping.")
+            metrics.inc("processes_dropped_total", labels=_UNAVAILABLE)
+
+        except Exception as e:
+            logging.log(1,f"An unexpected error occurred while processing PID {pid}: {e}")
+            metrics.inc("processes_dropped_total", labels=_ERROR)
+        return None
+
+    def _resolve(self, pid, sample):
+        """补全静态属性并构造 ProcessInfo"""
+        known = self._known.get(pid)
+        create_time = sample['create_time']
+        static = self._static.get((pid, create_time)) if known is not None else None
+        if known is not None and static is None:
+            # pid 被新进程复用, 需要重新读取静态属性
+            try:
+                sample = self.backend.sample_process(pid, with_static=True)
+            except platform_backend.ProcessUnavailable:
+                metrics.inc("processes_dropped_total", labels=_UNAVAILABLE)
+                return None
+            create_time = sample['create_time']
+        if static is None:
+            static = (sample['name'], sample['exe'], sample['username'])
+            if known is not None:
+                self._static.pop((pid, known[0]), None)
+            self._static[(pid, create_time)] = static
         else:
-            devices = AudioUtilities.GetSpeakers()
-
-        if not devices:
-
-            return list(active_pids)
-
-        # 激活设备
-        interface = devices.Activate(IAudioSessionManager2._iid_, comtypes.CLSCTX_ALL, None)
-        session_manager = interface.QueryInterface(IAudioSessionManager2)
-
-        # 枚举所有会话
-        session_enumerator = session_manager.GetSessionEnumerator()
-        count = session_enumerator.GetCount()
-
-        for i in range(count):
-            session = session_enumerator.GetSession(i)
-            if session:
-                # 获取会话的控制器
-                session_control = session.QueryInterface(IAudioSessionControl2)
-
-                # 检查会话状态是否为活动（正在播放/录制）
-                # AudioSessionStateActive = 1
-                if session_control.GetState() == 1:
-                    # 获取该会话所属的进程ID
-                    pid = session_control.GetProcessId()
-                    if pid != 0:  # 排除系统声音等没有明确PID的会话
-                        active_pids.add(pid)
-                        ppid = psutil.Process(pid).ppid()
-                        if ppid != 0:
-                            active_ppids.add(ppid)
-
-        return active_pids, active_ppids
+            sample['name'], sample['exe'], sample['username'] = static
+        self._known[pid] = (create_time, self._tick)
+        process_info = ProcessInfo.from_sample(sample)
+        if self.changeThreshold is not None:
+            self._fingerprints[pid] = (create_time, sample['rss'], self._tick, process_info)
+        return process_info
+
+
 class MemUsage:
     """
     记录程序的内存使用，单位为byte
     """
+    __slots__ = ('memoryPercent', 'rss', 'vms', 'peakWSet', 'numPageFault')
     def __init__(self):
         self.memoryPercent = 0
         self.rss = 0
@@ -154,6 +258,7 @@ class MemUsage:
         self.peakWSet = 0
         self.numPageFault = 0
 class IOUsage:
+    __slots__ = ('RCallNum', 'WCallNum', 'RByteNum', 'WByteNum')
     def __init__(self):
         self.RCallNum = 0
         self.WCallNum = 0
@@ -161,6 +266,11 @@ class IOUsage:
         self.WByteNum = 0
 # 单个窗口信息
 class WindowInfo:
+    __slots__ = ('isMainWindow', 'windowId', 'windowTitle', 'pids', 'startTime', 'processInfos', 'whichTime',
+                 'isUseMedia', 'isUseMicroPhone', 'isUseCamera', 'isShareMedia', 'isShareMicroPhone',
+                 'isShareCamera', 'interval')
+    # WindowMarker 为 True
+    unchanged = False
     def __init__(self,window_id,window_title,pids):
         # 窗口信息
         self.isMainWindow = False
@@ -170,6 +280,8 @@ class WindowInfo:
         self.startTime = None
         self.processInfos= []
         self.whichTime = None
+        # 本次快照代表的秒数, 为 None 时按 data.collect.window_second 计
+        self.interval = None
         # # 键盘鼠标
         # self.keyBoardInfo= KeyBoardInfo()
         # self.mouseInfo= MouseInfo()
@@ -181,11 +293,73 @@ class WindowInfo:
         self.isShareMedia = False
         self.isShareMicroPhone = False
         self.isShareCamera = False
+class WindowMarker:
+    """
+    变化检测模式下与上一 tick 相同的窗口(标题、进程列表都没变, 进程也都复用了上一次的采样)。
+    只记录本 tick 的时间、前台和外设状态, 其余属性取自最近一次完整采样的 WindowInfo。
+    """
+    __slots__ = ('base', 'isMainWindow', 'whichTime', 'interval', 'isUseMedia', 'isUseMicroPhone',
+                 'isUseCamera', 'isShareMedia', 'isShareMicroPhone', 'isShareCamera')
+    unchanged = True
+
+    def __init__(self, base):
+        self.base = base
+        self.isMainWindow = False
+        self.whichTime = None
+        self.interval = None
+        self.isUseMedia = False
+        self.isUseMicroPhone = False
+        self.isUseCamera = False
+        self.isShareMedia = False
+        self.isShareMicroPhone = False
+        self.isShareCamera = False
+
+    @property
+    def windowId(self):
+        return self.base.windowId
+
+    @property
+    def windowTitle(self):
+        return self.base.windowTitle
+
+    @property
+    def pids(self):
+        return self.base.pids
+
+    @property
+    def startTime(self):
+        return self.base.startTime
+
+    @property
+    def processInfos(self):
+        return self.base.processInfos
+
+
+def _same_objects(left, right):
+    return len(left) == len(right) and all(a is b for a, b in zip(left, right))
+
+
 # 汇总信息
 class WindowsData:
-    def __init__(self,second):
+    def __init__(self,second,backend=None,foreground=None,sampler=None,change_threshold=None,max_age_ticks=12):
+        """
+        :param sampler: data.adaptive.AdaptiveSampler, 给出时空闲期间跳过未到期的 tick
+        :param change_threshold: 变化检测的 rss 变化比例阈值, 为 None 时每个 tick 完整采样全部窗口和进程
+        :param max_age_ticks: 变化检测模式下进程完整采样的最长间隔(tick 数)
+        """
         self._lock = threading.Lock()
         self.window_infos = []
+        # 流式模式下每个 tick 的快照直接交给 sink, 不再缓存
+        self.sink = None
+        self.backend = backend if backend is not None else platform_backend.get_backend()
+        # 前台窗口跟踪, 与 KeyMouseData 共用时由调用方传入
+        self.foreground = foreground if foreground is not None else ForegroundTracker(self.backend)
+        self.processSnapshot = ProcessSnapshot(self.backend, change_threshold=change_threshold,
+                                               max_age_ticks=max_age_ticks)
+        self.changeDetection = change_threshold is not None
+        # 变化检测: hwnd -> 上一 tick 完整采样的 WindowInfo
+        self._previous = {}
+        self.sampler = sampler
         self.schedulerManager = schedule.SchedulerManager()
         if type(second) != int or second <= 0:
             logging.log(1, "your param is uncorrected.")
@@ -194,55 +368,93 @@ class WindowsData:
             logging.log(1, "second must bigger than 10.")
             second = 5
         self.second = second
+    def set_sink(self,sink):
+        """
+        :param sink: 接收一次快照(窗口列表)的函数, 为 None 时快照缓存在 window_infos 中
+        """
+        self.sink = sink
     def update_window_infos(self,window_info):
+        if self.sink is not None:
+            self.sink(window_info)
+            return
         with self._lock:
             self.window_infos.append(window_info)
 
     # 获取全部的窗口pwnd
-    @staticmethod
-    def get_all_windows():
+    def get_all_windows(self):
         """获取所有可见且有标题的窗口"""
-        hwnd_list = []
-
-        # EnumWindows函数需要一个回调函数作为参数
-        # 这个回调函数被调用时，会传入两个参数：窗口句柄(hwnd)和自定义参数(lParam)
-        def callback(hwnd, lParam):
-            # IsWindowVisible判断窗口是否可见
-            # GetWindowText获取窗口标题
-            if win32gui.IsWindowVisible(hwnd) and win32gui.GetWindowText(hwnd):
-                # 将窗口句柄和标题以元组形式添加到列表中
-                hwnd_list.append((hwnd, win32gui.GetWindowText(hwnd)))
-            return True  # 返回True以继续枚举下一个窗口
-
-        # 调用EnumWindows，传入回调函数和自定义参数（这里我们不需要，所以是None）
-        win32gui.EnumWindows(callback, None)
-        return hwnd_list
+        return self.backend.get_all_windows()
     def collect_window(self):
         """
         往window_infos添加当前窗口快照信息.
         """
-        hwnd_list = WindowsData.get_all_windows()
-        main_window_id = GetForegroundWindow()
+        windows = self.snapshot_windows()
+        if windows is not None:
+            self.update_window_infos(windows)
+    def snapshot_windows(self):
+        """
+        采样一次窗口快照但不交给 sink, 供 asyncio 运行时在线程池里采样、在事件循环上并入。
+        :return: WindowInfo 列表, 自适应采样跳过本 tick 时为 None
+        """
+        sampler = self.sampler
+        if sampler is None:
+            interval = self.second
+        elif sampler.due():
+            interval = sampler.begin()
+        else:
+            metrics.inc("ticks_skipped_total")
+            return None
+        with metrics.timer("collect_window"):
+            windows = self._collect_window(interval)
+        metrics.inc("ticks_total")
+        metrics.inc("windows_total", len(windows))
+        return windows
+    def _collect_window(self, interval):
+        backend = self.backend
+        snapshot = self.processSnapshot
+        snapshot.begin_tick()
+        hwnd_list = self.get_all_windows()
+        foreground = self.foreground
+        main_window_id = foreground.hwnd if foreground.running else foreground.refresh()
         windows = []
         collect_time = datetime.now()
-        micro_active_pids, micro_active_ppids = ProcessInfo.use_audio_process(True)
-        media_active_pids, media_active_ppids = ProcessInfo.use_audio_process(False)
+        # 播放与录制会话一次枚举
+        audio_sessions = backend.get_audio_sessions()
+        micro_active_pids, micro_active_ppids = audio_sessions.microPids, audio_sessions.microPpids
+        media_active_pids, media_active_ppids = audio_sessions.mediaPids, audio_sessions.mediaPpids
         # for process in psutil.process_iter(
         #         ['pid', 'name', 'exe', 'cpu_percent', 'memory_info', 'io_counters', 'create_time']):
         #     all_process.append(process)
 
-        for hwnd, win_title in hwnd_list:
-            # 新增window在每分记录信息中
-            pids = win32process.GetWindowThreadProcessId(hwnd)
-            window = WindowInfo(hwnd, win_title, pids)
-            if window.windowId == main_window_id:
+        window_pids = [(hwnd, win_title, backend.get_window_pids(hwnd)) for hwnd, win_title in hwnd_list]
+        # 本 tick 用到的全部进程一次批量采样
+        snapshot.prefetch(pid for _, _, pids in window_pids for pid in pids)
+
+        previous = self._previous
+        change_detection = self.changeDetection
+        current = {}
+        for hwnd, win_title, pids in window_pids:
+            # 同一进程的多个窗口共用本 tick 的采样结果
+            process_infos = snapshot.collect(pids)
+            base = previous.get(hwnd) if change_detection else None
+            if (base is not None and base.windowTitle == win_title and base.pids == pids
+                    and _same_objects(base.processInfos, process_infos)):
+                # 窗口没有变化, 只记录本 tick 的状态
+                window = WindowMarker(base)
+                current[hwnd] = base
+            else:
+                # 新增window在每分记录信息中
+                window = WindowInfo(hwnd, win_title, pids)
+                # window.processInfos = ProcessInfoProcessInfo.collect_process_info(pids, all_process)
+                window.processInfos = process_infos
+                # 赋值startTime到window
+                if len(window.processInfos) != 0:
+                    window.startTime = window.processInfos[0].startTime
+                current[hwnd] = window
+            if hwnd == main_window_id:
                 window.isMainWindow = True
             window.whichTime = collect_time
-            # window.processInfos = ProcessInfoProcessInfo.collect_process_info(pids, all_process)
-            window.processInfos = ProcessInfo.collect_pids_info(pids)
-            # 赋值startTime到window
-            if len(window.processInfos) != 0:
-                window.startTime = window.processInfos[0].startTime
+            window.interval = interval
             # 收集音频组件信息
             if micro_active_pids.intersection(pids):
                 window.isUseMicroPhone = True
@@ -253,20 +465,28 @@ class WindowsData:
             if media_active_ppids.intersection(pids):
                 window.isShareMedia = True
             windows.append(window)
-        self.update_window_infos(windows)
+        snapshot.end_tick()
+        if change_detection:
+            # 只保留本 tick 仍存在的窗口, 关闭的窗口随之释放
+            self._previous = current
+        return windows
+    def forget_previous(self):
+        """下一次采样不产生 WindowMarker, 全部窗口完整输出; 上一次的快照没有送达时调用"""
+        self._previous = {}
     def get_and_reset(self):
         with self._lock:
             window_infos = self.window_infos
             self.window_infos = []
         return window_infos
     def start_collect(self):
-
+        self.foreground.start()
+        # tick 对齐到 second 的整数倍, 每分钟的第一个 tick 落在整分上
         self.schedulerManager.add_second(self.second, "window_collect", self.collect_window)
-        if not self.schedulerManager.scheduler.running:
-            self.schedulerManager.scheduler.start()
+        self.schedulerManager.start()
     def stop_collect(self):
-        if self.schedulerManager.scheduler.running:
-            self.schedulerManager.scheduler.shutdown()
+        if self.schedulerManager.running:
+            self.schedulerManager.shutdown()
+        self.foreground.stop()
 
 
 
@@ -274,10 +494,18 @@ class WindowsData:
 实时统计键鼠信息
 """
 class KeyBoardInfo:
+    __slots__ = ('keyPressNum', 'keyCounts')
     def __init__(self):
         self.keyPressNum = 0
-        self.keyPressList = {}
+        # 按键直方图, 下标为 counter.key_codes 的编码
+        self.keyCounts = counter.new_histogram(0)
+
+    @property
+    def keyPressList(self):
+        return counter.histogram_to_dict(self.keyCounts)
 class MouseInfo:
+    __slots__ = ('mouseScrollNum', 'mouseMoveNum', 'mouseLeftClickNum', 'mouseRightClickNum',
+                 'mouseOtherClickNum')
     def __init__(self):
         self.mouseScrollNum = 0
         self.mouseMoveNum = 0
@@ -285,6 +513,7 @@ class MouseInfo:
         self.mouseRightClickNum = 0
         self.mouseOtherClickNum = 0
 class KeyMouseInfo:
+    __slots__ = ('lock', 'keyboardInfo', 'mouseInfo', 'activeWindowId', 'last_active_window_id')
     def __init__(self,window_id):
         self.lock = threading.Lock()
         self.keyboardInfo = KeyBoardInfo()
@@ -294,8 +523,7 @@ class KeyMouseInfo:
     def update_keyboard(self, key):
         with self.lock:
             self.keyboardInfo.keyPressNum += 1
-            key_str = str(key)
-            self.keyboardInfo.keyPressList[key_str] = self.keyboardInfo.keyPressList.get(key_str, 0) + 1
+            counter.add_key_code(self.keyboardInfo.keyCounts, counter.key_codes.code(key))
 
 
     def update_mouse_move(self):
@@ -339,93 +567,81 @@ class KeyMouseInfo:
             self.last_active_window_id = -1
 
             return kb_data, mouse_data, window_id
+def click_slot(button):
+    """鼠标按键对应的计数器"""
+    if button == platform_backend.BUTTON_LEFT:
+        return counter.MOUSE_LEFT_CLICK
+    if button == platform_backend.BUTTON_RIGHT:
+        return counter.MOUSE_RIGHT_CLICK
+    return counter.MOUSE_OTHER_CLICK
+
+
 class KeyMouseData:
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.windowsActivity = {}
-        self.activityCounters = 0
-        self.mouseListener = mouse.Listener(
-            on_move=self.mouse_on_move,
-            on_click=self.mouse_on_click,
-            on_scroll=self.mouse_on_scroll)
-        self.keyboardListener = keyboard.Listener(
-            on_press=self.key_on_press)
+    def __init__(self,backend=None,slots=64,foreground=None,timeline_seconds=3600):
+        """
+        :param timeline_seconds: 按秒记录输入活动的时间线保留的秒数, 为 0 时不记录
+        """
+        self.timeline = ActivityTimeline(timeline_seconds) if timeline_seconds else None
+        # 计数引擎, slots 为预分配的窗口槽位数
+        self.counters = InputCounters(slots, timeline=self.timeline)
+        self.backend = backend if backend is not None else platform_backend.get_backend()
+        # 回调只读 foreground.hwnd, 不在钩子线程上做系统调用
+        self.foreground = foreground if foreground is not None else ForegroundTracker(self.backend)
+        self.listening = False
+    @property
+    def activityCounters(self):
+        """当前周期内的键鼠事件总数"""
+        return self.counters.total
     def collect_events(self):
         """
         启动监听器
         """
-        if not self.keyboardListener.running:
-            self.keyboardListener.start()
-        if not self.mouseListener.running:
-            self.mouseListener.start()
+        self.foreground.start()
+        if not self.listening:
+            self.backend.start_input_listeners(
+                on_press=self.key_on_press,
+                on_move=self.mouse_on_move,
+                on_click=self.mouse_on_click,
+                on_scroll=self.mouse_on_scroll)
+            self.listening = True
 
     def get_and_reset(self):
-        with self.lock:
-            windows_activity = self.windowsActivity
-            activity_counters = self.activityCounters
-            self.windowsActivity = {}
-            self.activityCounters = 0
+        """
+        :return: ({hwnd: KeyMouseInfo}, 事件总数)
+        """
+        buf, activity_counters = self.counters.get_and_reset()
+        windows_activity = {}
+        counts = buf.counts
+        for slot, hwnd in enumerate(buf.hwnds):
+            base = slot * counter.SLOT_WIDTH
+            info = KeyMouseInfo(hwnd)
+            info.keyboardInfo.keyPressNum = counts[base + counter.KEY_PRESS]
+            if info.keyboardInfo.keyPressNum:
+                # 直接交出直方图, recycle 时 clear 会为该槽位换上新的数组
+                info.keyboardInfo.keyCounts = buf.histograms[slot]
+            info.mouseInfo.mouseMoveNum = counts[base + counter.MOUSE_MOVE]
+            info.mouseInfo.mouseScrollNum = counts[base + counter.MOUSE_SCROLL]
+            info.mouseInfo.mouseLeftClickNum = counts[base + counter.MOUSE_LEFT_CLICK]
+            info.mouseInfo.mouseRightClickNum = counts[base + counter.MOUSE_RIGHT_CLICK]
+            info.mouseInfo.mouseOtherClickNum = counts[base + counter.MOUSE_OTHER_CLICK]
+            windows_activity[hwnd] = info
+        self.counters.recycle(buf)
         return windows_activity, activity_counters
     def stop_collect(self):
-        if self.mouseListener.running:
-            self.mouseListener.stop()
-        if self.keyboardListener.running:
-            self.keyboardListener.stop()
-    # pynput 对应反应函数
+        if self.listening:
+            self.backend.stop_input_listeners()
+            self.listening = False
+        self.foreground.stop()
+    # pynput 对应反应函数, 只做计数, 不分配对象
     def key_on_press(self,key):
-        main_window_hwnd = GetForegroundWindow()
-        with self.lock:
-            self.activityCounters += 1
-        self.windowsActivity.setdefault(main_window_hwnd, KeyMouseInfo(main_window_hwnd)).update_keyboard(
-            key)
+        self.counters.add_key(self.foreground.hwnd, key)
 
     def mouse_on_move(self,x, y):
-        main_window_hwnd = GetForegroundWindow()
-        with self.lock:
-            self.activityCounters += 1
-            self.windowsActivity.setdefault(main_window_hwnd, KeyMouseInfo(main_window_hwnd)).update_mouse_move()
+        self.counters.add(self.foreground.hwnd, counter.MOUSE_MOVE)
 
     def mouse_on_click(self,x, y, button, pressed):
         if pressed:
-            main_window_hwnd = GetForegroundWindow()
-            with self.lock:
-                self.activityCounters += 1
-            if button == mouse.Button.left:
-                self.windowsActivity.setdefault(main_window_hwnd,
-                                                KeyMouseInfo(main_window_hwnd)).update_mouse_left_click()
-            elif button == mouse.Button.right:
-                self.windowsActivity.setdefault(main_window_hwnd,
-                                                KeyMouseInfo(main_window_hwnd)).update_mouse_right_click()
-            else:
-                self.windowsActivity.setdefault(main_window_hwnd,
-                                                KeyMouseInfo(main_window_hwnd)).update_mouse_other_click()
+            self.counters.add(self.foreground.hwnd, click_slot(button))
 
     def mouse_on_scroll(self,x, y, dx, dy):
-        main_window_hwnd = GetForegroundWindow()
-        self.windowsActivity.setdefault(main_window_hwnd,
-                                        KeyMouseInfo(main_window_hwnd)).update_mouse_scroll()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+        self.counters.add(self.foreground.hwnd, counter.MOUSE_SCROLL)
@@ -0,0 +1,84 @@
+"""
+进程指标的列式聚合
+columnar.py: 每个 tick 的进程指标按列追加, 周期结束时用 NumPy 一次算出平均值和总计
+- ProcessMetricColumns: 以 ProcesSorted 的序号为行键的列式缓冲区
+NumPy 是可选依赖, 不可用时 available() 返回 False, SortedDatas 使用逐对象累加的旧路径。
+NumPy 在第一次调用 available() 时才导入, 只使用数据模型的工具不必承担导入开销。
+"""
+np = None
+_numpy_checked = False
+
+# 追加顺序: 5 个内存指标(求平均) + 4 个 io 指标(求和)
+_MEMORY_COLUMNS = 5
+_COLUMNS = 9
+
+
+def available():
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:  # pragma: no cover - 取决于运行环境
+            pass
+        _numpy_checked = True
+    return np is not None
+
+
+class ProcessMetricColumns:
+    """
+    一个统计周期内的进程指标。
+    append 只做列表追加; finalize 用 bincount 按行键一次求和, 平均值为 总和/次数,
+    不存在逐次滑动平均带来的浮点误差累积。
+    """
+    def __init__(self):
+        # 行键 -> ProcesSorted
+        self._targets = []
+        # 每个样本的行键, 与 _values 中每 _COLUMNS 个值一一对应
+        self._rows = []
+        self._values = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def append(self, target, process_info):
+        """
+        :param target: ProcesSorted, 第一次出现时分配行键, 记录在 target.metricIndex
+        :param process_info: collect.ProcessInfo
+        """
+        index = target.metricIndex
+        if index < 0:
+            index = target.metricIndex = len(self._targets)
+            self._targets.append(target)
+        memory = process_info.memoryUsage
+        io = process_info.ioUsage
+        self._rows.append(index)
+        self._values.extend((memory.memoryPercent, memory.rss, memory.vms, memory.peakWSet, memory.numPageFault,
+                             io.RCallNum, io.WCallNum, io.RByteNum, io.WByteNum))
+
+    def finalize(self):
+        """一次向量化计算, 把平均值和总计写回各个 ProcesSorted"""
+        targets = self._targets
+        if not targets or not available():
+            return
+        size = len(targets)
+        rows = np.asarray(self._rows, dtype=np.intp)
+        values = np.asarray(self._values, dtype=np.float64).reshape(-1, _COLUMNS)
+        counts = np.bincount(rows, minlength=size)
+        sums = np.empty((size, _COLUMNS), dtype=np.float64)
+        for column in range(_COLUMNS):
+            sums[:, column] = np.bincount(rows, weights=values[:, column], minlength=size)
+        averages = (sums[:, :_MEMORY_COLUMNS] / np.maximum(counts, 1)[:, None]).tolist()
+        totals = np.rint(sums[:, _MEMORY_COLUMNS:]).astype(np.int64).tolist()
+        counts = counts.tolist()
+
+        for target, average, total, count in zip(targets, averages, totals, counts):
+            memory = target.memoryUsage
+            memory.avgMemoryPercent, memory.avgRss, memory.avgVms, memory.avgPeakWSet, memory.avgNumPageFault = average
+            memory.statsCount = count
+            io = target.ioUsage
+            io.totalRCallNum, io.totalWCallNum, io.totalRByteNum, io.totalWByteNum = total
+            target.metricIndex = -1
+        self._targets = []
+        self._rows = []
+        self._values = []
@@ -0,0 +1,217 @@
+"""
+键鼠事件计数
+counter.py: pynput 回调的计数引擎
+- InputCounters: 预分配的按窗口计数槽位, 一把锁, get_and_reset 时整体交换缓冲区
+- KeyCodes: 按键名称到整数编码的映射, 按键统计为以编码为下标的定长数组(直方图)
+"""
+import threading
+from array import array
+
+# 每个窗口槽位内各计数器的偏移
+KEY_PRESS = 0
+MOUSE_MOVE = 1
+MOUSE_SCROLL = 2
+MOUSE_LEFT_CLICK = 3
+MOUSE_RIGHT_CLICK = 4
+MOUSE_OTHER_CLICK = 5
+SLOT_WIDTH = 6
+
+# 按键直方图的初始长度, 编码超出时按需加长
+KEY_HISTOGRAM_SIZE = 128
+
+
+class KeyCodes:
+    """
+    按键对象第一次出现时转成字符串并分配编码, 之后每次按键只做一次字典查找。
+    编码只在进程内有效, 落库时通过名称换成 key_name 表的 ID。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 按键对象 -> 编码
+        self._by_key = {}
+        # 名称 -> 编码
+        self._by_name = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def code(self, key):
+        code = self._by_key.get(key)
+        if code is None:
+            code = self.intern(str(key), key)
+        return code
+
+    def intern(self, name, key=None):
+        with self._lock:
+            code = self._by_name.get(name)
+            if code is None:
+                code = self._by_name[name] = len(self.names)
+                self.names.append(name)
+            if key is not None:
+                self._by_key[key] = code
+        return code
+
+    def name(self, code):
+        return self.names[code]
+
+
+# 进程内共享的按键编码表
+key_codes = KeyCodes()
+
+
+def new_histogram(size=KEY_HISTOGRAM_SIZE):
+    return array('L', [0]) * size
+
+
+def add_key_code(histogram, code, count=1):
+    if code >= len(histogram):
+        histogram.extend(new_histogram(max(code + 1, len(histogram) * 2) - len(histogram)))
+    histogram[code] += count
+
+
+def merge_histogram(target, source):
+    """把 source 原地加到 target 上"""
+    if len(target) < len(source):
+        target.extend(new_histogram(len(source) - len(target)))
+    for code, count in enumerate(source):
+        if count:
+            target[code] += count
+    return target
+
+
+def histogram_to_dict(histogram):
+    """{按键名称: 次数}, 只在展示和调试时使用"""
+    names = key_codes.names
+    return {names[code]: count for code, count in enumerate(histogram) if count}
+
+
+class _CounterBuffer:
+    """
+    一组连续的计数槽位: counts 是扁平的整数列表, 第 i 个窗口占 [i*SLOT_WIDTH, (i+1)*SLOT_WIDTH)。
+    窗口第一次出现时分配槽位, 之后的事件只做一次字典查找和一次自增, 不创建任何对象。
+    """
+    def __init__(self, slots):
+        self.capacity = slots
+        self.counts = [0] * (slots * SLOT_WIDTH)
+        # hwnd -> 槽位起始下标
+        self.index = {}
+        self.hwnds = []
+        # 每个槽位的按键直方图, 下标为 key_codes 的编码
+        self.histograms = [new_histogram() for _ in range(slots)]
+        self.total = 0
+
+    def assign(self, hwnd):
+        slot = len(self.hwnds)
+        if slot == self.capacity:
+            # 槽位用完时翻倍, 只在窗口数超过预估时发生
+            self.counts.extend([0] * (self.capacity * SLOT_WIDTH))
+            self.histograms.extend(new_histogram() for _ in range(self.capacity))
+            self.capacity *= 2
+        self.hwnds.append(hwnd)
+        base = self.index[hwnd] = slot * SLOT_WIDTH
+        return base
+
+    def clear(self):
+        counts = self.counts
+        histograms = self.histograms
+        for slot in range(len(self.hwnds)):
+            # 只有按过键的槽位需要换成新的直方图
+            if counts[slot * SLOT_WIDTH + KEY_PRESS]:
+                histograms[slot] = new_histogram(len(histograms[slot]))
+        for i in range(len(self.hwnds) * SLOT_WIDTH):
+            counts[i] = 0
+        self.index.clear()
+        self.hwnds.clear()
+        self.total = 0
+
+
+class InputCounters:
+    """
+    按窗口统计键鼠事件。
+    事件路径只持有一把锁做自增; get_and_reset 在锁内把当前缓冲区换成已清零的备用缓冲区,
+    读取和清零都在锁外完成, 不会阻塞钩子线程。
+    """
+    def __init__(self, slots=64, timeline=None):
+        """
+        :param timeline: data.timeline.ActivityTimeline, 给出时每个事件同时记入按秒的时间线
+        """
+        self._lock = threading.Lock()
+        self._slots = slots
+        self.timeline = timeline
+        self._active = _CounterBuffer(slots)
+        self._spare = _CounterBuffer(slots)
+
+    @property
+    def total(self):
+        """当前周期内的事件总数"""
+        return self._active.total
+
+    def add(self, hwnd, counter):
+        with self._lock:
+            buf = self._active
+            base = buf.index.get(hwnd)
+            if base is None:
+                base = buf.assign(hwnd)
+            buf.counts[base + counter] += 1
+            buf.total += 1
+            if self.timeline is not None:
+                self.timeline.record(hwnd, counter)
+
+    def add_key(self, hwnd, key):
+        code = key_codes.code(key)
+        with self._lock:
+            buf = self._active
+            base = buf.index.get(hwnd)
+            if base is None:
+                base = buf.assign(hwnd)
+            buf.counts[base] += 1
+            buf.total += 1
+            if self.timeline is not None:
+                self.timeline.record(hwnd, KEY_PRESS)
+            histogram = buf.histograms[base // SLOT_WIDTH]
+            if code < len(histogram):
+                histogram[code] += 1
+            else:
+                add_key_code(histogram, code)
+
+    def merge(self, hwnd, counts, key_counts=(), now=None):
+        """
+        把别处统计好的一组计数并入 hwnd 的槽位, 进程外采集时由消费线程调用。
+        :param counts: 长度为 SLOT_WIDTH 的计数, 下标同 KEY_PRESS 等偏移
+        :param key_counts: [(按键编码, 次数)]
+        :param now: 这些事件发生的时间戳, 记入时间线的秒; 为 None 时取并入的时刻
+        """
+        with self._lock:
+            buf = self._active
+            base = buf.index.get(hwnd)
+            if base is None:
+                base = buf.assign(hwnd)
+            slot_counts = buf.counts
+            timeline = self.timeline
+            for offset, count in enumerate(counts):
+                slot_counts[base + offset] += count
+                if count and timeline is not None:
+                    timeline.record(hwnd, offset, count, now)
+            buf.total += sum(counts)
+            if key_counts:
+                histogram = buf.histograms[base // SLOT_WIDTH]
+                for code, count in key_counts:
+                    add_key_code(histogram, code, count)
+
+    def get_and_reset(self):
+        """
+        原子地取出当前周期的计数并开始新周期。
+        :return: (缓冲区, 事件总数), 缓冲区用完后需交还 recycle()
+        """
+        spare = self._spare or _CounterBuffer(self._slots)
+        self._spare = None
+        with self._lock:
+            buf = self._active
+            self._active = spare
+        return buf, buf.total
+
+    def recycle(self, buf):
+        """清零并交还 get_and_reset 取出的缓冲区, 作为下一次交换的备用缓冲区"""
+        buf.clear()
+        self._spare = buf
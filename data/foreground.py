@@ -0,0 +1,101 @@
+"""
+前台窗口跟踪
+foreground.py: 用一个后台线程跟踪前台窗口
+- ForegroundTracker: 当前前台 hwnd 保存在普通属性里, 键鼠回调和窗口采集直接读取;
+  同时记录每次切换的时间戳, 按窗口累计真实的前台时长
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ForegroundTracker:
+    """
+    以 poll_ms 的间隔轮询前台窗口(一次系统调用), 取代每个键鼠事件各调用一次 GetForegroundWindow。
+    前台时长的精度为一个轮询间隔。
+    """
+    def __init__(self, backend, poll_ms=100):
+        self.backend = backend
+        self.pollSecond = max(poll_ms, 10) / 1000
+        self._lock = threading.Lock()
+        # 回调线程只读这个属性, 赋值在 CPython 中是原子的
+        self.hwnd = backend.get_foreground_window()
+        self._since = time.time()
+        # hwnd -> 本周期内已结束的前台时长(秒)
+        self._durations = {}
+        self._switches = 0
+        self._stop = threading.Event()
+        self._thread = None
+        # 由外部按间隔调用 refresh
+        self._external = False
+
+    @property
+    def running(self):
+        return self._thread is not None or self._external
+
+    def start(self, own_thread=True):
+        """
+        :param own_thread: 为 False 时不启动轮询线程, 由调用方(asyncio 运行时)按 pollSecond 调用 refresh
+        """
+        if self.running:
+            return
+        if not own_thread:
+            self.refresh()
+            self._external = True
+            return
+        self.refresh()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="foreground-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._external = False
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.pollSecond):
+            try:
+                self.refresh()
+            except Exception as e:
+                log.log(1, f"refresh foreground window failed: {e}")
+
+    def refresh(self):
+        """读取一次前台窗口, 发生切换时结算上一个窗口的前台时长"""
+        return self.switch_to(self.backend.get_foreground_window())
+
+    def switch_to(self, hwnd, now=None):
+        """
+        前台切换到 hwnd, 进程外采集时由消费线程按工作进程发布的切换时间调用。
+        :param now: 切换发生的时间戳, 默认为当前时间
+        """
+        if hwnd == self.hwnd:
+            return hwnd
+        now = time.time() if now is None else now
+        with self._lock:
+            previous = self.hwnd
+            self._durations[previous] = self._durations.get(previous, 0) + now - self._since
+            self._since = now
+            self._switches += 1
+            self.hwnd = hwnd
+        return hwnd
+
+    def get_and_reset(self):
+        """
+        原子操作：结算当前周期并开始新周期。
+        :return: ({hwnd: 前台秒数}, 切换次数)
+        """
+        now = time.time()
+        with self._lock:
+            durations = self._durations
+            durations[self.hwnd] = durations.get(self.hwnd, 0) + now - self._since
+            switches = self._switches
+            self._durations = {}
+            self._switches = 0
+            self._since = now
+        return durations, switches
@@ -1,15 +1,19 @@
 import logging
 import threading
 import time
-from collections import Counter
 from datetime import datetime
 
 import db.sqlite
 from config import config
 from data import  schedule
+from data import columnar
+from data import counter
+from data import metrics
+from data.timeline import KEYS as timeline_keys
 
 
 class MemorySorted:
+    __slots__ = ('avgMemoryPercent', 'avgRss', 'avgVms', 'avgPeakWSet', 'avgNumPageFault', 'statsCount')
     def __init__(self):
         self.avgMemoryPercent = 0
         self.avgRss = 0
@@ -42,6 +46,7 @@ class MemorySorted:
         return
 
 class IOSorted:
+    __slots__ = ('totalRCallNum', 'totalWCallNum', 'totalRByteNum', 'totalWByteNum')
     def __init__(self):
         self.totalRCallNum = 0
         self.totalWCallNum = 0
@@ -57,6 +62,8 @@ class IOSorted:
         self.totalWByteNum += original_io_usage.WByteNum
 
 class ProcesSorted:
+    __slots__ = ('pid', 'name', 'path', 'username', 'status', 'startTime', 'cpuUsage', 'memoryUsage',
+                 'ioUsage', 'metricIndex')
     def __init__(self):
         self.pid = None
         self.name = None
@@ -67,7 +74,12 @@ class ProcesSorted:
         self.cpuUsage = None
         self.memoryUsage = MemorySorted()
         self.ioUsage = IOSorted()
-    def update(self, original_process_infos):
+        # 在 ProcessMetricColumns 中的行键, -1 表示未登记
+        self.metricIndex = -1
+    def update(self, original_process_infos, columns=None):
+        """
+        :param columns: columnar.ProcessMetricColumns, 给出时内存与io指标追加到列式缓冲区, 周期结束统一计算
+        """
         if not original_process_infos:
             logger.warning("original_process_infos is Null")
             return
@@ -79,28 +91,34 @@ class ProcesSorted:
             self.path = original_process_infos.path
             self.username = original_process_infos.username
             self.startTime = original_process_infos.startTime
+        if columns is not None:
+            columns.append(self, original_process_infos)
+            return
         # 更新-统计的内存使用情况和io使用情况
         self.memoryUsage.update(original_process_infos.memoryUsage)
         self.ioUsage.update(original_process_infos.ioUsage)
 
 class KeyBoardInfo:
+    __slots__ = ('keyPressNum', 'keyCounts')
     def __init__(self):
         self.keyPressNum = 0
-        self.keyPressList = {}
+        # 按键直方图, 下标为 counter.key_codes 的编码
+        self.keyCounts = counter.new_histogram(0)
+
+    @property
+    def keyPressList(self):
+        return counter.histogram_to_dict(self.keyCounts)
 
     def update(self,keyboard_info):
         if not keyboard_info:
             logger.warning("keyboard_info is null")
             return
         self.keyPressNum += keyboard_info.keyPressNum
-        self._update_key_list(keyboard_info.keyPressList)
-
-    def _update_key_list(self, key_list):
-        if not key_list:
-            logger.warning("key_list is null")
-            return
-        self.keyPressList = dict(Counter(self.keyPressList) +  Counter(key_list))
+        # 原地相加, 不创建新的字典
+        counter.merge_histogram(self.keyCounts, keyboard_info.keyCounts)
 class MouseInfo:
+    __slots__ = ('mouseScrollNum', 'mouseMoveNum', 'mouseLeftClickNum', 'mouseRightClickNum',
+                 'mouseOtherClickNum')
     def __init__(self):
         self.mouseScrollNum = 0
         self.mouseMoveNum = 0
@@ -132,6 +150,9 @@ class WindowSorted:
     用于存放整理好的,每一分钟的window信息
     时间以秒为单位
     """
+    __slots__ = ('windowHwnd', 'whichMinute', 'windowTitles', 'processInfos', 'keyboardInfo', 'mouseInfo',
+                 'startTime', 'mainWindowTime', 'mediaUseTime', 'microUseTime', 'cameraUseTime',
+                 'mediaShareTime', 'microShareTime', 'cameraShareTime')
     def __init__(self):
         self.windowHwnd = 0
         self.whichMinute = ""
@@ -152,7 +173,11 @@ class WindowSorted:
         self.mediaShareTime = 0
         self.microShareTime = 0
         self.cameraShareTime = 0
-    def update(self,original_window,original_km_data,):
+    def update(self,original_window,original_km_data,count_main_window=True,columns=None):
+        """
+        :param count_main_window: 为 False 时主窗口时间由前台切换记录直接给出, 不按采样间隔累加
+        :param columns: 进程指标的列式缓冲区, 为 None 时逐对象累加
+        """
         if not original_window:
             logger.warning("original_window is null")
             return
@@ -163,25 +188,27 @@ class WindowSorted:
             self.windowHwnd = original_window.windowId
             self.startTime = transform_time(original_window.startTime)
             if original_km_data is not None:
-                # 更新键盘信息
-                self.keyboardInfo.update(original_km_data.keyboardInfo)
-                # 更新鼠标信息
-                self.mouseInfo.update(original_km_data.mouseInfo)
+                self.update_input(original_km_data)
 
-        time_second = config['data']['collect']['window_second']
+        # 按快照实际代表的时长累加, 自适应采样时各快照的间隔不同
+        time_second = original_window.interval or config.settings['data']['collect']['window_second']
         # 更新主窗口时间
-        if original_window.isMainWindow:
+        if count_main_window and original_window.isMainWindow:
             self.update_main_window_time(time_second)
-        # 添加窗口标题
-        if original_window.windowTitle not in self.windowTitles:
-            self.windowTitles.append(original_window.windowTitle)
+        # 添加窗口标题; 未变化的窗口沿用上一次的标题对象, 与最后一个标题相同时不必查找
+        window_title = original_window.windowTitle
+        titles = self.windowTitles
+        if not (original_window.unchanged and titles and titles[-1] is window_title) and window_title not in titles:
+            titles.append(window_title)
         # 更新process信息
+        process_sorted_dict = self.processInfos
         for processInfo in original_window.processInfos:
-            self.processInfos.setdefault(processInfo.pid, ProcesSorted()).update(processInfo)
-
+            process_sorted = process_sorted_dict.get(processInfo.pid)
+            if process_sorted is None:
+                process_sorted = process_sorted_dict[processInfo.pid] = ProcesSorted()
+            process_sorted.update(processInfo, columns)
 
 
-        time_second = config['data']['collect']['window_second']
         # 更新各外设使用时间
         if original_window.isUseMedia:
             self.update_media_use_time(time_second)
@@ -196,6 +223,12 @@ class WindowSorted:
         if original_window.isShareCamera:
             self.update_camera_share_time(time_second)
 
+    def update_input(self,original_km_data):
+        # 更新键盘信息
+        self.keyboardInfo.update(original_km_data.keyboardInfo)
+        # 更新鼠标信息
+        self.mouseInfo.update(original_km_data.mouseInfo)
+
     # 更新时间
     def update_main_window_time(self,time_second):
         self.mainWindowTime += time_second
@@ -212,42 +245,111 @@ class WindowSorted:
     def update_camera_share_time(self,time_second):
         self.cameraShareTime += time_second
 
-config = config.settings
-logger = logging.getLogger(config['data']['log_name'])
+# data 包的 logger 由 DataCollector 按 data.log_name 配置, 子 logger 的日志向上传递
+logger = logging.getLogger(__name__)
 
 
 # 将设定时间内的window信息组合起来
+class SortedPeriod(dict):
+    """
+    一个统计周期的结果: hwnd -> WindowSorted, 附带各分钟的输入活动位图, 与窗口活动在同一个事务中落库。
+    minuteActivities: [(which_minute, 是否有输入, 活动位图, 按键位图)]
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.minuteActivities = []
+
+    @property
+    def empty(self):
+        return not self and not self.minuteActivities
+
+
 class SortedDatas:
-    def __init__(self,minute,km_datas, win_datas):
+    def __init__(self,minute,km_datas, win_datas, streaming=False, vectorized=False, writer=None):
         """
 
         :param minute: 执行频率，分钟为计算单位
         :param km_datas: 键鼠统计信息
         :param win_datas: 窗口统计信息
+        :param streaming: 流式模式, 每个 tick 的快照在采集时直接并入统计, 定时任务只负责交换和落库
+        :param vectorized: 进程指标按列缓存, 周期结束时用 NumPy 一次计算; NumPy 不可用时退回逐对象累加
+        :param writer: db.writer.StorageWriter, 给出时由独立线程异步落库, 否则在定时任务中同步写入
         """
         # window_hwnd 为 key
         self._lock = threading.Lock()
         self.originalWindowDatas = win_datas
         self.originalKMDatas = km_datas
-        self.windows = {}
+        self.windows = SortedPeriod()
         self.initiativeUse = False
+        # 按秒的输入时间线, 每个周期把已记录到的分钟压缩成位图; 下一次从 _timeline_minute 开始
+        self._timeline = getattr(km_datas, 'timeline', None)
+        self._timeline_minute = int(time.time() // 60 * 60)
+        self.streaming = streaming
+        if vectorized and not columnar.available():
+            logger.warning("numpy is not available, fall back to per-object aggregation")
+            vectorized = False
+        self.vectorized = vectorized
+        self.columns = columnar.ProcessMetricColumns() if vectorized else None
+        self.writer = writer
+        # 有前台跟踪时, 主窗口时间取真实的前台时长, 不按采样间隔累加
+        self._foreground = getattr(win_datas, 'foreground', None)
+        if streaming:
+            win_datas.set_sink(self.fold_windows)
         self.schedulerManager = schedule.SchedulerManager()
         if type(minute) != int or minute <= 0:
             logger.warning("minute is invalid")
             return
         self.minute = minute
 
-
+    def fold_windows(self, windows_list):
+        """
+        流式模式下由采集任务在每个 tick 调用, 把一次快照并入当前周期的统计。
+        """
+        with metrics.timer("fold"), self._lock:
+            self._fold(self.windows, windows_list)
+
+    def _fold(self, windows, windows_list):
+        count_main_window = self._foreground is None
+        columns = self.columns
+        for window in windows_list:
+            window_sorted = windows.get(window.windowId)
+            if window_sorted is None:
+                window_sorted = windows[window.windowId] = WindowSorted()
+            window_sorted.update(window, None, count_main_window=count_main_window, columns=columns)
+
+    def _get_inputs(self):
+        """取出并重置本周期的键鼠统计和前台时长"""
+        kms_window, kms_count = self.originalKMDatas.get_and_reset()
+        focus_durations = self._foreground.get_and_reset()[0] if self._foreground is not None else None
+        metrics.inc("input_events_total", kms_count)
+        return kms_window, kms_count, focus_durations
+
+    @staticmethod
+    def _apply_inputs(windows, kms_window, focus_durations):
+        # 有些窗口，没有输入输出，就正常处理就好
+        for hwnd, km_info in kms_window.items():
+            window_sorted = windows.get(hwnd)
+            if window_sorted is not None:
+                window_sorted.update_input(km_info)
+        if focus_durations:
+            for hwnd, seconds in focus_durations.items():
+                window_sorted = windows.get(hwnd)
+                if window_sorted is not None:
+                    window_sorted.update_main_window_time(seconds)
 
     def merge_data(self):
         """
         合并容器里的original数据到windows
         """
+        with metrics.timer("merge_data"):
+            return self._merge_data()
+
+    def _merge_data(self):
         logger.info("merge_data")
         window_list_list = self.originalWindowDatas.get_and_reset()
-        kms_window,kms_count =self.originalKMDatas.get_and_reset()
+        kms_window, kms_count, focus_durations = self._get_inputs()
         # 检查传入参数是否为空
-        if not window_list_list:
+        if not window_list_list and not self.streaming:
             logger.warning("windows_list_list is Empty")
             return None
         # kms_count不为0，表示用户最近1分钟内有碰过鼠标or键盘
@@ -257,12 +359,8 @@ class SortedDatas:
         with self._lock:
             # 将windows_list_list 变为 windows_list,
             for windows_list in window_list_list:
-                for window in windows_list:
-                    # window为窗口列表;km_window[window.windowId]表示为km_info
-                    # 有些窗口，没有输入输出，就正常处理就好,怕就怕在 没有对应key会阻塞
-                    self.windows.setdefault(window.windowId, WindowSorted()).update(window, kms_window.get(window.windowId))
-
-
+                self._fold(self.windows, windows_list)
+            self._apply_inputs(self.windows, kms_window, focus_durations)
 
         logger.info("windows_list_list's merge is finish")
         return None
@@ -272,26 +370,108 @@ class SortedDatas:
         with self._lock:
             windows = self.windows
             initiative_use = self.initiativeUse
-            self.windows = {}
+            columns = self.columns
+            self.windows = SortedPeriod()
             self.initiativeUse = False
-            return windows, initiative_use
+            if columns is not None:
+                self.columns = columnar.ProcessMetricColumns()
+        # 列式缓冲区在锁外一次算完, 写回被换出的 ProcesSorted
+        if columns is not None:
+            columns.finalize()
+        windows.minuteActivities = self._take_minutes()
+        return windows, initiative_use
+
+    def _take_minutes(self, now=None):
+        """
+        把上次之后到当前分钟为止的时间线压缩为每分钟一行。
+        当前分钟还没结束, 下个周期会再写一次, 落库时按位或合并。
+        """
+        timeline = self._timeline
+        if timeline is None:
+            return []
+        current = int((time.time() if now is None else now) // 60 * 60)
+        # 早于环形缓冲区容量的秒已被覆盖
+        minute = max(self._timeline_minute, current - (timeline.size // 60 - 1) * 60)
+        rows = []
+        while minute <= current:
+            active = timeline.bitmap(minute)
+            rows.append((datetime.fromtimestamp(minute).strftime("%Y-%m-%d %H:%M"), int(active != 0),
+                         active, timeline.bitmap(minute, column=timeline_keys)))
+            minute += 60
+        self._timeline_minute = current
+        return rows
     def storage_data(self):
         windows,initiative_use = self._get_and_reset()
-        if not windows:
+        if windows.empty:
             logger.warning("sorted windows is empty")
             return
-        db.sqlite.bulk_insert_window_activities(windows)
+        self.store(windows)
+
+    def store(self, windows):
+        """落库一个周期, 有 writer 时交给写线程"""
+        if self.writer is not None:
+            self.writer.submit(windows)
+        else:
+            db.sqlite.bulk_insert_window_activities(windows)
+
+    def swap_data(self):
+        """
+        流式模式: 交换出本周期已聚合好的窗口, 在锁外补上键鼠与前台时长。
+        :return: 本周期的 WindowSorted 字典, 没有数据时为 None
+        """
+        with metrics.timer("swap"):
+            kms_window, kms_count, focus_durations = self._get_inputs()
+            windows, initiative_use = self._get_and_reset()
+            if windows:
+                self._apply_inputs(windows, kms_window, focus_durations)
+        if windows.empty:
+            logger.warning("sorted windows is empty")
+            return None
+        return windows
+
+    def swap_and_storage_data(self):
+        """
+        流式模式的定时任务: 先交换出本周期已聚合好的窗口, 再在锁外补上键鼠与前台时长并落库。
+        """
+        windows = self.swap_data()
+        if windows is not None:
+            self.store(windows)
+
+    def take_period(self):
+        """
+        结束当前周期并返回整理好的窗口, 不落库; 非流式模式先合并缓存的快照。
+        :return: WindowSorted 字典, 没有数据时为 None
+        """
+        if self.streaming:
+            return self.swap_data()
+        self.merge_data()
+        windows, initiative_use = self._get_and_reset()
+        if windows.empty:
+            logger.warning("sorted windows is empty")
+            return None
+        return windows
 
     def merge_and_storage_data(self):
+        if self.streaming:
+            self.swap_and_storage_data()
+            return
         self.merge_data()
         self.storage_data()
 
     def start_sort(self):
-        self.schedulerManager.add_minute(self.minute,"merge_data",self.merge_and_storage_data)
-        self.schedulerManager.scheduler.start()
+        if self.writer is not None:
+            self.writer.start()
+        # 在整分前半个采集间隔落库, 刚好位于本分钟最后一个 tick 与下一分钟第一个 tick 之间,
+        # 每个周期正好包含同一个 whichMinute 的 tick
+        offset = -getattr(self.originalWindowDatas, 'second', 0) / 2
+        self.schedulerManager.add_minute(self.minute,"merge_data",self.merge_and_storage_data,offset=offset)
+        self.schedulerManager.start()
     def stop_sort(self):
-        self.schedulerManager.scheduler.shutdown()
-
-
-
-
+        """
+        停止定时任务后把未满一个周期的数据也落库, 并等待写线程写完队列。
+        """
+        if self.schedulerManager.running:
+            self.schedulerManager.shutdown()
+        self.merge_and_storage_data()
+        if self.writer is not None:
+            self.writer.stop()
@@ -1,44 +1,206 @@
 import atexit
+import logging
+import os
 import threading
 
 import log.logger as logger
-import time
-import config.config as config
+import config.config as conf
 import data.format as fm
+import db.sqlite
+from db.writer import StorageWriter
+from db.rollup import RollupEngine
+from data import backend as platform_backend
+from data import metrics
+from data import schedule
+from data.adaptive import AdaptiveSampler
+from data.aio import AsyncCollectorRuntime
 from data.collect import KeyMouseData, WindowsData
+from data.foreground import ForegroundTracker
+from data.shm import SharedMemoryCollector
 
-config = config.settings
-logger.setup_logger(config['data']['log_name'])
 class DataCollector:
-    def __init__(self):
-        self.collect_windows = WindowsData(second=config['data']['collect']['window_second'])
-        self.collect_keyMouses = KeyMouseData()
+    """
+    导入本模块不做任何初始化: 日志、配置和平台后端在构造时准备, 数据库在 start 时打开。
+    """
+    def __init__(self,backend=None):
+        logger.setup_logger(conf.settings['data']['log_name'])
+        # 窗口采集与键鼠采集共用同一个平台后端
+        self.backend = backend if backend is not None else platform_backend.get_backend()
+        # 窗口采集与键鼠采集共用同一个前台窗口跟踪
+        self.foreground = ForegroundTracker(self.backend, poll_ms=conf.settings['data']['collect'].get('foreground_poll_ms', 100))
+        self.collect_keyMouses = self._create_key_mouse_data()
+        self.collect_windows = self._create_windows_data()
         self.format_windows = None
+        self.rollup = self._create_rollup()
+        self.metricsExporter = self._create_metrics_exporter()
+        # threads / asyncio, 见配置 data.runtime
+        self.runtime = conf.settings['data'].get('runtime', 'threads')
+        self.asyncRuntime = None
+        self.worker = self._create_worker()
 
     # 传入收集容器,进行信息收集
     def _collect(self):
-        if self.collect_windows is None:
-            self.collect_windows = WindowsData(second=config['data']['collect']['window_second'])
         if self.collect_keyMouses is None:
-            self.collect_keyMouses = KeyMouseData()
+            self.collect_keyMouses = self._create_key_mouse_data()
+        if self.collect_windows is None:
+            self.collect_windows = self._create_windows_data()
+        if self.worker is not None:
+            self.worker.start()
+            return
+        self._collect_in_process()
+
+    def _collect_in_process(self):
         self.collect_windows.start_collect()
         self.collect_keyMouses.collect_events()
 
     # 传入收集信息,进行信息整理
     def _sort(self):
         if self.format_windows is None:
-            self.format_windows= fm.SortedDatas(minute=config['data']['format']['window_minute'],
-                                                win_datas=self.collect_windows, km_datas=self.collect_keyMouses)
+            self.format_windows = self._create_sorted_datas(writer=self._create_writer())
         self.format_windows.start_sort()
         return
 
+    def _create_sorted_datas(self, writer=None):
+        format_conf = conf.settings['data']['format']
+        return fm.SortedDatas(minute=format_conf['window_minute'],
+                              win_datas=self.collect_windows, km_datas=self.collect_keyMouses,
+                              streaming=format_conf.get('streaming', False),
+                              vectorized=format_conf.get('vectorized', False),
+                              writer=writer)
+
+    def _create_async_runtime(self):
+        """asyncio 运行时, 落库在它的线程池中同步执行, 不再使用写线程"""
+        if self.format_windows is None:
+            self.format_windows = self._create_sorted_datas()
+        async_conf = conf.settings['data'].get('asyncio') or {}
+        schedule_conf = conf.settings['data'].get('schedule') or {}
+        return AsyncCollectorRuntime(self.collect_windows, self.collect_keyMouses, self.format_windows,
+                                     rollup=self.rollup,
+                                     rollup_minutes=(conf.settings['db'].get('rollup') or {}).get('interval_minutes', 10),
+                                     exporter=self.metricsExporter,
+                                     max_workers=async_conf.get('max_workers', 2),
+                                     input_drain_ms=async_conf.get('input_drain_ms', 100),
+                                     misfire_grace_ratio=schedule_conf.get('misfire_grace_ratio', 0.5))
+
+    def _create_key_mouse_data(self):
+        """键鼠采集, 按配置 data.collect.timeline_seconds 保留按秒的输入时间线"""
+        return KeyMouseData(backend=self.backend, foreground=self.foreground,
+                            timeline_seconds=conf.settings['data']['collect'].get('timeline_seconds', 3600))
+
+    def _create_windows_data(self):
+        """窗口采集, 按配置 data.collect.change_detection 开启变化检测"""
+        collect_conf = conf.settings['data']['collect']
+        change_conf = collect_conf.get('change_detection') or {}
+        change_threshold = change_conf.get('rss_threshold', 0.05) if change_conf.get('enabled', False) else None
+        return WindowsData(second=collect_conf['window_second'], backend=self.backend, foreground=self.foreground,
+                           sampler=self._create_sampler(), change_threshold=change_threshold,
+                           max_age_ticks=change_conf.get('max_age_ticks', 12))
+
+    def _create_worker(self):
+        """按配置 data.collect.worker 创建进程外采集, 未启用或使用 asyncio 运行时时返回 None"""
+        worker_conf = conf.settings['data']['collect'].get('worker') or {}
+        if not worker_conf.get('enabled', False):
+            return None
+        if self.runtime != 'threads':
+            logging.getLogger(__name__).warning("进程外采集只用于 threads 运行时, 已忽略")
+            return None
+        return SharedMemoryCollector(self.collect_windows, self.collect_keyMouses, conf.settings,
+                                     slots=worker_conf.get('slots', 4096),
+                                     poll_ms=worker_conf.get('poll_ms', 50),
+                                     max_restarts=worker_conf.get('max_restarts', 3),
+                                     fallback=self._collect_in_process)
+
+    def _create_sampler(self):
+        """按配置 data.collect.adaptive 创建自适应采样, 以键鼠事件数作为活动信号, 未启用时返回 None"""
+        adaptive_conf = conf.settings['data']['collect'].get('adaptive') or {}
+        if not adaptive_conf.get('enabled', False):
+            return None
+        key_mouses = self.collect_keyMouses
+        return AdaptiveSampler(max(conf.settings['data']['collect']['window_second'], 5),
+                               max_second=adaptive_conf.get('max_second', 60),
+                               activity=lambda: key_mouses.activityCounters)
+
+    @staticmethod
+    def _create_writer():
+        """按配置 db.writer 创建异步落库线程, 未启用时返回 None"""
+        writer_conf = conf.settings['db'].get('writer') or {}
+        if not writer_conf.get('enabled', False):
+            return None
+        spill_dir = None
+        if writer_conf.get('spill', True):
+            spill_dir = os.path.join(os.path.dirname(db.sqlite.get_db_file_path()), 'spill')
+        return StorageWriter(max_queue=writer_conf.get('max_queue', 16),
+                             max_batch=writer_conf.get('max_batch', 8),
+                             block_timeout=writer_conf.get('block_timeout_second', 5),
+                             spill_dir=spill_dir,
+                             max_retry_second=writer_conf.get('spill_retry_max_second', 300))
+
+    @staticmethod
+    def _create_rollup():
+        """按配置 db.rollup 创建汇总与保留任务, 未启用时返回 None"""
+        rollup_conf = conf.settings['db'].get('rollup') or {}
+        if not rollup_conf.get('enabled', False):
+            return None
+        return RollupEngine(grace_minutes=rollup_conf.get('grace_minutes', 10),
+                            raw_retention_days=rollup_conf.get('raw_retention_days', 0),
+                            hourly_retention_days=rollup_conf.get('hourly_retention_days', 400),
+                            vacuum_pages=rollup_conf.get('vacuum_pages', 2000),
+                            convert_auto_vacuum=rollup_conf.get('convert_auto_vacuum', False))
+
+    @staticmethod
+    def _create_metrics_exporter():
+        """按配置 data.metrics 启用指标, 配置了 file_name 时创建导出线程"""
+        metrics_conf = conf.settings['data'].get('metrics') or {}
+        metrics.configure(metrics_conf.get('enabled', False))
+        if not metrics.registry.enabled or not metrics_conf.get('file_name'):
+            return None
+        path = os.path.join(os.path.dirname(os.path.abspath(logger.__file__)), metrics_conf['file_name'])
+        return metrics.MetricsExporter(path, interval=metrics_conf.get('interval_second', 15))
+
+    def metrics(self):
+        """当前的指标快照, 见 data.metrics.Registry.snapshot"""
+        snapshot = metrics.snapshot()
+        writer = self.format_windows.writer if self.format_windows is not None else None
+        if writer is not None:
+            snapshot["writer"] = writer.stats()
+        if self.asyncRuntime is not None:
+            snapshot["scheduler"] = self.asyncRuntime.lateness()
+        else:
+            snapshot["scheduler"] = schedule.get_runtime().lateness()
+        if self.worker is not None and self.worker.workerMetrics is not None:
+            snapshot["worker"] = self.worker.workerMetrics
+        return snapshot
+
     def start(self):
+        # 先建好数据库, 表结构或权限问题在启动时暴露, 而不是第一次落库时
+        db.sqlite.get_db_manager()
+        if self.runtime == 'asyncio':
+            if self.asyncRuntime is None:
+                self.asyncRuntime = self._create_async_runtime()
+            self.asyncRuntime.start()
+            return
+        if self.metricsExporter is not None:
+            self.metricsExporter.start()
         self._collect()
-        time.sleep(config['data']['collect']['window_second'])
+        # 采集与落库任务都对齐到整点边界, 落库不必等第一个 tick
         self._sort()
+        if self.rollup is not None:
+            self.rollup.start(conf.settings['db']['rollup'].get('interval_minutes', 10))
     def stop(self):
-        self.collect_windows.stop_collect()
-        self.collect_keyMouses.stop_collect()
+        if self.asyncRuntime is not None:
+            self.asyncRuntime.stop()
+            if self.metricsExporter is not None:
+                self.metricsExporter.write()
+            return
+        if self.worker is not None:
+            self.worker.stop()
+        if self.worker is None or self.worker.fellBack:
+            self.collect_windows.stop_collect()
+            self.collect_keyMouses.stop_collect()
         self.format_windows.stop_sort()
+        if self.rollup is not None:
+            self.rollup.stop()
+        if self.metricsExporter is not None:
+            self.metricsExporter.stop()
 
 
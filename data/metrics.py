@@ -0,0 +1,270 @@
+"""
+运行指标
+metrics.py: 采集、整理和落库各阶段的耗时与计数
+- Registry: 进程内的计数器和耗时直方图, 未启用时每个埋点只做一次属性判断
+- MetricsExporter: 后台线程按间隔把指标写成 Prometheus 文本格式的文件
+模块级的 inc / observe / timer / snapshot 使用共享的 registry。
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+log = logging.getLogger(__name__)
+
+PREFIX = "v_chat_"
+# 耗时直方图的桶上界(秒)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 指标名 -> (类型, 说明)
+HELP = {
+    "stage_duration_seconds": ("histogram", "各处理阶段的耗时"),
+    "job_lateness_seconds": ("histogram", "定时任务实际开始时间相对计划时间的延迟"),
+    "hook_latency_seconds": ("histogram", "键鼠事件从应当送达到回调返回的延迟"),
+    "ticks_total": ("counter", "窗口采集 tick 数"),
+    "ticks_skipped_total": ("counter", "自适应采样跳过的 tick 数"),
+    "windows_total": ("counter", "采集到的窗口数"),
+    "processes_total": ("counter", "采集到的进程数"),
+    "processes_unchanged_total": ("counter", "变化检测模式下复用上一次采样的进程数"),
+    "processes_dropped_total": ("counter", "采样时已退出或无权访问而被跳过的进程数"),
+    "input_events_total": ("counter", "键鼠事件数"),
+    "rows_total": ("counter", "写入数据库的行数"),
+    "scheduler_misfires_total": ("counter", "错过执行时间的定时任务次数"),
+    "ring_full_total": ("counter", "共享内存环形缓冲区已满而被丢弃或推迟的发布次数"),
+    "worker_restarts_total": ("counter", "采集进程意外退出的次数"),
+    "shm_truncated_total": ("counter", "采集进程发布时超过定长而被截断的字段数"),
+    "shm_bad_records_total": ("counter", "主进程处理时出错而被丢弃的共享内存记录数"),
+}
+
+# 直方图指标名 -> 标签名
+HISTOGRAM_LABELS = {
+    "stage_duration_seconds": "stage",
+    "job_lateness_seconds": "job",
+    "hook_latency_seconds": "source",
+}
+
+
+def _label_key(labels):
+    if not labels:
+        return ""
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        # 最后一个为 +Inf 桶
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('registry', 'stage', 'started')
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class Registry:
+    """
+    计数器以 (指标名, 标签) 为键, 直方图以 (指标名, 标签值) 为键, 都在第一次使用时创建。
+    埋点路径上只有一把锁和几次整数自增。
+    """
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (指标名, 标签字符串) -> 数值
+        self._counters = {}
+        # (指标名, 标签值) -> Histogram
+        self._histograms = {}
+
+    def inc(self, name, amount=1, labels=None):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, stage, seconds, name="stage_duration_seconds"):
+        """
+        记录一次耗时(秒)
+        :param stage: 直方图的标签值, 阶段耗时为阶段名, 任务延迟为任务 id
+        """
+        if not self.enabled:
+            return
+        key = (name, stage)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def timer(self, stage):
+        """with registry.timer("collect_window"): ... 记录代码块的耗时"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def snapshot(self):
+        """
+        :return: {"counters": {指标名: {标签: 数值}},
+                  "histograms": {指标名: {标签值: {count, sum_ms, avg_ms, buckets}}}}
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (histogram.bounds, list(histogram.counts), histogram.sum, histogram.count)
+                          for key, histogram in self._histograms.items()}
+        result = {"counters": {}, "histograms": {}}
+        for (name, labels), value in counters.items():
+            result["counters"].setdefault(name, {})[labels] = value
+        for (name, stage), (bounds, counts, total, count) in histograms.items():
+            result["histograms"].setdefault(name, {})[stage] = {
+                "count": count,
+                "sum_ms": total * 1000,
+                "avg_ms": total / count * 1000 if count else 0.0,
+                "buckets": dict(zip([*bounds, float("inf")], counts)),
+            }
+        return result
+
+    def to_prometheus(self):
+        """Prometheus 文本格式(0.0.4)"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, histogram.bounds, histogram.cumulative(), histogram.sum, histogram.count)
+                                for key, histogram in self._histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name in described:
+                return
+            described.add(name)
+            kind, text = HELP.get(name, ("counter", name))
+            lines.append(f"# HELP {PREFIX}{name} {text}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{PREFIX}{name}{{{labels}}} {value}" if labels else f"{PREFIX}{name} {value}")
+        for (name, stage), bounds, cumulative, total, count in histograms:
+            describe(name)
+            label = HISTOGRAM_LABELS.get(name, "stage")
+            for bound, value in zip([*bounds, "+Inf"], cumulative):
+                lines.append(f'{PREFIX}{name}_bucket{{{label}="{stage}",le="{bound}"}} {value}')
+            lines.append(f'{PREFIX}{name}_sum{{{label}="{stage}"}} {total}')
+            lines.append(f'{PREFIX}{name}_count{{{label}="{stage}"}} {count}')
+        lines.append("")
+        return "\n".join(lines)
+
+
+# 进程内共享的指标, 由 configure 启用
+registry = Registry()
+
+
+def configure(enabled):
+    registry.enabled = bool(enabled)
+
+
+def inc(name, amount=1, labels=None):
+    registry.inc(name, amount, labels)
+
+
+def observe(stage, seconds, name="stage_duration_seconds"):
+    registry.observe(stage, seconds, name)
+
+
+def timer(stage):
+    return registry.timer(stage)
+
+
+def snapshot():
+    return registry.snapshot()
+
+
+class MetricsExporter:
+    """
+    每 interval 秒把 registry 写到 path, 先写临时文件再替换, 读取方不会看到写了一半的文件。
+    可以作为 node_exporter 的 textfile collector 输入。
+    """
+    def __init__(self, path, interval=15, registry_=None):
+        self.path = path
+        self.interval = max(interval, 1)
+        self.registry = registry_ if registry_ is not None else registry
+        self._stop = threading.Event()
+        self._thread = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止线程并写出最后一次结果"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.write()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        try:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+                file.write(self.registry.to_prometheus())
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            log.warning(f"写入指标文件 {self.path} 失败: {e}")
@@ -0,0 +1,190 @@
+"""
+Linux 进程采样
+procfs.py: 直接读取 /proc/<pid>/stat, statm, io, status, 不构造 psutil.Process 对象
+- ProcfsProcessSampler: 与 PsutilProcessSampler 接口一致, 返回相同结构的采样 dict
+"""
+import logging
+import os
+import pwd
+
+from data.backend import ProcessUnavailable
+
+log = logging.getLogger(__name__)
+
+# /proc/<pid>/stat 中的进程状态字母, 转换为与 psutil 相同的状态名
+_STATUS_NAMES = {
+    "R": "running",
+    "S": "sleeping",
+    "D": "disk-sleep",
+    "T": "stopped",
+    "t": "tracing-stop",
+    "Z": "zombie",
+    "X": "dead",
+    "x": "dead",
+    "K": "wake-kill",
+    "W": "waking",
+    "I": "idle",
+    "P": "parked",
+}
+
+
+class ProcfsProcessSampler:
+    """
+    批量读取 /proc 的进程采样器。
+    /proc 目录句柄在构造时打开一次, 之后所有文件都相对它打开, 避免每次解析完整路径。
+    字段对应关系: rss/vms 来自 statm, num_page_faults 为 minflt+majflt,
+    peak_wset 取 status 中的 VmHWM(峰值常驻内存), io 计数来自 io(无权读取时为 0)。
+    """
+
+    def __init__(self, proc_root="/proc"):
+        self.procRoot = proc_root
+        self._proc_fd = os.open(proc_root, os.O_RDONLY | os.O_DIRECTORY)
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._boot_time = self._read_boot_time()
+        self._mem_total = self._read_mem_total()
+        # uid -> 用户名, 用户很少, 常驻缓存
+        self._usernames = {}
+
+    def close(self):
+        if self._proc_fd is not None:
+            os.close(self._proc_fd)
+            self._proc_fd = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _read(self, path):
+        fd = os.open(path, os.O_RDONLY, dir_fd=self._proc_fd)
+        try:
+            return os.read(fd, 8192)
+        finally:
+            os.close(fd)
+
+    def _read_boot_time(self):
+        for line in self._read("stat").splitlines():
+            if line.startswith(b"btime"):
+                return float(line.split()[1])
+        return 0.0
+
+    def _read_mem_total(self):
+        for line in self._read("meminfo").splitlines():
+            if line.startswith(b"MemTotal:"):
+                return int(line.split()[1]) * 1024
+        return 0
+
+    def _username(self, uid):
+        name = self._usernames.get(uid)
+        if name is None:
+            try:
+                name = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                name = str(uid)
+            self._usernames[uid] = name
+        return name
+
+    def sample(self, pid, with_static=True):
+        try:
+            return self._sample(pid, with_static)
+        except (FileNotFoundError, ProcessLookupError, PermissionError) as e:
+            raise ProcessUnavailable(pid) from e
+
+    def sample_many(self, requests):
+        """
+        一次遍历采样多个进程。
+        :param requests: [(pid, with_static), ...]
+        :return: {pid: sample}, 已消失或无权访问的进程不出现在结果中
+        """
+        samples = {}
+        for pid, with_static in requests:
+            try:
+                samples[pid] = self._sample(pid, with_static)
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                log.log(1, f"Process with PID {pid} no longer exists or access is denied. Skipping.")
+        return samples
+
+    def probe_many(self, pids):
+        """
+        只读取 /proc/<pid>/stat 一个文件。
+        :return: {pid: (create_time, rss)}
+        """
+        probes = {}
+        page_size = self._page_size
+        for pid in pids:
+            try:
+                stat = self._read(str(pid) + "/stat")
+            except (FileNotFoundError, ProcessLookupError, PermissionError):
+                log.log(1, f"Process with PID {pid} no longer exists or access is denied. Skipping.")
+                continue
+            fields = stat[stat.rfind(b")") + 2:].split()
+            # 第 22 个字段 starttime, 第 24 个字段 rss(页数)
+            probes[pid] = (self._boot_time + int(fields[19]) / self._clock_ticks, int(fields[21]) * page_size)
+        return probes
+
+    def _sample(self, pid, with_static):
+        prefix = str(pid)
+        stat = self._read(prefix + "/stat")
+        statm = self._read(prefix + "/statm")
+        status = self._read(prefix + "/status")
+        try:
+            io = self._read(prefix + "/io")
+        except PermissionError:
+            io = b""
+
+        # comm 可能包含空格和括号, 以最后一个 ')' 为界
+        rpar = stat.rfind(b")")
+        comm = stat[stat.find(b"(") + 1:rpar]
+        fields = stat[rpar + 2:].split()
+        # fields[0] 为第 3 个字段 state, 第 n 个字段位于 fields[n - 3]
+        state = fields[0].decode()
+        page_faults = int(fields[7]) + int(fields[9])
+        create_time = self._boot_time + int(fields[19]) / self._clock_ticks
+
+        statm_fields = statm.split()
+        vms = int(statm_fields[0]) * self._page_size
+        rss = int(statm_fields[1]) * self._page_size
+
+        uid = 0
+        peak = 0
+        for line in status.splitlines():
+            if line.startswith(b"Uid:"):
+                uid = int(line.split()[1])
+            elif line.startswith(b"VmHWM:"):
+                peak = int(line.split()[1]) * 1024
+
+        io_values = {}
+        for line in io.splitlines():
+            key, _, value = line.partition(b":")
+            io_values[key] = value
+        sample = {
+            'pid': pid,
+            'create_time': create_time,
+            'status': _STATUS_NAMES.get(state, state),
+            'rss': rss,
+            'vms': vms,
+            'peak_wset': peak,
+            'num_page_faults': page_faults,
+            'memory_percent': rss / self._mem_total * 100 if self._mem_total else 0,
+            'read_count': int(io_values.get(b"syscr", 0)),
+            'write_count': int(io_values.get(b"syscw", 0)),
+            'read_bytes': int(io_values.get(b"read_bytes", 0)),
+            'write_bytes': int(io_values.get(b"write_bytes", 0)),
+        }
+        if with_static:
+            sample['name'] = comm.decode(errors="replace")
+            try:
+                sample['exe'] = os.readlink(prefix + "/exe", dir_fd=self._proc_fd)
+            except (PermissionError, FileNotFoundError):
+                sample['exe'] = None
+            sample['username'] = self._username(uid)
+        return sample
+
+    def parent_pid(self, pid):
+        try:
+            stat = self._read(str(pid) + "/stat")
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return 0
+        return int(stat[stat.rfind(b")") + 2:].split()[1])
@@ -1,39 +1,223 @@
-import timeit
-from datetime import time
-from time import sleep
+"""
+定时任务
+schedule.py: 进程内共享一个调度器
+- SchedulerRuntime: 一个 BackgroundScheduler + 一个小线程池, 本地时区;
+  间隔任务对齐到整点边界(5 秒任务在 :00/:05/... 触发, 分钟任务在整分触发),
+  错过执行时间的任务按 misfire_grace_time 补跑或跳过, 积压的多次执行合并为一次, 同一任务不并发
+- SchedulerManager: 各模块持有的任务句柄, 只启停自己注册的任务, 最后一个任务移除时关闭调度器,
+  共享的运行时随之作废, 之后注册的任务在新建的运行时上执行
+APScheduler 在第一次注册任务时才导入和创建。
+"""
+import logging
+import threading
+import time
+from datetime import datetime
 
 # 收集系统信息
 # [1.用户进程信息,2.用户前置窗口 3.调用音频组件进程 4.调用麦克风程序 5.键盘,鼠标活动与否]
 # 每分钟收集
 
-from apscheduler.executors.pool import ThreadPoolExecutor
-from apscheduler.jobstores.memory import MemoryJobStore
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+from data import metrics
 
-class SchedulerManager:
+log = logging.getLogger(__name__)
+
+
+def aligned_start(period, offset=0.0, now=None):
+    """
+    下一个 period 秒的整点边界再加上 offset 秒(可以为负), 返回带本地时区的 datetime。
+    边界按 unix 时间计算, 本地时区偏移是整分钟时与墙上时钟的整分对齐。
+    """
+    now = time.time() if now is None else now
+    phase = offset % period
+    start = (int((now - phase) // period) + 1) * period + phase
+    return datetime.fromtimestamp(start).astimezone()
+
+
+class LatenessTracker:
+    """各任务最近一次和最大的开始延迟, 同时记入 job_lateness_seconds 直方图"""
     def __init__(self):
-        # 任务存储类型
-        job_stores = {
-            'default': MemoryJobStore()
-        }
-
-        # 执行器,线程池执行
-        executors = {
-            'default': ThreadPoolExecutor(10),
-        }
-
-        # 调度器
-        scheduler = BackgroundScheduler(
-
-            jobstores=job_stores,
-            executors=executors,
-            timezone='Asia/Shanghai'
+        self._lock = threading.Lock()
+        # job_id -> (最近一次延迟秒数, 最大延迟秒数)
+        self._lateness = {}
+
+    def record(self, job_id, lateness):
+        with self._lock:
+            _, worst = self._lateness.get(job_id, (0.0, 0.0))
+            self._lateness[job_id] = (lateness, max(worst, lateness))
+        metrics.observe(job_id, max(lateness, 0.0), name="job_lateness_seconds")
+
+    def report(self):
+        """:return: {job_id: {"last_ms", "max_ms"}}"""
+        with self._lock:
+            return {job_id: {"last_ms": last * 1000, "max_ms": worst * 1000}
+                    for job_id, (last, worst) in self._lateness.items()}
+
+
+class SchedulerRuntime:
+    def __init__(self, max_workers=3, misfire_grace_ratio=0.5):
+        """
+        :param max_workers: 执行任务的线程数, 所有模块的任务共用
+        :param misfire_grace_ratio: 允许迟到的时间占任务间隔的比例, 超过则跳过这一次并计入 misfire
+        """
+        from apscheduler.events import EVENT_JOB_MISSED
+        from apscheduler.executors.pool import ThreadPoolExecutor
+        from apscheduler.jobstores.memory import MemoryJobStore
+        from apscheduler.schedulers.background import BackgroundScheduler
+
+        self.misfireGraceRatio = misfire_grace_ratio
+        # release 关闭后线程池不能再用, 不再接受任务
+        self.closed = False
+        self._lock = threading.Lock()
+        self._lateness = LatenessTracker()
+        self.scheduler = BackgroundScheduler(
+            jobstores={'default': MemoryJobStore()},
+            executors={'default': ThreadPoolExecutor(max(int(max_workers), 1))},
+            job_defaults={'coalesce': True, 'max_instances': 1},
         )
-        self.scheduler = scheduler
+        self.scheduler.add_listener(self._on_missed, EVENT_JOB_MISSED)
+
+    @staticmethod
+    def _on_missed(event):
+        log.warning(f"定时任务 {event.job_id} 错过了 {event.scheduled_run_time} 的执行")
+        metrics.inc("scheduler_misfires_total", labels={"job": event.job_id})
+
+    @property
+    def running(self):
+        return self.scheduler.running
+
+    def _timed(self, job_id, func, period, start):
+        """包装任务函数, 开始执行时按对齐的相位计算相对计划时间的延迟"""
+        phase = start.timestamp()
+
+        def run():
+            lateness = (time.time() - phase) % period
+            # 时钟被往回调时会略早于计划时间, 记为负数
+            if lateness > period / 2:
+                lateness -= period
+            self._lateness.record(job_id, lateness)
+            return func()
+        return run
+
+    def lateness(self):
+        """:return: {job_id: {"last_ms", "max_ms"}}"""
+        return self._lateness.report()
+
+    def _add_job(self, **kwargs):
+        """:return: False 表示运行时已关闭, 任务没有注册"""
+        with self._lock:
+            if self.closed:
+                return False
+            self.scheduler.add_job(**kwargs)
+            return True
+
+    def add_interval(self, job_id, seconds, func, offset=0.0):
+        """每 seconds 秒执行一次, 对齐到整点边界后偏移 offset 秒"""
+        from apscheduler.triggers.interval import IntervalTrigger
+        start = aligned_start(seconds, offset)
+        return self._add_job(
+            func=self._timed(job_id, func, seconds, start),
+            trigger=IntervalTrigger(seconds=seconds, start_date=start),
+            id=job_id,
+            name=job_id,
+            replace_existing=True,
+            misfire_grace_time=max(int(seconds * self.misfireGraceRatio), 1),
+        )
+
+    def add_cron(self, job_id, trigger, func):
+        return self._add_job(func=func, trigger=trigger, id=job_id, name=job_id, replace_existing=True)
+
+    def remove(self, job_id):
+        if self.scheduler.get_job(job_id) is not None:
+            self.scheduler.remove_job(job_id)
+
+    def start(self):
+        with self._lock:
+            if not self.closed and not self.scheduler.running:
+                self.scheduler.start()
+
+    def release(self):
+        """没有任务时关闭调度器和线程池; 若是共享的运行时, 下一次 get_runtime 会新建一个"""
+        global _runtime
+        with _runtime_lock, self._lock:
+            if self.closed or self.scheduler.get_jobs():
+                return
+            if self.scheduler.running:
+                self.scheduler.shutdown(wait=False)
+            self.closed = True
+            if _runtime is self:
+                _runtime = None
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    """进程内共享的调度运行时, 第一次使用时按配置 data.schedule 创建"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            from config import config
+            schedule_conf = config.settings['data'].get('schedule') or {}
+            _runtime = SchedulerRuntime(max_workers=schedule_conf.get('max_workers', 3),
+                                        misfire_grace_ratio=schedule_conf.get('misfire_grace_ratio', 0.5))
+        return _runtime
+
+
+class SchedulerManager:
+    """
+    一个模块的任务集合。任务在共享的调度器上执行, shutdown 只移除自己的任务,
+    并等待自己正在执行的任务结束。
+    """
+    def __init__(self, runtime=None):
+        self._runtime = runtime
+        # 未指定运行时的使用共享的那个, 它被关闭后换成新建的
+        self._shared = runtime is None
+        self.jobIds = []
+        self._idle = threading.Condition()
+        self._active = 0
+
+    @property
+    def runtime(self):
+        """未指定时为共享的运行时, 第一次注册任务时才创建"""
+        if self._runtime is None or (self._shared and self._runtime.closed):
+            self._runtime = get_runtime()
+        return self._runtime
+
+    @property
+    def scheduler(self):
+        return self.runtime.scheduler
+
+    @property
+    def running(self):
+        return bool(self.jobIds) and self.runtime.running
+
+    def _register(self, job_id, add):
+        """
+        :param add: add(runtime) 在运行时上注册任务, 返回 False 表示运行时已关闭
+        """
+        # 共享的运行时可能刚被其他模块的 shutdown 关闭, 换成新建的再注册
+        while not add(self.runtime):
+            if not self._shared:
+                raise RuntimeError(f"调度运行时已关闭, 无法注册任务 {job_id}")
+        self.jobIds.append(job_id)
+
+    def _tracked(self, function_def):
+        def run():
+            with self._idle:
+                self._active += 1
+            try:
+                return function_def()
+            finally:
+                with self._idle:
+                    self._active -= 1
+                    self._idle.notify_all()
+        return run
 
     def add_cron(self,cron_string,function_name,function_def):
 
+        from apscheduler.triggers.cron import CronTrigger
+
         # 触发器
         cron_char_list = cron_string.split(',')
 
@@ -43,21 +227,33 @@ class SchedulerManager:
         trigger = CronTrigger(second=cron_char_list[0], minute=cron_char_list[1], hour=cron_char_list[2],
                               day=cron_char_list[3], month=cron_char_list[4])
 
+        func = self._tracked(function_def)
+        self._register(function_name, lambda runtime: runtime.add_cron(function_name, trigger, func))
 
-
-        self.scheduler.add_job(
-            trigger=trigger,
-            func=function_def,
-            id=function_name,
-        )
-
-    def add_second(self,second,function_name,function_def):
+    def add_second(self,second,function_name,function_def,offset=0.0):
 
         if type(second) != int:
             return
-        self.scheduler.add_job(func=function_def,id=function_name,trigger='interval',seconds=second)
+        func = self._tracked(function_def)
+        self._register(function_name, lambda runtime: runtime.add_interval(function_name, second, func, offset))
 
-    def add_minute(self,minute,function_name,function_def):
+    def add_minute(self,minute,function_name,function_def,offset=0.0):
+        """:param offset: 相对整分边界的偏移秒数, 可以为负"""
         if type(minute) != int:
             return
-        self.scheduler.add_job(func=function_def,id=function_name,trigger='interval',minutes=minute)
\ No newline at end of file
+        func = self._tracked(function_def)
+        self._register(function_name,
+                       lambda runtime: runtime.add_interval(function_name, minute * 60, func, offset))
+
+    def start(self):
+        self.runtime.start()
+
+    def shutdown(self, wait=True):
+        """移除本模块的任务, wait 为 True 时等待正在执行的任务结束"""
+        for job_id in self.jobIds:
+            self.runtime.remove(job_id)
+        self.jobIds = []
+        if wait:
+            with self._idle:
+                self._idle.wait_for(lambda: self._active == 0)
+        self.runtime.release()
@@ -0,0 +1,665 @@
+"""
+进程外采集
+shm.py: 窗口/进程采样和键鼠钩子运行在独立的工作进程里, 主进程只做整理和落库,
+merge_data 或 SQLite 提交占住 GIL 时不会拖慢钩子回调
+- RingBuffer: multiprocessing.shared_memory 上的单生产者单消费者环形缓冲区, 定长槽位, 头部保存写/读序号
+- 记录: 每条记录占一个槽位, 第一个字节为类型, 见 TICK / PROCESS / WINDOW / TICK_END / INPUT / KEYS /
+  KEY_NAME / FOREGROUND; 字符串按 UTF-8 截断到定长字段(标题和路径 256 字节, 名称 64 字节), 每个窗口最多带
+  MAX_WINDOW_PIDS 个 pid, 截断的字段数记在缓冲区头部
+- run_worker: 工作进程入口, 按 window_second 发布 tick, 按 publish_ms 发布键鼠计数和前台切换
+- SharedMemoryCollector: 主进程端, 启动工作进程, 消费线程把记录还原为 WindowInfo 和计数,
+  交给 WindowsData.update_window_infos / InputCounters.merge / ForegroundTracker.switch_to;
+  工作进程意外退出时重启, 超过次数后改为在主进程内采集
+缓冲区满时 tick 被丢弃(下一个 tick 完整发布), 键鼠计数留在工作进程中下次再发; 丢弃和推迟的次数记在缓冲区头部,
+由主进程计入指标并告警。记录数超过槽位数的 tick 分批写入, 等主进程读走前一批再写下一批。
+主进程逐条处理记录, 一条记录出错只丢弃这一条。
+"""
+import logging
+import math
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from data import counter
+from data import metrics
+from data.collect import ProcessInfo, WindowInfo, WindowMarker
+
+log = logging.getLogger(__name__)
+
+SLOT_SIZE = 512
+# 写序号, 读序号, 槽位数, 槽位大小, 丢弃的 tick 数, 推迟的键鼠发布数, 截断的字段数;
+# 序号只增不减, 槽位下标为序号对槽位数取模. 读序号由消费者写, 其余由生产者写
+_HEADER = struct.Struct("<QQIIQQQ")
+_HEADER_SIZE = 64
+_DROPPED_OFFSET = 24
+_DEFERRED_OFFSET = 32
+_TRUNCATED_OFFSET = 40
+
+# 记录类型
+TICK = 1
+PROCESS = 2
+WINDOW = 3
+TICK_END = 4
+INPUT = 5
+KEYS = 6
+KEY_NAME = 7
+FOREGROUND = 8
+
+# 类型, tick 序号, 采集时间戳, 本次快照代表的秒数
+_TICK = struct.Struct("<B7xqdd")
+# 类型, pid, create_time, rss, vms, peak_wset, num_page_faults, memory_percent,
+# read_count, write_count, read_bytes, write_bytes, status, name, username, exe
+_PROCESS = struct.Struct("<B3xIdQQQQdQQQQ16s64s64s256s")
+# 类型, 标志位, pid 数, hwnd, startTime(NaN 为 None), 标题, pids
+MAX_WINDOW_PIDS = 32
+_WINDOW = struct.Struct(f"<BBH4xqd256s{MAX_WINDOW_PIDS}I")
+_TICK_END = struct.Struct("<B7xq")
+# 类型, hwnd, 事件时间戳, 各计数器(顺序同 counter.KEY_PRESS 等偏移)
+_INPUT = struct.Struct(f"<B7xqd{counter.SLOT_WIDTH}I")
+# 类型, 条目数, hwnd, 按键编码, 次数
+MAX_KEY_PAIRS = 60
+_KEYS = struct.Struct(f"<BxH4xq{MAX_KEY_PAIRS}H{MAX_KEY_PAIRS}I")
+# 类型, 工作进程内的按键编码, 按键名称
+_KEY_NAME = struct.Struct("<BxH4x64s")
+# 类型, hwnd, 切换时间戳
+_FOREGROUND = struct.Struct("<B7xqd")
+
+# WINDOW 的标志位
+_MAIN = 1
+_MEDIA = 2
+_MICRO = 4
+_CAMERA = 8
+_SHARE_MEDIA = 16
+_SHARE_MICRO = 32
+_SHARE_CAMERA = 64
+_UNCHANGED = 128
+_WINDOW_FLAGS = (("isMainWindow", _MAIN), ("isUseMedia", _MEDIA), ("isUseMicroPhone", _MICRO),
+                 ("isUseCamera", _CAMERA), ("isShareMedia", _SHARE_MEDIA),
+                 ("isShareMicroPhone", _SHARE_MICRO), ("isShareCamera", _SHARE_CAMERA))
+
+
+# 本进程编码时被截断的字段数(字符串超长或 pid 超过 MAX_WINDOW_PIDS), 工作进程发布时写入缓冲区头部
+_truncated = 0
+
+
+def _text(value, size):
+    global _truncated
+    raw = (value or "").encode("utf-8")
+    if len(raw) > size:
+        _truncated += 1
+        return raw[:size]
+    return raw
+
+
+def _untext(raw):
+    # 截断可能落在多字节字符中间, 丢弃残缺的部分
+    return raw.rstrip(b"\0").decode("utf-8", "ignore")
+
+
+class RingBuffer:
+    """
+    生产者只写槽位和写序号, 消费者只写读序号, 两边不需要锁。
+    一批记录先写入槽位再推进写序号, 消费者看不到写了一半的批次。
+    """
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        _, _, self.slots, self.slotSize, _, _, _ = _HEADER.unpack_from(shm.buf, 0)
+
+    @classmethod
+    def create(cls, slots=4096, slot_size=SLOT_SIZE):
+        shm = shared_memory.SharedMemory(create=True, size=_HEADER_SIZE + slots * slot_size)
+        _HEADER.pack_into(shm.buf, 0, 0, 0, slots, slot_size, 0, 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _sequences(self):
+        write, read, _, _, _, _, _ = _HEADER.unpack_from(self.shm.buf, 0)
+        return write, read
+
+    def losses(self):
+        """:return: (丢弃的 tick 数, 推迟的键鼠发布数, 截断的字段数), 自缓冲区创建起累计"""
+        _, _, _, _, dropped, deferred, truncated = _HEADER.unpack_from(self.shm.buf, 0)
+        return dropped, deferred, truncated
+
+    def _add(self, offset, amount):
+        value, = struct.unpack_from("<Q", self.shm.buf, offset)
+        struct.pack_into("<Q", self.shm.buf, offset, value + amount)
+
+    def count_loss(self, tick):
+        """生产者记录一次丢弃(tick=True)或推迟(tick=False)"""
+        self._add(_DROPPED_OFFSET if tick else _DEFERRED_OFFSET, 1)
+
+    def count_truncated(self, amount):
+        """生产者记录被截断的字段数"""
+        self._add(_TRUNCATED_OFFSET, amount)
+
+    def free(self):
+        write, read = self._sequences()
+        return self.slots - (write - read)
+
+    def push(self, records):
+        """
+        写入一批记录, 空间不足时一条都不写。
+        :param records: 每条不超过 slotSize 字节的 bytes
+        :return: 是否写入
+        """
+        write, read = self._sequences()
+        if self.slots - (write - read) < len(records):
+            return False
+        buf = self.shm.buf
+        slots, size = self.slots, self.slotSize
+        for seq, record in enumerate(records, write):
+            offset = _HEADER_SIZE + (seq % slots) * size
+            buf[offset:offset + len(record)] = record
+        struct.pack_into("<Q", buf, 0, write + len(records))
+        return True
+
+    def pop_all(self):
+        """:return: 已发布但还没读取的记录(bytes), 读取后推进读序号"""
+        write, read = self._sequences()
+        if write == read:
+            return []
+        buf = self.shm.buf
+        slots, size = self.slots, self.slotSize
+        records = []
+        for seq in range(read, write):
+            offset = _HEADER_SIZE + (seq % slots) * size
+            records.append(bytes(buf[offset:offset + size]))
+        struct.pack_into("<Q", buf, 8, write)
+        return records
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# 编码(工作进程)
+
+def encode_tick(tick, windows):
+    """一次快照编码为 TICK, PROCESS..., WINDOW..., TICK_END"""
+    global _truncated
+    first = windows[0] if windows else None
+    timestamp = first.whichTime.timestamp() if first is not None and first.whichTime else time.time()
+    interval = (first.interval if first is not None else None) or 0.0
+    records = [_TICK.pack(TICK, tick, timestamp, interval)]
+    # 本 tick 完整采样的窗口引用到的进程, 同一个 ProcessInfo 只发布一次
+    sent = set()
+    for window in windows:
+        if window.unchanged:
+            continue
+        for process_info in window.processInfos:
+            if id(process_info) in sent:
+                continue
+            sent.add(id(process_info))
+            memory, io = process_info.memoryUsage, process_info.ioUsage
+            records.append(_PROCESS.pack(
+                PROCESS, process_info.pid, process_info.startTime or 0.0,
+                memory.rss or 0, memory.vms or 0, memory.peakWSet or 0, memory.numPageFault or 0,
+                memory.memoryPercent or 0.0,
+                io.RCallNum or 0, io.WCallNum or 0, io.RByteNum or 0, io.WByteNum or 0,
+                _text(process_info.status, 16), _text(process_info.name, 64),
+                _text(process_info.username, 64), _text(process_info.path, 256)))
+    for window in windows:
+        flags = _UNCHANGED if window.unchanged else 0
+        for attribute, bit in _WINDOW_FLAGS:
+            if getattr(window, attribute):
+                flags |= bit
+        pids = list(window.pids)
+        if len(pids) > MAX_WINDOW_PIDS:
+            _truncated += 1
+            pids = pids[:MAX_WINDOW_PIDS]
+        start_time = window.startTime if window.startTime is not None else math.nan
+        records.append(_WINDOW.pack(WINDOW, flags, len(pids), window.windowId, start_time,
+                                    _text(window.windowTitle, 256),
+                                    *pids, *([0] * (MAX_WINDOW_PIDS - len(pids)))))
+    records.append(_TICK_END.pack(TICK_END, tick))
+    return records
+
+
+def encode_inputs(buf, timestamp, names_from=0):
+    """
+    一个 InputCounters 缓冲区编码为 KEY_NAME..., INPUT..., KEYS...
+    :param timestamp: 缓冲区内事件的发生时间, 主进程按它记入时间线
+    :param names_from: 已发布过名称的按键编码数, 之后新出现的编码先发布名称
+    :return: (记录列表, 已发布名称的编码数)
+    """
+    records = []
+    names = counter.key_codes.names
+    for code in range(names_from, len(names)):
+        records.append(_KEY_NAME.pack(KEY_NAME, code, _text(names[code], 64)))
+    counts = buf.counts
+    for slot, hwnd in enumerate(buf.hwnds):
+        base = slot * counter.SLOT_WIDTH
+        records.append(_INPUT.pack(INPUT, hwnd, timestamp, *counts[base:base + counter.SLOT_WIDTH]))
+        if not counts[base + counter.KEY_PRESS]:
+            continue
+        pairs = [(code, count) for code, count in enumerate(buf.histograms[slot]) if count]
+        for start in range(0, len(pairs), MAX_KEY_PAIRS):
+            chunk = pairs[start:start + MAX_KEY_PAIRS]
+            padding = [0] * (MAX_KEY_PAIRS - len(chunk))
+            records.append(_KEYS.pack(KEYS, len(chunk), hwnd,
+                                      *(code for code, _ in chunk), *padding,
+                                      *(count for _, count in chunk), *padding))
+    return records, len(names)
+
+
+# 工作进程
+
+class _Worker:
+    def __init__(self, ring, settings, stop_event):
+        from data import backend as platform_backend
+        from data.adaptive import AdaptiveSampler
+        from data.collect import KeyMouseData, WindowsData
+        from data.foreground import ForegroundTracker
+
+        self.ring = ring
+        self.stopEvent = stop_event
+        collect_conf = settings['data']['collect']
+        worker_conf = collect_conf.get('worker') or {}
+        self.publishSecond = max(worker_conf.get('publish_ms', 100), 10) / 1000
+        self.backend = platform_backend.create_backend(settings)
+        self.foreground = ForegroundTracker(self.backend, poll_ms=collect_conf.get('foreground_poll_ms', 100))
+        # 时间线由主进程按 INPUT 记录的时间戳记录, 工作进程不需要
+        self.keyMouses = KeyMouseData(backend=self.backend, foreground=self.foreground, timeline_seconds=0)
+        # 计数每次发布后清零, 自适应采样的活动信号用累计的事件数
+        self._published_events = 0
+        adaptive_conf = collect_conf.get('adaptive') or {}
+        sampler = None
+        if adaptive_conf.get('enabled', False):
+            sampler = AdaptiveSampler(max(collect_conf['window_second'], 5),
+                                      max_second=adaptive_conf.get('max_second', 60),
+                                      activity=lambda: self._published_events + self.keyMouses.activityCounters)
+        change_conf = collect_conf.get('change_detection') or {}
+        self.windows = WindowsData(second=collect_conf['window_second'], backend=self.backend,
+                                   foreground=self.foreground, sampler=sampler,
+                                   change_threshold=change_conf.get('rss_threshold', 0.05)
+                                   if change_conf.get('enabled', False) else None,
+                                   max_age_ticks=change_conf.get('max_age_ticks', 12))
+        self._ring_lock = threading.Lock()
+        self._names_published = 0
+        # 已写入缓冲区头部的截断字段数
+        self._truncated = 0
+        self._pending_inputs = []
+        # 上一次取出键鼠计数的时间, 本次取出的事件发生在它之后
+        self._inputs_since = time.time()
+        self._tick = 0
+
+    def _push(self, records):
+        with self._ring_lock:
+            if _truncated != self._truncated:
+                self.ring.count_truncated(_truncated - self._truncated)
+                self._truncated = _truncated
+            return self.ring.push(records)
+
+    def run(self):
+        from data.schedule import aligned_start
+
+        # 前台由发布线程轮询, 不另起线程
+        self.foreground.start(own_thread=False)
+        self._push([_FOREGROUND.pack(FOREGROUND, self.foreground.hwnd, time.time())])
+        self.keyMouses.listening = True
+        self.backend.start_input_listeners(
+            on_press=self.keyMouses.key_on_press,
+            on_move=self.keyMouses.mouse_on_move,
+            on_click=self.keyMouses.mouse_on_click,
+            on_scroll=self.keyMouses.mouse_on_scroll)
+        publisher = threading.Thread(target=self._run_publish, name="shm-publisher", daemon=True)
+        publisher.start()
+
+        second = self.windows.second
+        due = aligned_start(second).timestamp()
+        while not self.stopEvent.wait(max(due - time.time(), 0)):
+            try:
+                self._publish_tick()
+            except Exception as e:
+                log.warning(f"采样失败: {e}")
+            due += second
+            now = time.time()
+            if due <= now:
+                due += ((now - due) // second + 1) * second
+
+        self.backend.stop_input_listeners()
+        self.keyMouses.listening = False
+        publisher.join()
+        self._publish_inputs()
+
+    def _publish_tick(self):
+        windows = self.windows.snapshot_windows()
+        if windows is None:
+            return
+        self._tick += 1
+        if not self._push_tick(encode_tick(self._tick, windows)):
+            with self._ring_lock:
+                self.ring.count_loss(tick=True)
+            # 主进程没有收到这次快照, 下一个 tick 不能只发标记
+            self.windows.forget_previous()
+
+    def _push_tick(self, records):
+        ring = self.ring
+        if len(records) <= ring.slots:
+            return self._push(records)
+        # 一次写不下: 分批写入, 每批等主进程腾出空间, 最多等一个采集间隔.
+        # 主进程在 TICK_END 才处理这个 tick, 中途放弃时它会在下一个 TICK 丢掉已收到的部分
+        chunk = max(ring.slots // 2, 1)
+        deadline = time.monotonic() + self.windows.second
+        for start in range(0, len(records), chunk):
+            part = records[start:start + chunk]
+            while not self._push(part):
+                if time.monotonic() >= deadline or self.stopEvent.wait(0.01):
+                    return False
+        return True
+
+    def _run_publish(self):
+        while not self.stopEvent.wait(self.publishSecond):
+            previous = self.foreground.hwnd
+            hwnd = self.foreground.refresh()
+            if hwnd != previous:
+                self._push([_FOREGROUND.pack(FOREGROUND, hwnd, time.time())])
+            self._publish_inputs()
+
+    def _publish_inputs(self):
+        counters = self.keyMouses.counters
+        now = time.time()
+        since, self._inputs_since = self._inputs_since, now
+        if not counters.total and not self._pending_inputs:
+            return
+        buf, total = counters.get_and_reset()
+        # 事件发生在 [since, now) 之间, 间隔为 publish_ms, 取中点
+        records, names_published = encode_inputs(buf, (since + now) / 2, self._names_published)
+        counters.recycle(buf)
+        self._published_events += total
+        self._names_published = names_published
+        records = self._pending_inputs + records
+        if self._push(records):
+            self._pending_inputs = []
+        else:
+            # 计数已从 InputCounters 取出, 留到下次和新的计数一起发布
+            with self._ring_lock:
+                self.ring.count_loss(tick=False)
+            self._pending_inputs = records
+
+
+def run_worker(ring_name, settings, stop_event, conn):
+    """
+    工作进程入口。
+    :param settings: 主进程的配置, 工作进程不再读取配置文件
+    :param conn: 退出前通过它把工作进程的指标快照交给主进程
+    """
+    import log.logger as logger
+    logger.setup_logger(settings['data']['log_name'] + "_worker")
+    metrics.configure((settings['data'].get('metrics') or {}).get('enabled', False))
+    ring = RingBuffer.attach(ring_name)
+    try:
+        _Worker(ring, settings, stop_event).run()
+    finally:
+        conn.send(metrics.snapshot())
+        conn.close()
+        ring.close()
+
+
+# 主进程
+
+class SharedMemoryCollector:
+    """
+    取代 WindowsData.start_collect 和 KeyMouseData.collect_events: 主进程不采样也不挂钩子,
+    只把工作进程发布的记录交给原有的 WindowsData / KeyMouseData, 整理和落库不变。
+    """
+    def __init__(self, win_datas, km_datas, settings, slots=4096, poll_ms=50, max_restarts=3, fallback=None):
+        """
+        :param settings: 传给工作进程的配置
+        :param slots: 环形缓冲区的槽位数
+        :param poll_ms: 消费线程读取缓冲区的间隔(毫秒)
+        :param max_restarts: 工作进程意外退出后最多重启的次数
+        :param fallback: 重启次数用尽后调用, 在主进程内开始采集; 为 None 时只记录错误
+        """
+        self.winDatas = win_datas
+        self.kmDatas = km_datas
+        self.foreground = win_datas.foreground
+        self.settings = settings
+        self.slots = slots
+        self.pollSecond = max(poll_ms, 5) / 1000
+        self.maxRestarts = max_restarts
+        self.fallback = fallback
+        self.restarts = 0
+        # 重启次数用尽, 已交给 fallback 在主进程内采集
+        self.fellBack = False
+        # 工作进程退出时交回的指标快照
+        self.workerMetrics = None
+        self.ring = None
+        self._process = None
+        self._stop_event = None
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+        # 重启工作进程与 stop 互斥
+        self._lock = threading.Lock()
+        # 已计入指标的丢弃/推迟/截断次数
+        self._losses = (0, 0, 0)
+        self._oversize_warned = False
+        # 当前 tick
+        self._tick_time = None
+        self._tick_interval = None
+        self._processes = {}
+        self._windows = []
+        # hwnd -> 最近一次完整发布的 WindowInfo, 用于还原 WindowMarker
+        self._previous = {}
+        self._current = {}
+        # 工作进程的按键编码 -> 本进程的按键编码
+        self._codes = {}
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        import multiprocessing
+        # Windows 只支持 spawn, 其他平台也使用 spawn, 工作进程不继承主进程的线程和锁
+        self._context = multiprocessing.get_context("spawn")
+        self.ring = RingBuffer.create(self.slots)
+        self._losses = self.ring.losses()
+        self._spawn()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="shm-consumer", daemon=True)
+        self._thread.start()
+
+    def _spawn(self):
+        # 每个工作进程一个新的事件: 被杀死的进程若正在 wait, 旧事件的 set 会一直等它醒来
+        self._stop_event = self._context.Event()
+        self._conn, child_conn = self._context.Pipe(duplex=False)
+        self._process = self._context.Process(target=run_worker, name="collector-worker", daemon=True,
+                                              args=(self.ring.name, self.settings, self._stop_event, child_conn))
+        self._process.start()
+        child_conn.close()
+
+    def stop(self, timeout=10):
+        """通知工作进程退出, 读完缓冲区中剩余的记录后释放共享内存"""
+        if self._thread is None:
+            return
+        with self._lock:
+            process = self._process
+            # 已改为主进程内采集时工作进程早已退出, 不能再 set 它的事件
+            if process is not None:
+                self._stop_event.set()
+        if process is not None:
+            if self._conn.poll(timeout):
+                try:
+                    self.workerMetrics = self._conn.recv()
+                except EOFError:
+                    pass
+            process.join(timeout)
+            if process.is_alive():
+                log.warning("采集进程未在超时时间内退出")
+                process.terminate()
+        self._process = None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.consume()
+        self.ring.close()
+        self.ring = None
+
+    def _run(self):
+        while not self._stop.wait(self.pollSecond):
+            try:
+                self.consume()
+            except Exception as e:
+                log.warning(f"读取采集记录失败: {e}")
+            process = self._process
+            if process is not None and not process.is_alive() and not self._handle_exit(process):
+                return
+
+    def _handle_exit(self, process):
+        """
+        工作进程意外退出: 在 max_restarts 次以内重启, 之后交给 fallback。
+        :return: 消费线程是否继续运行
+        """
+        with self._lock:
+            if self._stop_event.is_set():
+                return True
+            metrics.inc("worker_restarts_total")
+            # 新的工作进程从头发布按键名称和完整快照
+            self._codes = {}
+            self._previous = {}
+            if self.restarts < self.maxRestarts:
+                self.restarts += 1
+                log.error(f"采集进程意外退出(exitcode={process.exitcode}), 第 {self.restarts} 次重启")
+                self._spawn()
+                return True
+            log.error(f"采集进程意外退出(exitcode={process.exitcode}), 已重启 {self.restarts} 次, 改为在主进程内采集")
+            self._process = None
+            self.fellBack = True
+        if self.fallback is not None:
+            self.fallback()
+        return False
+
+    def consume(self):
+        """:return: 本次处理的记录数"""
+        records = self.ring.pop_all()
+        for record in records:
+            try:
+                self._apply(record)
+            except Exception as e:
+                # 只丢弃出错的这一条, 同一批的其他记录照常处理
+                metrics.inc("shm_bad_records_total", labels={"kind": record[0]})
+                log.warning(f"处理采集记录(类型 {record[0]})失败: {e}")
+        self._check_losses()
+        return len(records)
+
+    def _check_losses(self):
+        losses = self.ring.losses()
+        if losses == self._losses:
+            return
+        dropped, deferred, truncated = losses
+        last_dropped, last_deferred, last_truncated = self._losses
+        self._losses = losses
+        if dropped > last_dropped:
+            metrics.inc("ring_full_total", dropped - last_dropped, labels={"kind": "tick"})
+            log.warning(f"共享内存缓冲区已满, 采集进程丢弃了 {dropped - last_dropped} 个 tick, "
+                        f"可调大 data.collect.worker.slots")
+        if deferred > last_deferred:
+            metrics.inc("ring_full_total", deferred - last_deferred, labels={"kind": "input"})
+        if truncated > last_truncated:
+            metrics.inc("shm_truncated_total", truncated - last_truncated)
+            if not last_truncated:
+                log.warning(f"采集进程发布时截断了 {truncated} 个字段: 标题和路径超过 256 字节, 名称超过 64 字节, "
+                            f"或窗口的进程超过 {MAX_WINDOW_PIDS} 个")
+
+    def _apply(self, record):
+        kind = record[0]
+        if kind == PROCESS:
+            self._apply_process(record)
+        elif kind == WINDOW:
+            self._apply_window(record)
+        elif kind == TICK:
+            _, _, self._tick_time, self._tick_interval = _TICK.unpack_from(record)
+            self._processes = {}
+            self._windows = []
+            self._current = {}
+        elif kind == TICK_END:
+            records = len(self._processes) + len(self._windows) + 2
+            if records > self.ring.slots and not self._oversize_warned:
+                self._oversize_warned = True
+                log.warning(f"一个 tick 有 {records} 条记录, 超过缓冲区的 {self.ring.slots} 个槽位, 只能分批传输, "
+                            f"可调大 data.collect.worker.slots")
+            windows = self._windows
+            self._previous = self._current
+            self._windows = []
+            self._processes = {}
+            if windows:
+                self.winDatas.update_window_infos(windows)
+        elif kind == INPUT:
+            _, hwnd, timestamp, *counts = _INPUT.unpack_from(record)
+            self.kmDatas.counters.merge(hwnd, counts, now=timestamp)
+        elif kind == KEYS:
+            _, count, hwnd, *values = _KEYS.unpack_from(record)
+            codes = self._codes
+            # 工作进程重启后旧进程的记录可能引用还没发布名称的编码, 计入 "?" 键
+            unknown = None
+            key_counts = []
+            for i, code in enumerate(values[:count]):
+                local = codes.get(code)
+                if local is None:
+                    if unknown is None:
+                        unknown = counter.key_codes.intern("?")
+                    local = unknown
+                key_counts.append((local, values[MAX_KEY_PAIRS + i]))
+            # 按键次数已计入同一 hwnd 的 INPUT 记录, 这里只补直方图
+            self.kmDatas.counters.merge(hwnd, (), key_counts)
+        elif kind == KEY_NAME:
+            _, code, name = _KEY_NAME.unpack_from(record)
+            self._codes[code] = counter.key_codes.intern(_untext(name))
+        elif kind == FOREGROUND:
+            _, hwnd, timestamp = _FOREGROUND.unpack_from(record)
+            self.foreground.switch_to(hwnd, timestamp)
+
+    def _apply_process(self, record):
+        (_, pid, create_time, rss, vms, peak_wset, page_faults, memory_percent,
+         read_count, write_count, read_bytes, write_bytes, status, name, username, exe) = _PROCESS.unpack_from(record)
+        process_info = ProcessInfo()
+        process_info.pid = pid
+        process_info.startTime = create_time
+        process_info.status = _untext(status)
+        process_info.name = _untext(name)
+        process_info.username = _untext(username)
+        process_info.path = _untext(exe)
+        memory, io = process_info.memoryUsage, process_info.ioUsage
+        memory.rss, memory.vms, memory.peakWSet = rss, vms, peak_wset
+        memory.numPageFault, memory.memoryPercent = page_faults, memory_percent
+        io.RCallNum, io.WCallNum, io.RByteNum, io.WByteNum = read_count, write_count, read_bytes, write_bytes
+        self._processes[pid] = process_info
+
+    def _apply_window(self, record):
+        from datetime import datetime
+
+        _, flags, pid_count, hwnd, start_time, title, *pids = _WINDOW.unpack_from(record)
+        pids = tuple(pids[:pid_count])
+        if flags & _UNCHANGED:
+            base = self._previous.get(hwnd)
+            if base is None:
+                # 对应的完整快照没有送达, 工作进程会在下一个 tick 重新完整发布
+                return
+            window = WindowMarker(base)
+        else:
+            base = window = WindowInfo(hwnd, _untext(title), pids)
+            processes = self._processes
+            window.processInfos = [processes[pid] for pid in pids if pid in processes]
+            window.startTime = None if math.isnan(start_time) else start_time
+        self._current[hwnd] = base
+        for attribute, bit in _WINDOW_FLAGS:
+            if flags & bit:
+                setattr(window, attribute, True)
+        window.whichTime = datetime.fromtimestamp(self._tick_time)
+        window.interval = self._tick_interval or None
+        self._windows.append(window)
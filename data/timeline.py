@@ -0,0 +1,181 @@
+"""
+输入活动时间线
+timeline.py: 按秒记录键鼠活动的定长环形缓冲区
+- ActivityTimeline: 每秒一个桶(按键/点击/移动/滚轮次数 + 该秒最后一个事件所在的前台 hwnd),
+  预分配的 array, 下标为 unix 秒对容量取模, 桶的时间戳不是该秒时视为空桶, 不需要清理线程
+- 每分钟压缩为一个 60 位的位图, 第 i 位表示该分钟第 i 秒有输入, 落库到 minute_initiativeUse;
+  活动时长是位图中 1 的个数, 空闲间隔是连续的 0, 都是逐分钟在 60 位的字上做位运算,
+  跨分钟的空闲由 IdleRuns 按分钟顺序拼接
+"""
+import time
+from array import array
+
+from data import counter
+
+# 每秒桶内各计数的偏移
+KEYS = 0
+CLICKS = 1
+MOVES = 2
+SCROLLS = 3
+WIDTH = 4
+
+# 一分钟位图的位数与掩码
+MINUTE_BITS = 60
+MINUTE_MASK = (1 << MINUTE_BITS) - 1
+
+# counter 的计数偏移(KEY_PRESS, MOUSE_MOVE, ...) -> 桶内偏移
+_COLUMNS = [0] * counter.SLOT_WIDTH
+_COLUMNS[counter.KEY_PRESS] = KEYS
+_COLUMNS[counter.MOUSE_MOVE] = MOVES
+_COLUMNS[counter.MOUSE_SCROLL] = SCROLLS
+_COLUMNS[counter.MOUSE_LEFT_CLICK] = CLICKS
+_COLUMNS[counter.MOUSE_RIGHT_CLICK] = CLICKS
+_COLUMNS[counter.MOUSE_OTHER_CLICK] = CLICKS
+
+
+def popcount(bits):
+    """位图中 1 的个数, 即活动秒数"""
+    return bin(bits).count("1")
+
+
+def idle_runs(idle, min_length=1):
+    """
+    一分钟位图中连续 1 的区间。每个区间做几次移位, 只用于 60 位的字, 跨分钟用 IdleRuns。
+    :param idle: 空闲位图, 第 i 位为 1 表示第 i 秒空闲
+    :return: [(起始位, 长度)], 只保留长度不小于 min_length 的区间
+    """
+    runs = []
+    position = 0
+    while idle:
+        # 跳过低位的 0, 再数从这里开始的连续 1
+        skip = (idle & -idle).bit_length() - 1
+        idle >>= skip
+        position += skip
+        length = (idle ^ (idle + 1)).bit_length() - 1
+        if length >= min_length:
+            runs.append((position, length))
+        idle >>= length
+        position += length
+    return runs
+
+
+class IdleRuns:
+    """
+    按时间顺序逐分钟喂入空闲位图, 把首尾相接的分钟里的空闲区间拼成一段。
+    两次 add 的分钟不相邻(中间没有记录)时, 前一段在那里截断。
+    """
+    def __init__(self, min_length=1):
+        self.minLength = min_length
+        self.runs = []
+        # 尚未结束的区间: [起点秒, 长度], 它延伸到上一分钟的最后一秒
+        self._open = None
+
+    def add(self, second, idle):
+        """
+        :param second: 这一分钟第 0 位对应的秒(任意原点, 相邻分钟相差 60)
+        :param idle: 这一分钟的空闲位图
+        """
+        open_run = self._open
+        if open_run is not None and open_run[0] + open_run[1] != second:
+            self._close()
+            open_run = None
+        for start, length in idle_runs(idle & MINUTE_MASK):
+            if start == 0 and open_run is not None:
+                open_run[1] += length
+            else:
+                self._close()
+                open_run = self._open = [second + start, length]
+        if open_run is not None and open_run[0] + open_run[1] != second + MINUTE_BITS:
+            self._close()
+
+    def _close(self):
+        if self._open is not None and self._open[1] >= self.minLength:
+            self.runs.append(tuple(self._open))
+        self._open = None
+
+    def finish(self):
+        """:return: [(起点秒, 长度)], 按时间顺序"""
+        self._close()
+        return self.runs
+
+
+class ActivityTimeline:
+    """
+    由 InputCounters 在它的锁内调用 record, 所有写入都是串行的; 读取在锁外进行,
+    正在写入的那一秒可能读到旧值, 已经结束的秒不受影响。
+    """
+    def __init__(self, seconds=3600):
+        """
+        :param seconds: 保留的秒数, 超过的桶被新的秒覆盖
+        """
+        self.size = max(int(seconds), 60)
+        self.counts = array('L', [0]) * (self.size * WIDTH)
+        self.hwnds = array('q', [0]) * self.size
+        # 每个桶对应的 unix 秒, -1 为从未使用
+        self.stamps = array('q', [-1]) * self.size
+
+    def record(self, hwnd, offset, count=1, now=None, _time=time.time):
+        """
+        在钩子回调路径上, 每个事件一次。
+        :param offset: counter 的计数偏移, 如 counter.KEY_PRESS
+        """
+        second = int(_time() if now is None else now)
+        index = second % self.size
+        base = index * WIDTH
+        counts = self.counts
+        if self.stamps[index] != second:
+            # 先清零再改时间戳, 读取方不会把旧计数当成这一秒的
+            counts[base] = counts[base + 1] = counts[base + 2] = counts[base + 3] = 0
+            self.stamps[index] = second
+        counts[base + _COLUMNS[offset]] += count
+        self.hwnds[index] = hwnd or 0
+
+    def bucket(self, second):
+        """:return: (按键, 点击, 移动, 滚轮, hwnd), 该秒没有输入或已被覆盖时为 None"""
+        index = second % self.size
+        if self.stamps[index] != second:
+            return None
+        base = index * WIDTH
+        return (*self.counts[base:base + WIDTH], self.hwnds[index])
+
+    def bitmap(self, start, seconds=60, column=None):
+        """
+        [start, start + seconds) 的活动位图, 第 i 位对应 start + i 秒。
+        :param column: 只看一种输入(KEYS / CLICKS / MOVES / SCROLLS), 为 None 时任意输入都算
+        """
+        size, stamps, counts = self.size, self.stamps, self.counts
+        bits = 0
+        for i in range(min(seconds, size)):
+            second = start + i
+            index = second % size
+            if stamps[index] != second:
+                continue
+            base = index * WIDTH
+            if column is None:
+                active = counts[base] or counts[base + 1] or counts[base + 2] or counts[base + 3]
+            else:
+                active = counts[base + column]
+            if active:
+                bits |= 1 << i
+        return bits
+
+    def totals(self, start, seconds=60):
+        """[start, start + seconds) 内各种输入的次数, 顺序同 KEYS / CLICKS / MOVES / SCROLLS"""
+        totals = [0] * WIDTH
+        for second in range(start, start + min(seconds, self.size)):
+            index = second % self.size
+            if self.stamps[index] == second:
+                base = index * WIDTH
+                for column in range(WIDTH):
+                    totals[column] += self.counts[base + column]
+        return totals
+
+    def active_seconds_per_window(self, start, seconds=60):
+        """:return: {hwnd: 有输入的秒数}, 按每秒最后一个事件所在的前台窗口计"""
+        result = {}
+        for second in range(start, start + min(seconds, self.size)):
+            index = second % self.size
+            if self.stamps[index] == second:
+                hwnd = self.hwnds[index]
+                result[hwnd] = result.get(hwnd, 0) + 1
+        return result
@@ -0,0 +1,103 @@
+"""
+数据库连接管理
+connection.py: 进程内常驻的 SQLite 连接
+- ConnectionManager: 一个长期存在的写连接(WAL, synchronous=NORMAL, 缓存与 mmap 按配置),
+  以及按线程复用的只读连接, 供查询使用
+"""
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionManager:
+    """
+    写操作通过 writer() 串行使用同一个连接, 预编译语句由 sqlite3 的语句缓存按 SQL 文本复用,
+    所以调用方应使用模块级常量作为 SQL, 保证每次文本相同。
+    读操作通过 reader() 使用每个线程自己的只读连接, WAL 模式下读写互不阻塞。
+    """
+    def __init__(self, db_path, journal_mode="WAL", synchronous="NORMAL", cache_size_kb=8192,
+                 mmap_size_mb=64, cached_statements=128, auto_vacuum=None):
+        """
+        :param journal_mode: 为 None 时保持 SQLite 默认(DELETE)
+        :param synchronous: 为 None 时保持 SQLite 默认(FULL)
+        :param cache_size_kb: 页缓存大小, 为 None 时保持默认
+        :param mmap_size_mb: 内存映射大小, 为 None 或 0 时不使用 mmap
+        :param auto_vacuum: NONE / FULL / INCREMENTAL, 只对新建的数据库生效, 为 None 时保持默认
+        """
+        self.dbPath = db_path
+        self.journalMode = journal_mode
+        self.synchronous = synchronous
+        self.cacheSizeKb = cache_size_kb
+        self.mmapSizeMb = mmap_size_mb
+        self.cachedStatements = cached_statements
+        self.autoVacuum = auto_vacuum
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+    def _apply_pragmas(self, conn):
+        if self.cacheSizeKb:
+            # 负数表示以 KiB 为单位
+            conn.execute(f"PRAGMA cache_size = -{int(self.cacheSizeKb)}")
+        if self.mmapSizeMb:
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmapSizeMb) * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+    def _open_writer(self):
+        conn = sqlite3.connect(self.dbPath, check_same_thread=False, cached_statements=self.cachedStatements)
+        if self.autoVacuum:
+            # 必须在切换日志模式之前设置, 切换 WAL 会写入文件头
+            conn.execute(f"PRAGMA auto_vacuum = {self.autoVacuum}")
+        if self.journalMode:
+            mode = conn.execute(f"PRAGMA journal_mode = {self.journalMode}").fetchone()[0]
+            if mode.lower() != self.journalMode.lower():
+                logger.warning(f"journal_mode {self.journalMode} 设置失败, 当前为 {mode}")
+        if self.synchronous:
+            conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        self._apply_pragmas(conn)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        独占写连接。用法与原来的 "with conn:" 相同, 需要事务时在块内使用 "with conn:"。
+        """
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._open_writer()
+            yield self._writer
+
+    @contextmanager
+    def reader(self):
+        """当前线程的只读连接, 第一次使用时打开"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.dbPath}?mode=ro", uri=True, check_same_thread=False,
+                                   cached_statements=self.cachedStatements)
+            conn.execute("PRAGMA query_only = ON")
+            self._apply_pragmas(conn)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        yield conn
+
+    def checkpoint(self):
+        """把 WAL 中的内容合并回主库文件"""
+        with self.writer() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+        self._local = threading.local()
@@ -0,0 +1,114 @@
+"""
+维度表
+dimension.py: 进程身份、窗口标题和按键名称只在第一次出现时写入, 事实表只保存整数 ID
+- DimensionCache: 写连接使用的内存 ID 缓存, 同一个字符串在进程生命周期内只查询/插入一次
+"""
+
+SQL_SELECT_PROCESS_IDENTITY = "SELECT id FROM process_identity WHERE pid = ? AND create_time IS ?"
+
+SQL_INSERT_PROCESS_IDENTITY = """
+INSERT INTO process_identity (pid, create_time, name, path, username)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+SQL_SELECT_WINDOW_TITLE = "SELECT id FROM window_title WHERE title = ?"
+
+SQL_INSERT_WINDOW_TITLE = "INSERT INTO window_title (title) VALUES (?)"
+
+SQL_SELECT_KEY_NAME = "SELECT id FROM key_name WHERE name = ?"
+
+SQL_INSERT_KEY_NAME = "INSERT INTO key_name (name) VALUES (?)"
+
+
+class DimensionCache:
+    """
+    事务中新分配的 ID 先记在 pending 中, commit() 后才并入缓存;
+    事务回滚时调用 rollback() 丢弃, 避免缓存指向不存在的行。
+    缓存超过 max_entries 时整体清空, 之后的未命中会从数据库重新读回 ID。
+    """
+    def __init__(self, max_entries=100_000):
+        self.maxEntries = max_entries
+        self._processes = {}
+        self._titles = {}
+        self._keys = {}
+        self._pending_processes = {}
+        self._pending_titles = {}
+        self._pending_keys = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._processes) + len(self._titles) + len(self._keys)
+
+    def process_id(self, cursor, process_info):
+        """
+        :param process_info: format.ProcesSorted, 以 (pid, 创建时间) 标识, 避免 pid 复用
+        """
+        key = (process_info.pid, process_info.startTime)
+        identity_id = self._processes.get(key)
+        if identity_id is None:
+            identity_id = self._pending_processes.get(key)
+        if identity_id is not None:
+            self.hits += 1
+            return identity_id
+        self.misses += 1
+        row = cursor.execute(SQL_SELECT_PROCESS_IDENTITY, key).fetchone()
+        if row is None:
+            cursor.execute(SQL_INSERT_PROCESS_IDENTITY, (
+                process_info.pid, process_info.startTime,
+                process_info.name, process_info.path, process_info.username,
+            ))
+            identity_id = cursor.lastrowid
+        else:
+            identity_id = row[0]
+        self._pending_processes[key] = identity_id
+        return identity_id
+
+    def title_id(self, cursor, title):
+        return self._name_id(cursor, title, self._titles, self._pending_titles,
+                             SQL_SELECT_WINDOW_TITLE, SQL_INSERT_WINDOW_TITLE)
+
+    def key_id(self, cursor, name):
+        return self._name_id(cursor, name, self._keys, self._pending_keys,
+                             SQL_SELECT_KEY_NAME, SQL_INSERT_KEY_NAME)
+
+    def _name_id(self, cursor, name, cache, pending, select_sql, insert_sql):
+        name_id = cache.get(name)
+        if name_id is None:
+            name_id = pending.get(name)
+        if name_id is not None:
+            self.hits += 1
+            return name_id
+        self.misses += 1
+        row = cursor.execute(select_sql, (name,)).fetchone()
+        if row is None:
+            cursor.execute(insert_sql, (name,))
+            name_id = cursor.lastrowid
+        else:
+            name_id = row[0]
+        pending[name] = name_id
+        return name_id
+
+    def commit(self):
+        """事务提交成功后调用"""
+        pending = len(self._pending_processes) + len(self._pending_titles) + len(self._pending_keys)
+        if len(self) + pending > self.maxEntries:
+            self._processes.clear()
+            self._titles.clear()
+            self._keys.clear()
+        self._processes.update(self._pending_processes)
+        self._titles.update(self._pending_titles)
+        self._keys.update(self._pending_keys)
+        self.rollback()
+
+    def rollback(self):
+        """事务回滚后调用"""
+        self._pending_processes.clear()
+        self._pending_titles.clear()
+        self._pending_keys.clear()
+
+    def clear(self):
+        self.rollback()
+        self._processes.clear()
+        self._titles.clear()
+        self._keys.clear()
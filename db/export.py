@@ -0,0 +1,343 @@
+"""
+批量导出
+export.py: 按时间范围把 window_activity / process_snapshots 流式导出为 Parquet 或 gzip 压缩的 NDJSON
+- 读取兼容视图(window_activity_full / process_snapshots_full), 新旧记录的列一致
+- 按 id 做键集分页, 每块一条独立的查询, 不长时间持有读事务, 内存只与块大小有关
+- 安装了 pyarrow 时默认写 Parquet(每块一个 row group), 否则写 .ndjson.gz
+- 增量导出: export_state 按 (导出名, 表) 记录上次导出到的 id 或 which_minute, 文件完整写出后才更新.
+  落库是异步的, 队列积压或溢出文件写回时, 一分钟的行可能在那一分钟过去很久以后才提交;
+  id 水位(默认)不受影响, minute 水位只推进到 settled_minute, 不会越过还可能写入的分钟
+
+运行: python -m db.export window_activity --out export/ [--start ...] [--end ...] [--name analytics]
+"""
+import argparse
+import glob
+import gzip
+import json
+import logging
+import math
+import os
+import pickle
+import time
+from datetime import datetime, timedelta
+
+import config.config as conf
+
+logger = logging.getLogger(__name__)
+
+# pyarrow 导入较慢, 第一次需要时才导入
+pa = None
+pq = None
+_arrow_checked = False
+
+
+def _load_arrow():
+    global pa, pq, _arrow_checked
+    if not _arrow_checked:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            pa, pq = pyarrow, pyarrow.parquet
+        except ImportError:  # pragma: no cover - 取决于运行环境
+            pass
+        _arrow_checked = True
+    return pa is not None
+
+SQL_CREATE_EXPORT_STATE = """
+CREATE TABLE IF NOT EXISTS export_state (
+    name TEXT NOT NULL,               -- 导出任务名
+    table_name TEXT NOT NULL,
+    last_id INTEGER,                  -- 已导出的最大 id
+    last_minute TEXT,                 -- 已导出的 which_minute 上界(不含)
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (name, table_name)
+) WITHOUT ROWID;
+"""
+
+SQL_SELECT_EXPORT_STATE = "SELECT last_id, last_minute FROM export_state WHERE name = ? AND table_name = ?"
+
+SQL_SET_EXPORT_STATE = """
+INSERT INTO export_state (name, table_name, last_id, last_minute) VALUES (?, ?, ?, ?)
+ON CONFLICT (name, table_name) DO UPDATE SET
+    last_id = excluded.last_id, last_minute = excluded.last_minute, updated_at = CURRENT_TIMESTAMP
+"""
+
+# 列名 -> 类型, 查询时按类型 CAST, 保证每一块的类型一致(SQLite 的列可以混存不同类型)
+_WINDOW_ACTIVITY_COLUMNS = [
+    ("id", "int"), ("which_minute", "str"), ("window_hwnd", "int"), ("start_time", "str"),
+    ("window_titles", "str"), ("main_window_time", "float"),
+    ("media_use_time", "float"), ("micro_use_time", "float"), ("camera_use_time", "float"),
+    ("media_share_time", "float"), ("micro_share_time", "float"), ("camera_share_time", "float"),
+    ("keyboard_press_num", "int"), ("keyboard_press_list", "str"),
+    ("mouse_scroll_num", "int"), ("mouse_move_num", "int"), ("mouse_left_click_num", "int"),
+    ("mouse_right_click_num", "int"), ("mouse_other_click_num", "int"), ("created_at", "str"),
+]
+
+_PROCESS_SNAPSHOT_COLUMNS = [
+    ("id", "int"), ("which_minute", "str"), ("activity_id", "int"), ("pid", "int"),
+    ("name", "str"), ("path", "str"), ("username", "str"),
+    # 旧记录为文本形式的时间戳, 新记录为 process_identity.create_time
+    ("start_time", "float"), ("statuses", "str"),
+    ("avg_memory_percent", "float"), ("avg_rss", "float"), ("avg_vms", "float"),
+    ("avg_peak_wset", "float"), ("avg_num_page_fault", "float"),
+    ("total_read_call", "int"), ("total_write_call", "int"),
+    ("total_read_bytes", "int"), ("total_write_bytes", "int"),
+]
+
+# 可导出的表 -> (读取的视图, 列)
+TABLES = {
+    "window_activity": ("window_activity_full", _WINDOW_ACTIVITY_COLUMNS),
+    "process_snapshots": ("process_snapshots_full", _PROCESS_SNAPSHOT_COLUMNS),
+}
+
+_SQL_TYPES = {"int": "INTEGER", "float": "REAL", "str": "TEXT"}
+
+# 按 id 走主键顺序扫描; which_minute 前的 + 阻止规划器改用 which_minute 索引再排序,
+# 否则每一页都要重新扫描整个时间范围
+_SQL_PAGE = """
+SELECT {columns} FROM {view}
+WHERE id > ? AND id <= ? AND +which_minute >= ? AND +which_minute < ?
+ORDER BY id
+LIMIT ?
+"""
+
+# 时间范围对应的 id 范围, 只读 which_minute 索引
+_SQL_ID_BOUNDS = "SELECT MIN(id), MAX(id) FROM {table} WHERE which_minute >= ? AND which_minute < ?"
+
+
+def create_tables(cursor):
+    cursor.executescript(SQL_CREATE_EXPORT_STATE)
+
+
+def available_formats():
+    return ("parquet", "ndjson") if _load_arrow() else ("ndjson",)
+
+
+def _page_sql(table):
+    view, columns = TABLES[table]
+    select = ", ".join(f"CAST({name} AS {_SQL_TYPES[kind]}) AS {name}" for name, kind in columns)
+    return _SQL_PAGE.format(columns=select, view=view)
+
+
+class NdjsonSink:
+    """每行一个 JSON 对象, gzip 压缩"""
+    extension = "ndjson.gz"
+
+    def __init__(self, path, columns):
+        self.names = [name for name, _ in columns]
+        self._file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+
+    def write(self, rows):
+        names = self.names
+        self._file.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """每块写一个 row group, 写入时按列构造, 不经过逐行字典"""
+    extension = "parquet"
+
+    _ARROW_TYPES = {"int": "int64", "float": "float64", "str": "string"}
+
+    def __init__(self, path, columns):
+        self.schema = pa.schema([(name, getattr(pa, self._ARROW_TYPES[kind])()) for name, kind in columns])
+        self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        arrays = [pa.array(list(values), type=field.type) for values, field in zip(zip(*rows), self.schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def _sink_class(fmt):
+    if fmt == "auto":
+        fmt = "parquet" if _load_arrow() else "ndjson"
+    if fmt == "parquet":
+        if not _load_arrow():
+            raise RuntimeError("导出 Parquet 需要安装 pyarrow")
+        return ParquetSink
+    if fmt == "ndjson":
+        return NdjsonSink
+    raise ValueError(f"不支持的导出格式: {fmt}")
+
+
+def _manager(manager):
+    if manager is None:
+        import db.sqlite
+        manager = db.sqlite.get_db_manager()
+    return manager
+
+
+def read_state(name, table, manager=None):
+    """:return: (last_id, last_minute), 没有记录时为 (None, None)"""
+    with _manager(manager).writer() as conn:
+        row = conn.execute(SQL_SELECT_EXPORT_STATE, (name, table)).fetchone()
+    return tuple(row) if row else (None, None)
+
+
+def _write_state(name, table, last_id, last_minute, manager):
+    with manager.writer() as conn:
+        with conn:
+            conn.execute(SQL_SET_EXPORT_STATE, (name, table, last_id, last_minute))
+
+
+def _writer_lag_minutes():
+    """落库线程最多落后的分钟数: 队列中积压的周期(每个一分钟) + 队列满时的等待 + 正在整理的那一分钟"""
+    writer_conf = conf.settings['db'].get('writer') or {}
+    if not writer_conf.get('enabled', False):
+        return 1
+    return writer_conf.get('max_queue', 16) + math.ceil(writer_conf.get('block_timeout_second', 5) / 60) + 1
+
+
+def _oldest_spilled_minute(manager):
+    """溢出目录中尚未写回的周期里最早的 which_minute, 没有时为 None"""
+    oldest = None
+    spill_dir = os.path.join(os.path.dirname(manager.dbPath), "spill")
+    for path in glob.glob(os.path.join(spill_dir, "spill-*.pkl")):
+        try:
+            with open(path, "rb") as file:
+                window_dict = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            continue
+        for window_obj in window_dict.values():
+            if window_obj.whichMinute and (oldest is None or window_obj.whichMinute < oldest):
+                oldest = window_obj.whichMinute
+    return oldest
+
+
+def settled_minute(manager=None, now=None):
+    """
+    minute 水位默认的上界, 之前的分钟不会再有新行写入: 当前分钟减去落库线程最多落后的分钟数,
+    并且不越过溢出文件中最早的分钟. 数据库一直不可写时溢出文件持续重试, 水位停在那里等它写回。
+    """
+    now = datetime.now() if now is None else now
+    end = (now - timedelta(minutes=_writer_lag_minutes())).strftime("%Y-%m-%d %H:%M")
+    oldest = _oldest_spilled_minute(_manager(manager))
+    return min(end, oldest) if oldest else end
+
+
+def iter_pages(table, start, end, after_id=0, chunk_size=50_000, manager=None):
+    """按 id 顺序产出 [tuple, ...], 每块一次独立的查询"""
+    sql = _page_sql(table)
+    manager = _manager(manager)
+    with manager.reader() as conn:
+        first_id, last_id = conn.execute(_SQL_ID_BOUNDS.format(table=table), (start, end)).fetchone()
+    if first_id is None:
+        return
+    after_id = max(after_id, first_id - 1)
+    while True:
+        with manager.reader() as conn:
+            rows = conn.execute(sql, (after_id, last_id, start, end, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+        if len(rows) < chunk_size:
+            return
+
+
+def export(table, out_dir, start=None, end=None, fmt="auto", name=None, watermark="id",
+           chunk_size=50_000, manager=None):
+    """
+    导出 which_minute 在 [start, end) 内的行。
+    :param name: 增量导出的任务名, 为 None 时不读写 export_state
+    :param watermark: 增量导出的水位, "id" 从上次的最大 id 之后继续, 晚提交的行 id 更大, 不会漏掉;
+        "minute" 从上次的 which_minute 上界继续, 此时 end 默认为 settled_minute(). 显式给出的 end 不做调整,
+        之后才提交到 end 之前的行不会再被导出
+    :return: {"rows", "path", "first_id", "last_id", "start", "end", "seconds"}
+    """
+    if table not in TABLES:
+        raise ValueError(f"不支持导出的表: {table}")
+    if watermark not in ("id", "minute"):
+        raise ValueError(f"不支持的水位: {watermark}")
+    manager = _manager(manager)
+    sink_class = _sink_class(fmt)
+    started = time.perf_counter()
+
+    after_id = 0
+    start = _minute(start) if start else "0000"
+    if end:
+        end = _minute(end)
+    elif name and watermark == "minute":
+        end = settled_minute(manager)
+    else:
+        end = "9999"
+    if name:
+        last_id, last_minute = read_state(name, table, manager)
+        if watermark == "id" and last_id is not None:
+            after_id = last_id
+        if watermark == "minute" and last_minute is not None:
+            start = max(start, last_minute)
+            # 溢出文件里出现更早的分钟时水位不后退, 已导出的行不会重复导出
+            end = max(end, start)
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = os.path.join(out_dir, f".{table}-{time.time_ns()}.{sink_class.extension}.tmp")
+    _, columns = TABLES[table]
+    sink = sink_class(tmp_path, columns)
+    rows = 0
+    first_id = last_id = None
+    try:
+        for page in iter_pages(table, start, end, after_id, chunk_size, manager):
+            sink.write(page)
+            rows += len(page)
+            if first_id is None:
+                first_id = page[0][0]
+            last_id = page[-1][0]
+    finally:
+        sink.close()
+
+    path = None
+    if rows:
+        path = os.path.join(out_dir, f"{table}-{first_id}-{last_id}.{sink_class.extension}")
+        os.replace(tmp_path, path)
+    else:
+        os.remove(tmp_path)
+    # 文件落盘后才推进水位, 中途失败时下次会重新导出同一段
+    if name and (rows or watermark == "minute"):
+        _write_state(name, table, last_id if last_id is not None else after_id,
+                     end if watermark == "minute" else None, manager)
+    result = {"rows": rows, "path": path, "first_id": first_id, "last_id": last_id,
+              "start": start, "end": end, "seconds": time.perf_counter() - started}
+    logger.info(f"导出 {table}: {rows} 行 -> {path}, 耗时 {result['seconds']:.1f} s")
+    return result
+
+
+def _minute(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M")
+    return str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("tables", nargs="+", choices=sorted(TABLES))
+    parser.add_argument("--out", required=True, help="输出目录")
+    parser.add_argument("--start", help="which_minute 下界, 例如 2025-01-01 00:00")
+    parser.add_argument("--end", help="which_minute 上界(不含)")
+    parser.add_argument("--format", default="auto", choices=("auto", "parquet", "ndjson"))
+    parser.add_argument("--name", help="增量导出的任务名, 从上次导出的位置继续")
+    parser.add_argument("--watermark", default="id", choices=("id", "minute"))
+    parser.add_argument("--chunk", type=int, default=50_000, help="每块行数")
+    parser.add_argument("--db", help="数据库文件, 默认为配置中的数据库")
+    args = parser.parse_args()
+
+    manager = None
+    if args.db:
+        import db.sqlite
+        from db.connection import ConnectionManager
+        manager = ConnectionManager(args.db)
+        # 补齐兼容视图和 export_state
+        db.sqlite.create_window_activity_table(manager)
+    for table in args.tables:
+        result = export(table, args.out, args.start, args.end, args.format, args.name, args.watermark,
+                        args.chunk, manager)
+        print(f"{table}: {result['rows']} rows -> {result['path']} ({result['seconds']:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+查询与报表
+query.py: 按时间范围读取 window_activity / process_snapshots 的常用统计
+- 所有报表都是生成器, 每次产出一块(最多 chunk_size 行)字典, 调用方可以边读边处理
+- 时间范围作用在 which_minute 上 ('YYYY-MM-DD HH:MM', 左闭右开), 走 which_minute 索引;
+  进程快照与窗口活动按 (which_minute, activity_id) 关联, 命中 process_snapshots 的复合索引
+- 应用时间、键鼠强度和进程排行在已汇总的范围上读取 db.rollup 的小时表/天表, 其余部分读明细
+- 活动时长和空闲间隔读取 minute_initiativeUse 的每分钟位图, 在 Python 里逐行做 60 位的位运算, 不扫描明细
+- 使用连接管理器的只读连接, 不阻塞写线程
+- 配置 db.query.debug 为 true 时, 耗时超过 slow_ms 的查询会连同 EXPLAIN QUERY PLAN 一起记录
+"""
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import config.config as conf
+from db import rollup
+
+logger = logging.getLogger(__name__)
+
+MINUTE_FORMAT = "%Y-%m-%d %H:%M"
+
+# --- 分层报表: 范围按 rollup.plan 拆成 明细 / 小时表 / 天表 各段, {parts} 为各段的 UNION ALL ---
+# 明细段使用 rollup 中按小时的部分汇总, 与汇总表的列一一对应, 外层再合并
+
+# 每个应用(进程名)的前台时间和处于前台的分钟数, 每条活动只算给它的所属进程, 见 rollup.SQL_PRIMARY_SNAPSHOT
+SQL_TIME_PER_APP = """
+SELECT app, SUM(foreground_seconds) AS foreground_seconds, SUM(active_minutes) AS active_minutes
+FROM ({parts})
+GROUP BY app
+ORDER BY foreground_seconds DESC
+"""
+
+# 每小时的键鼠事件数, per_minute 为该小时内有记录的分钟平均值
+SQL_INPUT_PER_HOUR = """
+SELECT period AS hour, SUM(minutes) AS minutes, SUM(key_presses) AS key_presses, SUM(clicks) AS clicks,
+       SUM(mouse_moves) AS mouse_moves, SUM(scrolls) AS scrolls,
+       SUM(key_presses + clicks + scrolls) * 1.0 / SUM(minutes) AS per_minute
+FROM ({parts})
+GROUP BY period
+ORDER BY period
+"""
+
+# 进程按 (身份, pid) 分组, 旧记录没有身份 ID 时按 pid 分组. 先聚合再关联身份表, 只查分组数次
+_SQL_TOP_PROCESSES = """
+SELECT g.pid, COALESCE(g.name, i.name) AS name, g.samples, g.sum_rss / g.samples AS avg_rss, g.max_rss,
+       g.sum_memory_percent / g.samples AS avg_memory_percent,
+       g.read_bytes, g.write_bytes, g.read_bytes + g.write_bytes AS io_bytes
+FROM (
+    SELECT identity_id, pid, MAX(name) AS name, SUM(samples) AS samples, SUM(sum_rss) AS sum_rss,
+           MAX(max_rss) AS max_rss, SUM(sum_memory_percent) AS sum_memory_percent,
+           SUM(read_bytes) AS read_bytes, SUM(write_bytes) AS write_bytes
+    FROM ({{parts}})
+    GROUP BY identity_id, pid
+) g
+LEFT JOIN process_identity i ON i.id = g.identity_id
+ORDER BY {order} DESC
+LIMIT ?
+"""
+
+SQL_TOP_PROCESSES = {
+    "memory": _SQL_TOP_PROCESSES.format(order="g.max_rss"),
+    "io": _SQL_TOP_PROCESSES.format(order="io_bytes"),
+}
+
+# 报表名 -> (外层 SQL, 明细段 SQL, 汇总表前缀, 汇总表列, 可用的汇总层)
+TIERED_REPORTS = {
+    "time_per_app": (SQL_TIME_PER_APP, rollup.SQL_APP_RAW, "app_rollup", rollup.APP_COLUMNS,
+                     (rollup.HOUR, rollup.DAY)),
+    # 按小时输出, 不能使用天表
+    "input_intensity_per_hour": (SQL_INPUT_PER_HOUR, rollup.SQL_INPUT_RAW, "input_rollup", rollup.INPUT_COLUMNS,
+                                 (rollup.HOUR,)),
+    "top_processes_memory": (SQL_TOP_PROCESSES["memory"], rollup.SQL_PROCESS_RAW, "process_rollup",
+                             rollup.PROCESS_COLUMNS, (rollup.HOUR, rollup.DAY)),
+    "top_processes_io": (SQL_TOP_PROCESSES["io"], rollup.SQL_PROCESS_RAW, "process_rollup",
+                         rollup.PROCESS_COLUMNS, (rollup.HOUR, rollup.DAY)),
+}
+
+# 以下报表只读明细, 明细超过保留期被删除后不再有结果
+
+# 每个窗口的前台时间, 标题取该窗口最后一条活动的最后一个标题
+SQL_FOREGROUND_PER_WINDOW = """
+SELECT g.window_hwnd, g.foreground_seconds, g.active_minutes, g.first_minute, g.last_minute,
+       COALESCE((SELECT t.title FROM window_activity_title at
+                 JOIN window_title t ON t.id = at.title_id
+                 WHERE at.activity_id = g.last_id ORDER BY at.position DESC LIMIT 1),
+                json_extract(l.window_titles, '$[#-1]')) AS title
+FROM (
+    SELECT a.window_hwnd, SUM(a.main_window_time) AS foreground_seconds, COUNT(*) AS active_minutes,
+           MIN(a.which_minute) AS first_minute, MAX(a.which_minute) AS last_minute, MAX(a.id) AS last_id
+    FROM window_activity a
+    WHERE a.which_minute >= ? AND a.which_minute < ?
+    GROUP BY a.window_hwnd
+    HAVING foreground_seconds > 0
+) g
+JOIN window_activity l ON l.id = g.last_id
+ORDER BY g.foreground_seconds DESC
+"""
+
+# 按键次数, 按应用(进程名)分组, 与应用时间一样每条活动只算给它的所属进程
+SQL_TOP_KEYS_PER_APP = f"""
+SELECT app, k.name AS key, SUM(c.press_count) AS press_count
+FROM (
+    SELECT w.id, COALESCE(s.name, i.name) AS app
+    FROM (
+        SELECT a.id, {rollup.SQL_PRIMARY_SNAPSHOT} AS snapshot_id
+        FROM window_activity a
+        WHERE a.which_minute >= ? AND a.which_minute < ? AND a.keyboard_press_num > 0
+    ) w
+    JOIN process_snapshots s ON s.id = w.snapshot_id
+    LEFT JOIN process_identity i ON i.id = s.identity_id
+) w
+JOIN keyboard_key_counts c ON c.activity_id = w.id
+JOIN key_name k ON k.id = c.key_id
+GROUP BY app, k.name
+ORDER BY app, press_count DESC
+"""
+
+
+# 每分钟的输入活动位图, 见 data.timeline
+SQL_MINUTE_ACTIVITY = """
+SELECT which_minute, active_bitmap, keyboard_bitmap
+FROM minute_initiativeUse
+WHERE which_minute >= ? AND which_minute < ?
+ORDER BY which_minute
+"""
+
+
+def to_minute(value):
+    """datetime 或字符串转成 which_minute 的格式"""
+    if isinstance(value, datetime):
+        return value.strftime(MINUTE_FORMAT)
+    return str(value)[:16]
+
+
+def _query_conf():
+    return conf.settings['db'].get('query') or {}
+
+
+def _explain(conn, sql, params):
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return "\n".join(f"  {row[-1]}" for row in rows)
+
+
+def _manager(manager):
+    if manager is None:
+        import db.sqlite
+        manager = db.sqlite.get_db_manager()
+    return manager
+
+
+def build(report, start, end, watermarks):
+    """
+    生成分层报表的 SQL 和参数(不含 LIMIT 等附加参数)。
+    :param watermarks: rollup.read_watermarks 的结果, 为空时全部读明细
+    """
+    outer, raw_sql, table, columns, levels = TIERED_REPORTS[report]
+    start, end = to_minute(start), to_minute(end)
+    parts = []
+    params = []
+    for level, lower, upper in rollup.plan(start, end, watermarks, levels):
+        if level is None:
+            parts.append(raw_sql)
+            params += [lower, upper]
+        else:
+            length = rollup.PERIOD_LENGTH[level]
+            parts.append(f"SELECT {columns} FROM {table}_{rollup.TABLE_SUFFIX[level]} "
+                         f"WHERE period >= ? AND period < ?")
+            params += [lower[:length], upper[:length]]
+    if not parts:
+        parts, params = [raw_sql], [start, end]
+    return outer.format(parts="\nUNION ALL\n".join(parts)), tuple(params)
+
+
+def _watermarks(manager):
+    with manager.reader() as conn:
+        try:
+            return rollup.read_watermarks(conn)
+        except sqlite3.OperationalError:
+            # 尚未创建汇总表的数据库
+            return {}
+
+
+def tiered(report, start, end, extra_params=(), chunk_size=None, manager=None):
+    manager = _manager(manager)
+    sql, params = build(report, start, end, _watermarks(manager))
+    return stream(sql, params + tuple(extra_params), chunk_size, manager)
+
+
+def stream(sql, params=(), chunk_size=None, manager=None):
+    """
+    执行只读查询, 按块产出 [dict, ...]。
+    生成器中途被丢弃时游标会被关闭, 不会一直持有读事务。
+    """
+    manager = _manager(manager)
+    query_conf = _query_conf()
+    chunk_size = chunk_size or query_conf.get('chunk_size', 1000)
+    started = time.perf_counter()
+    rows = 0
+    with manager.reader() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        try:
+            cursor.execute(sql, params)
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                rows += len(chunk)
+                yield [dict(row) for row in chunk]
+        finally:
+            cursor.close()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if query_conf.get('debug') and elapsed_ms > query_conf.get('slow_ms', 200):
+            logger.warning(f"慢查询 {elapsed_ms:.1f} ms, {rows} 行, 参数 {params}\n"
+                           f"{sql.strip()}\n查询计划:\n{_explain(conn, sql, params)}")
+
+
+def rows(chunks):
+    """把按块产出的结果展开成逐行"""
+    for chunk in chunks:
+        yield from chunk
+
+
+def time_per_app(start, end, chunk_size=None, manager=None):
+    """每个应用的前台时间(秒)和处于前台的分钟数"""
+    return tiered("time_per_app", start, end, chunk_size=chunk_size, manager=manager)
+
+
+def foreground_time_per_window(start, end, chunk_size=None, manager=None):
+    """每个窗口的前台时间(秒), 附最后一次出现的标题"""
+    return stream(SQL_FOREGROUND_PER_WINDOW, (to_minute(start), to_minute(end)), chunk_size, manager)
+
+
+def input_intensity_per_hour(start, end, chunk_size=None, manager=None):
+    """每小时的键盘、点击、移动和滚轮次数"""
+    return tiered("input_intensity_per_hour", start, end, chunk_size=chunk_size, manager=manager)
+
+
+def top_processes(start, end, by="memory", limit=10, chunk_size=None, manager=None):
+    """
+    :param by: "memory" 按最大常驻内存排序, "io" 按读写字节总数排序
+    """
+    if by not in SQL_TOP_PROCESSES:
+        raise ValueError(f"不支持的排序方式: {by}")
+    return tiered(f"top_processes_{by}", start, end, (limit,), chunk_size, manager)
+
+
+def top_keys_per_app(start, end, chunk_size=None, manager=None):
+    """每个应用的按键次数, 同一应用内按次数降序"""
+    return stream(SQL_TOP_KEYS_PER_APP, (to_minute(start), to_minute(end)), chunk_size, manager)
+
+
+def _minute_bitmaps(start, end, manager):
+    """
+    按时间顺序逐行产出范围内每分钟的位图, 每行只做 60 位的运算, 不把整个范围拼成一个大整数。
+    :return: 生成器 (该分钟第 0 位相对 start 的秒数, 活动位图, 按键位图)
+    """
+    from data.timeline import MINUTE_MASK
+    start, end = to_minute(start), to_minute(end)
+    origin = datetime.strptime(start, MINUTE_FORMAT)
+    for chunk in stream(SQL_MINUTE_ACTIVITY, (start, end), manager=manager):
+        for row in chunk:
+            offset = int((datetime.strptime(row["which_minute"], MINUTE_FORMAT) - origin).total_seconds())
+            yield offset, row["active_bitmap"] & MINUTE_MASK, row["keyboard_bitmap"] & MINUTE_MASK
+
+
+def active_time(start, end, manager=None):
+    """
+    有键鼠输入的秒数。
+    :return: {"recorded_seconds", "active_seconds", "keyboard_seconds", "active_minutes"}
+    """
+    from data.timeline import MINUTE_BITS, popcount
+    recorded = active_seconds = keyboard_seconds = active_minutes = 0
+    for _, active, keyboard in _minute_bitmaps(start, end, manager):
+        recorded += MINUTE_BITS
+        active_seconds += popcount(active)
+        keyboard_seconds += popcount(keyboard)
+        if active:
+            active_minutes += 1
+    return {"recorded_seconds": recorded, "active_seconds": active_seconds,
+            "keyboard_seconds": keyboard_seconds, "active_minutes": active_minutes}
+
+
+def idle_gaps(start, end, min_seconds=300, manager=None):
+    """
+    连续没有键鼠输入的时段。只看有记录的分钟, 采集没有运行的时间不算空闲, 会把空闲时段截断。
+    :return: [{"start": 'YYYY-MM-DD HH:MM:SS', "seconds"}], 按时间顺序
+    """
+    from data.timeline import MINUTE_MASK, IdleRuns
+    origin = datetime.strptime(to_minute(start), MINUTE_FORMAT)
+    runs = IdleRuns(min_seconds)
+    for offset, active, _ in _minute_bitmaps(start, end, manager):
+        runs.add(offset, ~active & MINUTE_MASK)
+    return [{"start": (origin + timedelta(seconds=offset)).strftime("%Y-%m-%d %H:%M:%S"), "seconds": length}
+            for offset, length in runs.finish()]
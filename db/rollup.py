@@ -0,0 +1,429 @@
+"""
+分层汇总与数据保留
+rollup.py: 分钟级数据 -> 小时表 -> 天表, 超过保留期的明细被删除, 空闲页通过增量 vacuum 归还
+- 汇总表: app_rollup_* (应用前台时间), process_rollup_* (进程内存/io), input_rollup_* (键鼠次数),
+  每种各有 _hourly 和 _daily 两张, period 分别为 'YYYY-MM-DD HH' 和 'YYYY-MM-DD'
+- rollup_state: 每一层已汇总到的位置(水位, 不含), 格式与 which_minute 相同, 总是对齐到整点/零点
+- RollupEngine: 增量汇总已结束的小时和天, 按保留期删除明细和小时表, 清理不再被引用的维度行, 定时增量 vacuum
+- plan(): 把查询范围拆成 明细 / 小时表 / 天表 的若干段, 供 db.query 在长范围上直接读汇总表
+汇总只处理结束超过 grace_minutes 的小时, 之后才写入的迟到明细不会再进入汇总表。
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+MINUTE_FORMAT = "%Y-%m-%d %H:%M"
+
+HOUR = "hour"
+DAY = "day"
+
+# 各层 period 字符串的长度, which_minute 截取前缀即可得到
+PERIOD_LENGTH = {HOUR: 13, DAY: 10}
+TABLE_SUFFIX = {HOUR: "hourly", DAY: "daily"}
+
+_SQL_CREATE_LEVEL = """
+CREATE TABLE IF NOT EXISTS app_rollup_{suffix} (
+    period TEXT NOT NULL,
+    app TEXT,
+    foreground_seconds REAL NOT NULL,   -- 前台时间 (秒)
+    active_minutes INTEGER NOT NULL     -- 处于前台的分钟数
+);
+CREATE INDEX IF NOT EXISTS idx_app_rollup_{suffix}_period ON app_rollup_{suffix} (period);
+
+CREATE TABLE IF NOT EXISTS process_rollup_{suffix} (
+    period TEXT NOT NULL,
+    identity_id INTEGER,                -- process_identity.id, 旧记录为 NULL
+    pid INTEGER NOT NULL,
+    name TEXT,                          -- 只有旧记录(没有 identity_id)才有值
+    samples INTEGER NOT NULL,           -- 汇总的分钟记录数, 平均值 = sum_* / samples
+    sum_rss REAL NOT NULL,
+    max_rss REAL NOT NULL,
+    sum_memory_percent REAL NOT NULL,
+    read_bytes INTEGER NOT NULL,
+    write_bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_process_rollup_{suffix}_period ON process_rollup_{suffix} (period);
+
+CREATE TABLE IF NOT EXISTS input_rollup_{suffix} (
+    period TEXT PRIMARY KEY,
+    minutes INTEGER NOT NULL,           -- 有记录的分钟数
+    key_presses INTEGER NOT NULL,
+    clicks INTEGER NOT NULL,
+    mouse_moves INTEGER NOT NULL,
+    scrolls INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+SQL_CREATE_ROLLUP = "".join(_SQL_CREATE_LEVEL.format(suffix=suffix) for suffix in TABLE_SUFFIX.values()) + """
+CREATE TABLE IF NOT EXISTS rollup_state (
+    level TEXT PRIMARY KEY,
+    watermark TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# --- 明细上的按小时部分汇总, 汇总引擎和 db.query 共用 ---
+# 参数: which_minute 的 [起, 止)
+
+# 一条活动归属的进程快照: 最先写入的那一个. 快照按窗口的 pid 顺序写入, 第一个是窗口的所属进程;
+# 多进程窗口的前台时间只算给这一个应用, 不会按进程数重复累加. 只读复合索引, 不回表
+SQL_PRIMARY_SNAPSHOT = ("(SELECT MIN(s.id) FROM process_snapshots s "
+                        "WHERE s.which_minute = a.which_minute AND s.activity_id = a.id)")
+
+SQL_APP_RAW = f"""
+SELECT substr(w.which_minute, 1, 13) AS period, COALESCE(s.name, i.name) AS app,
+       SUM(w.main_window_time) AS foreground_seconds, COUNT(DISTINCT w.which_minute) AS active_minutes
+FROM (
+    SELECT a.which_minute, a.main_window_time, {SQL_PRIMARY_SNAPSHOT} AS snapshot_id
+    FROM window_activity a
+    WHERE a.which_minute >= ? AND a.which_minute < ? AND a.main_window_time > 0
+) w
+JOIN process_snapshots s ON s.id = w.snapshot_id
+LEFT JOIN process_identity i ON i.id = s.identity_id
+GROUP BY 1, 2
+"""
+
+SQL_PROCESS_RAW = """
+SELECT substr(which_minute, 1, 13) AS period, identity_id, pid, MAX(name) AS name, COUNT(*) AS samples,
+       SUM(avg_rss) AS sum_rss, MAX(avg_rss) AS max_rss, SUM(avg_memory_percent) AS sum_memory_percent,
+       SUM(total_read_bytes) AS read_bytes, SUM(total_write_bytes) AS write_bytes
+FROM process_snapshots
+WHERE which_minute >= ? AND which_minute < ?
+GROUP BY 1, identity_id, pid
+"""
+
+SQL_INPUT_RAW = """
+SELECT substr(which_minute, 1, 13) AS period, COUNT(DISTINCT which_minute) AS minutes,
+       SUM(keyboard_press_num) AS key_presses,
+       SUM(mouse_left_click_num + mouse_right_click_num + mouse_other_click_num) AS clicks,
+       SUM(mouse_move_num) AS mouse_moves, SUM(mouse_scroll_num) AS scrolls
+FROM window_activity
+WHERE which_minute >= ? AND which_minute < ?
+GROUP BY 1
+"""
+
+APP_COLUMNS = "period, app, foreground_seconds, active_minutes"
+PROCESS_COLUMNS = ("period, identity_id, pid, name, samples, sum_rss, max_rss, sum_memory_percent, "
+                   "read_bytes, write_bytes")
+INPUT_COLUMNS = "period, minutes, key_presses, clicks, mouse_moves, scrolls"
+
+# 小时表 -> 天表, 参数: 小时 period 的 [起, 止)
+_SQL_DAILY = {
+    "app": """
+INSERT INTO app_rollup_daily ({columns})
+SELECT substr(period, 1, 10), app, SUM(foreground_seconds), SUM(active_minutes)
+FROM app_rollup_hourly WHERE period >= ? AND period < ? GROUP BY 1, app
+""",
+    "process": """
+INSERT INTO process_rollup_daily ({columns})
+SELECT substr(period, 1, 10), identity_id, pid, MAX(name), SUM(samples), SUM(sum_rss), MAX(max_rss),
+       SUM(sum_memory_percent), SUM(read_bytes), SUM(write_bytes)
+FROM process_rollup_hourly WHERE period >= ? AND period < ? GROUP BY 1, identity_id, pid
+""",
+    "input": """
+INSERT INTO input_rollup_daily ({columns})
+SELECT substr(period, 1, 10), SUM(minutes), SUM(key_presses), SUM(clicks), SUM(mouse_moves), SUM(scrolls)
+FROM input_rollup_hourly WHERE period >= ? AND period < ? GROUP BY 1
+""",
+}
+
+SQL_HOURLY = [
+    f"INSERT INTO app_rollup_hourly ({APP_COLUMNS}) {SQL_APP_RAW}",
+    f"INSERT INTO process_rollup_hourly ({PROCESS_COLUMNS}) {SQL_PROCESS_RAW}",
+    f"INSERT INTO input_rollup_hourly ({INPUT_COLUMNS}) {SQL_INPUT_RAW}",
+]
+
+SQL_DAILY = [
+    _SQL_DAILY["app"].format(columns=APP_COLUMNS),
+    _SQL_DAILY["process"].format(columns=PROCESS_COLUMNS),
+    _SQL_DAILY["input"].format(columns=INPUT_COLUMNS),
+]
+
+SQL_SELECT_WATERMARKS = "SELECT level, watermark FROM rollup_state"
+
+SQL_SET_WATERMARK = """
+INSERT INTO rollup_state (level, watermark) VALUES (?, ?)
+ON CONFLICT (level) DO UPDATE SET watermark = excluded.watermark
+"""
+
+# 明细的删除顺序: 先删子表, 再删 window_activity. 参数: which_minute 的上界(不含)
+SQL_DELETE_RAW = [
+    """DELETE FROM window_activity_title WHERE activity_id IN
+       (SELECT id FROM window_activity WHERE which_minute < ?)""",
+    """DELETE FROM keyboard_key_counts WHERE activity_id IN
+       (SELECT id FROM window_activity WHERE which_minute < ?)""",
+    "DELETE FROM process_snapshots WHERE which_minute < ?",
+    "DELETE FROM minute_initiativeUse WHERE which_minute < ?",
+    "DELETE FROM window_activity WHERE which_minute < ?",
+]
+
+# 删除明细后不再被引用的维度行. 进程身份还被汇总表引用, 汇总表中出现的保留;
+# NOT IN 的子查询里不能有 NULL, 否则整个条件为假
+SQL_DELETE_ORPHANS = [
+    "DELETE FROM window_title WHERE id NOT IN (SELECT title_id FROM window_activity_title)",
+    "DELETE FROM key_name WHERE id NOT IN (SELECT key_id FROM keyboard_key_counts)",
+    """DELETE FROM process_identity
+       WHERE id NOT IN (SELECT identity_id FROM process_snapshots WHERE identity_id IS NOT NULL)
+         AND id NOT IN (SELECT identity_id FROM process_rollup_hourly WHERE identity_id IS NOT NULL)
+         AND id NOT IN (SELECT identity_id FROM process_rollup_daily WHERE identity_id IS NOT NULL)""",
+]
+
+# 明细中最早的分钟, minute_initiativeUse 可能早于 window_activity
+SQL_FIRST_RAW_MINUTE = """
+SELECT MIN(which_minute) FROM (
+    SELECT MIN(which_minute) AS which_minute FROM window_activity
+    UNION ALL SELECT MIN(which_minute) FROM minute_initiativeUse
+)
+"""
+
+SQL_DELETE_HOURLY = [f"DELETE FROM {table}_hourly WHERE period < ?"
+                     for table in ("app_rollup", "process_rollup", "input_rollup")]
+
+
+def create_tables(cursor):
+    cursor.executescript(SQL_CREATE_ROLLUP)
+
+
+def _parse(minute):
+    return datetime.strptime(minute, MINUTE_FORMAT)
+
+
+def _format(moment):
+    return moment.strftime(MINUTE_FORMAT)
+
+
+def _floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(moment):
+    floor = _floor_hour(moment)
+    return floor if floor == moment else floor + timedelta(hours=1)
+
+
+def _floor_day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil_day(moment):
+    floor = _floor_day(moment)
+    return floor if floor == moment else floor + timedelta(days=1)
+
+
+def read_watermarks(conn):
+    """{层: datetime}, 没有汇总过的层不出现"""
+    return {level: _parse(watermark) for level, watermark in conn.execute(SQL_SELECT_WATERMARKS)}
+
+
+def plan(start, end, watermarks, levels=(HOUR, DAY)):
+    """
+    把 [start, end) 拆成若干段, 每段为 (层, 起, 止), 层为 None 表示读明细。
+    已汇总的整小时读小时表, 其中的整天(且天表已汇总)读天表, 其余读明细。
+    起止均为 which_minute 格式; 汇总表的段需要截取 PERIOD_LENGTH[层] 位作为 period。
+    """
+    start, end = _parse(start), _parse(end)
+    hour_watermark = watermarks.get(HOUR)
+    if HOUR not in levels or hour_watermark is None:
+        return [(None, _format(start), _format(end))] if start < end else []
+    first_hour = _ceil_hour(start)
+    rolled_end = min(_floor_hour(end), hour_watermark)
+    if first_hour >= rolled_end:
+        return [(None, _format(start), _format(end))] if start < end else []
+
+    segments = [(None, start, first_hour)]
+    day_watermark = watermarks.get(DAY)
+    first_day = _ceil_day(first_hour)
+    last_day = min(_floor_day(rolled_end), day_watermark) if day_watermark else first_day
+    if DAY in levels and first_day < last_day:
+        segments += [(HOUR, first_hour, first_day), (DAY, first_day, last_day), (HOUR, last_day, rolled_end)]
+    else:
+        segments.append((HOUR, first_hour, rolled_end))
+    segments.append((None, rolled_end, end))
+    return [(level, _format(lo), _format(hi)) for level, lo, hi in segments if lo < hi]
+
+
+class RollupEngine:
+    """
+    汇总、保留和压缩都通过连接管理器的写连接执行, 与落库线程串行。
+    每个事务最多处理一天的数据, 期间落库线程只需短暂等待。
+    """
+    def __init__(self, manager=None, grace_minutes=10, raw_retention_days=0, hourly_retention_days=400,
+                 vacuum_pages=2000, convert_auto_vacuum=False):
+        """
+        :param grace_minutes: 小时结束后等待多久才汇总, 给落库队列留出时间
+        :param raw_retention_days: 明细保留天数, 为 0 或 None 时不删除
+        :param hourly_retention_days: 小时表保留天数, 为 0 或 None 时不删除
+        :param vacuum_pages: 每次增量 vacuum 最多归还的页数
+        :param convert_auto_vacuum: 旧数据库未启用 auto_vacuum 时, 是否执行一次完整 VACUUM 来开启
+        """
+        self.manager = manager
+        self.graceMinutes = grace_minutes
+        self.rawRetentionDays = raw_retention_days
+        self.hourlyRetentionDays = hourly_retention_days
+        self.vacuumPages = vacuum_pages
+        self.convertAutoVacuum = convert_auto_vacuum
+        self.schedulerManager = None
+
+    def _manager(self):
+        if self.manager is None:
+            import db.sqlite
+            self.manager = db.sqlite.get_db_manager()
+        return self.manager
+
+    def _watermarks(self):
+        with self._manager().writer() as conn:
+            return read_watermarks(conn)
+
+    def _first_minute(self, sql="SELECT MIN(which_minute) FROM window_activity"):
+        with self._manager().writer() as conn:
+            row = conn.execute(sql).fetchone()
+        return _parse(row[0]) if row and row[0] else None
+
+    def rollup(self, now=None):
+        """
+        把已结束的小时汇总到小时表, 已汇总完整的天汇总到天表。
+        :return: {层: 本次汇总的小时数/天数}
+        """
+        now = now or datetime.now()
+        done = {HOUR: 0, DAY: 0}
+        watermarks = self._watermarks()
+
+        closed_hour = _floor_hour(now - timedelta(minutes=self.graceMinutes))
+        hour_watermark = watermarks.get(HOUR)
+        if hour_watermark is None:
+            first = self._first_minute()
+            hour_watermark = _floor_hour(first) if first else closed_hour
+        # 天表从小时表的起点所在的那一天开始
+        hour_start = hour_watermark
+        while hour_watermark < closed_hour:
+            # 每个事务最多一天
+            upper = min(_floor_day(hour_watermark) + timedelta(days=1), closed_hour)
+            self._run_level(HOUR, SQL_HOURLY, hour_watermark, upper, PERIOD_LENGTH[HOUR], raw=True)
+            done[HOUR] += int((upper - hour_watermark).total_seconds() // 3600)
+            hour_watermark = upper
+        if HOUR not in watermarks:
+            self._set_watermark(HOUR, hour_watermark)
+
+        closed_day = _floor_day(hour_watermark)
+        day_watermark = watermarks.get(DAY) or _floor_day(hour_start)
+        while day_watermark < closed_day:
+            upper = day_watermark + timedelta(days=1)
+            self._run_level(DAY, SQL_DAILY, day_watermark, upper, PERIOD_LENGTH[HOUR], raw=False)
+            done[DAY] += 1
+            day_watermark = upper
+        if DAY not in watermarks:
+            self._set_watermark(DAY, day_watermark)
+        if done[HOUR] or done[DAY]:
+            logger.info(f"汇总完成: {done[HOUR]} 小时, {done[DAY]} 天")
+        return done
+
+    def _run_level(self, level, statements, lower, upper, period_length, raw):
+        if raw:
+            params = (_format(lower), _format(upper))
+        else:
+            params = (_format(lower)[:period_length], _format(upper)[:period_length])
+        with self._manager().writer() as conn:
+            with conn:
+                for sql in statements:
+                    conn.execute(sql, params)
+                conn.execute(SQL_SET_WATERMARK, (level, _format(upper)))
+
+    def _set_watermark(self, level, moment):
+        with self._manager().writer() as conn:
+            with conn:
+                conn.execute(SQL_SET_WATERMARK, (level, _format(moment)))
+
+    def apply_retention(self, now=None):
+        """
+        删除超过保留期的明细(含 minute_initiativeUse)和小时表。只删除已经汇总过的部分。
+        :return: 删除的 window_activity 行数
+        """
+        now = now or datetime.now()
+        watermarks = self._watermarks()
+        deleted = 0
+        if self.rawRetentionDays and HOUR in watermarks:
+            horizon = min(_floor_day(now - timedelta(days=self.rawRetentionDays)), watermarks[HOUR])
+            first = self._first_minute(SQL_FIRST_RAW_MINUTE)
+            # 按天删除, 每个事务只持有写连接很短的时间
+            lower = _floor_day(first) if first else horizon
+            while first is not None and lower < horizon:
+                upper = min(lower + timedelta(days=1), horizon)
+                with self._manager().writer() as conn:
+                    with conn:
+                        for sql in SQL_DELETE_RAW:
+                            cursor = conn.execute(sql, (_format(upper),))
+                        deleted += cursor.rowcount
+                lower = upper
+        hourly_deleted = 0
+        if self.hourlyRetentionDays and DAY in watermarks:
+            horizon = min(_floor_day(now - timedelta(days=self.hourlyRetentionDays)), watermarks[DAY])
+            with self._manager().writer() as conn:
+                with conn:
+                    for sql in SQL_DELETE_HOURLY:
+                        hourly_deleted += conn.execute(sql, (_format(horizon)[:PERIOD_LENGTH[HOUR]],)).rowcount
+        if deleted or hourly_deleted:
+            self._delete_orphans()
+        if deleted:
+            logger.info(f"数据保留: 删除 {deleted} 条过期的窗口活动明细")
+        return deleted
+
+    def _delete_orphans(self):
+        import db.sqlite
+        manager = self._manager()
+        removed = 0
+        with manager.writer() as conn:
+            with conn:
+                for sql in SQL_DELETE_ORPHANS:
+                    removed += conn.execute(sql).rowcount
+            # 缓存里可能还有刚删除的 ID, 与落库共用写连接的锁, 清空后下一次落库会重新分配
+            db.sqlite.get_dimension_cache(manager).clear()
+        if removed:
+            logger.info(f"数据保留: 删除 {removed} 条不再被引用的维度记录")
+        return removed
+
+    def compact(self):
+        """
+        增量 vacuum, 把空闲页归还给文件系统。
+        :return: 归还的页数
+        """
+        manager = self._manager()
+        with manager.writer() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                if not self.convertAutoVacuum:
+                    return 0
+                # 已有数据的库需要一次完整 VACUUM 才能切换到 INCREMENTAL
+                started = time.perf_counter()
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+                logger.info(f"数据库已切换为 auto_vacuum=INCREMENTAL, 耗时 {time.perf_counter() - started:.1f} s")
+            free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free_before:
+                return 0
+            # sqlite3 的 execute 对这条 PRAGMA 只执行一步(归还一页), executescript 会执行到结束
+            conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuumPages)});")
+            freed = free_before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        manager.checkpoint()
+        logger.info(f"增量 vacuum 归还 {freed} 页")
+        return freed
+
+    def run(self, now=None):
+        """一次完整的维护: 汇总 -> 保留 -> 压缩"""
+        try:
+            self.rollup(now)
+            self.apply_retention(now)
+            self.compact()
+        except Exception as e:
+            logger.warning(f"汇总维护失败: {e}")
+
+    def start(self, interval_minutes=10):
+        from data.schedule import SchedulerManager
+        if self.schedulerManager is None:
+            self.schedulerManager = SchedulerManager()
+            self.schedulerManager.add_minute(interval_minutes, "rollup", self.run)
+        self.schedulerManager.start()
+
+    def stop(self):
+        if self.schedulerManager is not None and self.schedulerManager.running:
+            self.schedulerManager.shutdown()
+            self.schedulerManager = None
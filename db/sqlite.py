@@ -2,9 +2,17 @@ import json
 import logging
 import os
 import sqlite3
+import threading
+import weakref
 from typing import List, Dict
 
 import config.config as conf
+from db.connection import ConnectionManager
+from data import counter
+from data import metrics
+from db import export
+from db import rollup
+from db.dimension import DimensionCache
 
 # --- SQL 定义 ---
 # 将所有需要执行的 SQL 语句放在一个多行字符串中
@@ -17,7 +25,7 @@ CREATE TABLE IF NOT EXISTS window_activity (
     -- WindowSorted 核心信息
     window_hwnd INTEGER NOT NULL,
     start_time TEXT NOT NULL,  -- 窗口开始时间, 'YYYY-MM-DD HH:MM:SS' 格式
-    window_titles TEXT,              -- 存储窗口标题列表的 JSON 字符串, 例如: '["Title 1", "Title 2"]'
+    window_titles TEXT,              -- 旧版本的窗口标题 JSON, 新记录为 NULL, 标题见 window_activity_title
     main_window_time REAL DEFAULT 0, -- 担任主窗口的时间 (秒)
     media_use_time REAL DEFAULT 0,   -- 音频使用时间 (秒)
     micro_use_time REAL DEFAULT 0,   -- 麦克风使用时间 (秒)
@@ -28,7 +36,7 @@ CREATE TABLE IF NOT EXISTS window_activity (
 
     -- 从 KeyBoardInfo 平铺的字段
     keyboard_press_num INTEGER DEFAULT 0,
-    keyboard_press_list TEXT,        -- 存储按键统计字典的 JSON 字符串, 例如: '{"a": 10, "Control": 5}'
+    keyboard_press_list TEXT,        -- 旧版本的按键统计 JSON, 新记录为 NULL, 按键次数见 keyboard_key_counts
 
     -- 从 MouseInfo 平铺的字段
     mouse_scroll_num INTEGER DEFAULT 0,
@@ -51,6 +59,7 @@ CREATE TABLE IF NOT EXISTS process_snapshots (
 
     -- ProcesSorted 核心信息
     pid INTEGER NOT NULL,
+    identity_id INTEGER REFERENCES process_identity(id), -- 进程身份维度, 新记录的 name/path/username/start_time 为 NULL
     name TEXT,
     path TEXT,
     username TEXT,
@@ -73,29 +82,183 @@ CREATE TABLE IF NOT EXISTS process_snapshots (
     FOREIGN KEY (activity_id) REFERENCES window_activity(id) ON DELETE CASCADE
 );
 
+-- 进程身份维度: 同一个 (pid, 创建时间) 只保存一份名称、路径和用户名
+CREATE TABLE IF NOT EXISTS process_identity (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pid INTEGER NOT NULL,
+    create_time REAL,               -- 进程创建时间 (unix 时间戳)
+    name TEXT,
+    path TEXT,
+    username TEXT,
+    UNIQUE (pid, create_time)
+);
+
+-- 窗口标题维度: 每个标题字符串只保存一次
+CREATE TABLE IF NOT EXISTS window_title (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL UNIQUE
+);
+
+-- 窗口活动与标题的对应关系, position 为标题在 windowTitles 中的顺序
+CREATE TABLE IF NOT EXISTS window_activity_title (
+    activity_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    title_id INTEGER NOT NULL,
+    PRIMARY KEY (activity_id, position),
+    FOREIGN KEY (activity_id) REFERENCES window_activity(id) ON DELETE CASCADE,
+    FOREIGN KEY (title_id) REFERENCES window_title(id)
+) WITHOUT ROWID;
+
+-- 按键名称维度
+CREATE TABLE IF NOT EXISTS key_name (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE
+);
+
+-- 每条窗口活动的按键直方图, 只保存次数不为 0 的按键
+CREATE TABLE IF NOT EXISTS keyboard_key_counts (
+    activity_id INTEGER NOT NULL,
+    key_id INTEGER NOT NULL,
+    press_count INTEGER NOT NULL,
+    PRIMARY KEY (activity_id, key_id),
+    FOREIGN KEY (activity_id) REFERENCES window_activity(id) ON DELETE CASCADE,
+    FOREIGN KEY (key_id) REFERENCES key_name(id)
+) WITHOUT ROWID;
+
 CREATE TABLE IF NOT EXISTS minute_initiativeUse (
     -- 主键, 自动增长, 用于唯一标识每条窗口活动记录
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     which_minute Text NOT NULL,
-    is_initiative_use NOT NULL
+    is_initiative_use NOT NULL,
+    active_bitmap INTEGER NOT NULL DEFAULT 0,   -- 第 i 位为 1 表示该分钟第 i 秒有键鼠输入
+    keyboard_bitmap INTEGER NOT NULL DEFAULT 0  -- 同上, 只计按键
 );
--- 在 process_snapshots 表的 activity_id 列上创建索引，以加速 JOIN 查询
-CREATE INDEX IF NOT EXISTS idx_process_snapshots_activity_minute_id ON process_snapshots (which_minute,activity_id);
-
 -- 在 window_activity 表的 which_minute 列上创建索引，以加速按时间范围的查询
 CREATE INDEX IF NOT EXISTS idx_window_activity_which_minute ON window_activity (which_minute);
+"""
+
+# 旧数据库缺少的列: (表, 列, 列定义), 建表后通过 PRAGMA table_info 检查并补齐
+SQL_MIGRATE_COLUMNS = [
+    ("process_snapshots", "identity_id", "INTEGER REFERENCES process_identity(id)"),
+    ("minute_initiativeUse", "active_bitmap", "INTEGER NOT NULL DEFAULT 0"),
+    ("minute_initiativeUse", "keyboard_bitmap", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+# 依赖迁移后的列, 放在迁移之后执行
+SQL_CREATE_DERIVED = """
+CREATE INDEX IF NOT EXISTS idx_process_snapshots_identity_id ON process_snapshots (identity_id);
+
+-- 按 (which_minute, activity_id) 关联窗口活动, 同时覆盖 identity_id 和旧记录的 name,
+-- 报表按应用分组时不需要回表. 它包含旧索引 (which_minute, activity_id) 的全部前缀, 旧索引不再需要
+DROP INDEX IF EXISTS idx_process_snapshots_activity_minute_id;
+CREATE INDEX IF NOT EXISTS idx_process_snapshots_minute_activity_identity
+    ON process_snapshots (which_minute, activity_id, identity_id, name);
+
+-- 每分钟一行, 同一分钟再次写入时按位或合并. 该表此前从未写入过, 直接换成唯一索引
+DROP INDEX IF EXISTS idx_minute_initiativeUse_which_minute;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_minute_initiativeUse_minute ON minute_initiativeUse (which_minute);
+
+-- 只索引当过前台的窗口活动, 应用时间报表从这里出发
+CREATE INDEX IF NOT EXISTS idx_window_activity_foreground_minute
+    ON window_activity (which_minute, main_window_time) WHERE main_window_time > 0;
+
+-- 兼容视图: 以旧的平铺形式读取, 新旧记录都可以直接查询. 每次初始化时重建, 保证与当前结构一致
+DROP VIEW IF EXISTS process_snapshots_full;
+CREATE VIEW process_snapshots_full AS
+SELECT s.id, s.which_minute, s.activity_id, s.pid,
+       COALESCE(s.name, i.name) AS name,
+       COALESCE(s.path, i.path) AS path,
+       COALESCE(s.username, i.username) AS username,
+       COALESCE(s.start_time, i.create_time) AS start_time,
+       s.statuses, s.avg_memory_percent, s.avg_rss, s.avg_vms, s.avg_peak_wset, s.avg_num_page_fault,
+       s.total_read_call, s.total_write_call, s.total_read_bytes, s.total_write_bytes
+FROM process_snapshots s
+LEFT JOIN process_identity i ON i.id = s.identity_id;
+
+DROP VIEW IF EXISTS window_activity_full;
+CREATE VIEW window_activity_full AS
+SELECT a.id, a.which_minute, a.window_hwnd, a.start_time,
+       COALESCE(a.window_titles,
+                (SELECT json_group_array(t.title)
+                 FROM (SELECT title_id FROM window_activity_title
+                       WHERE activity_id = a.id ORDER BY position) at
+                 JOIN window_title t ON t.id = at.title_id)) AS window_titles,
+       a.main_window_time, a.media_use_time, a.micro_use_time, a.camera_use_time,
+       a.media_share_time, a.micro_share_time, a.camera_share_time,
+       a.keyboard_press_num,
+       COALESCE(a.keyboard_press_list,
+                (SELECT json_group_object(k.name, c.press_count)
+                 FROM keyboard_key_counts c
+                 JOIN key_name k ON k.id = c.key_id
+                 WHERE c.activity_id = a.id)) AS keyboard_press_list,
+       a.mouse_scroll_num, a.mouse_move_num, a.mouse_left_click_num,
+       a.mouse_right_click_num, a.mouse_other_click_num, a.created_at
+FROM window_activity a;
+"""
+
+
+SQL_INSERT_WINDOW_ACTIVITY = """
+INSERT INTO window_activity (which_minute,window_hwnd, start_time, window_titles, main_window_time,
+                             media_use_time, micro_use_time, camera_use_time,
+                             media_share_time, micro_share_time, camera_share_time,
+                             keyboard_press_num, keyboard_press_list,
+                             mouse_scroll_num, mouse_move_num, mouse_left_click_num,
+                             mouse_right_click_num, mouse_other_click_num)
+VALUES (?,?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
--- 在 window_activity 表的 start_time 列上创建索引，以加速按时间范围的查询
-CREATE INDEX IF NOT EXISTS idx_minute_initiativeUse_which_minute ON minute_initiativeUse (which_minute);
+SQL_INSERT_PROCESS_SNAPSHOT = """
+INSERT INTO process_snapshots (
+     activity_id, pid, identity_id, which_minute,
+     statuses,avg_memory_percent,avg_rss,
+     avg_vms,avg_peak_wset,avg_num_page_fault,total_read_call,total_write_call,
+     total_read_bytes,total_write_bytes
+)
+VALUES (?, ?, ?, ?,
+        ?, ?, ?,
+        ?, ?, ?, ?, ?,
+        ?,?)
+"""
+
+SQL_INSERT_KEYBOARD_KEY_COUNT = """
+INSERT INTO keyboard_key_counts (activity_id, key_id, press_count) VALUES (?, ?, ?)
+"""
+
+SQL_INSERT_WINDOW_ACTIVITY_TITLE = """
+INSERT INTO window_activity_title (activity_id, position, title_id) VALUES (?, ?, ?)
+"""
+
+# 当前分钟在下一个周期会再写一次, 位图按位或合并
+SQL_UPSERT_MINUTE_ACTIVITY = """
+INSERT INTO minute_initiativeUse (which_minute, is_initiative_use, active_bitmap, keyboard_bitmap)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (which_minute) DO UPDATE SET
+    is_initiative_use = is_initiative_use OR excluded.is_initiative_use,
+    active_bitmap = active_bitmap | excluded.active_bitmap,
+    keyboard_bitmap = keyboard_bitmap | excluded.keyboard_bitmap
 """
 
 
 def get_db_connection():
-    return sqlite3.connect(db_file_path)
+    return sqlite3.connect(get_db_file_path())
+
+
+def create_connection_manager(db_path):
+    """按配置 db 节创建连接管理器"""
+    db_conf = conf.settings['db']
+    return ConnectionManager(
+        db_path,
+        journal_mode=db_conf.get('journal_mode', 'WAL'),
+        synchronous=db_conf.get('synchronous', 'NORMAL'),
+        cache_size_kb=db_conf.get('cache_size_kb', 8192),
+        mmap_size_mb=db_conf.get('mmap_size_mb', 64),
+        # 新数据库开启增量 vacuum, 已有数据的库由 RollupEngine.compact 转换
+        auto_vacuum=db_conf.get('auto_vacuum', 'INCREMENTAL'),
+    )
 def setup_db_file():
 
 
-    db_name = config['db']["file_name"]
+    db_name = conf.settings['db']["file_name"]
     # 确保数据库文件存在
     db_path = os.path.join(
         os.path.dirname(os.path.abspath(__file__)),
@@ -111,123 +274,216 @@ def setup_db_file():
             logger.error(f"创建文件失败: {e}")
 
     return db_path
-def create_window_activity_table():
-
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        # 使用 executescript 执行包含多个 SQL 语句的脚本
-        cursor.executescript(SQL_CREATE_WINDOW_ACTIVITY)
-
-        # 提交事务
-        conn.commit()
-        logger.info("数据库初始化成功。表和索引已准备就绪。")
-
-    except sqlite3.Error as e:
-        logger.error(f"数据库初始化时发生错误: {e}")
-    finally:
-        # 确保数据库连接被关闭
-        if conn:
-            conn.close()
-def bulk_insert_window_activities(window_dict: Dict):
+def create_window_activity_table(manager=None):
+
+    manager = manager or get_db_manager()
+    with manager.writer() as conn:
+        try:
+            cursor = conn.cursor()
+            # 使用 executescript 执行包含多个 SQL 语句的脚本
+            cursor.executescript(SQL_CREATE_WINDOW_ACTIVITY)
+            _migrate_columns(cursor)
+            cursor.executescript(SQL_CREATE_DERIVED)
+            rollup.create_tables(cursor)
+            export.create_tables(cursor)
+
+            # 提交事务
+            conn.commit()
+            logger.info("数据库初始化成功。表和索引已准备就绪。")
+
+        except sqlite3.Error as e:
+            logger.error(f"数据库初始化时发生错误: {e}")
+def _migrate_columns(cursor):
+    """为旧数据库补齐新增的列"""
+    for table, column, definition in SQL_MIGRATE_COLUMNS:
+        columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            logger.info(f"数据库迁移: {table} 新增列 {column}")
+
+
+def get_dimension_cache(manager=None):
+    """每个连接管理器(即每个数据库)一份维度 ID 缓存"""
+    manager = manager or get_db_manager()
+    cache = _dimension_caches.get(manager)
+    if cache is None:
+        cache = _dimension_caches[manager] = DimensionCache()
+    return cache
+
+
+def _key_counts(key_counts):
+    """
+    :param key_counts: 本进程的按键直方图, 或溢出文件读回的 {按键名称: 次数}
+    :return: [(按键名称, 次数)]
+    """
+    if isinstance(key_counts, dict):
+        return key_counts.items()
+    key_names = counter.key_codes.names
+    return [(key_names[code], count) for code, count in enumerate(key_counts) if count]
+
+
+def _insert_windows(cursor, window_dict: Dict, dimensions: DimensionCache):
+    """在调用方的事务中插入一批 WindowSorted"""
+    # 遍历每一个要插入的 WindowSorted 对象
+    for window_obj in window_dict.values():
+        # --- 步骤 1: 插入主表 (window_activity) ---
+        # 因为需要获取每个父记录的 lastrowid，所以主表记录仍然需要逐条插入。
+        # 但由于它们都在同一个事务中，所以速度依然非常快。
+
+        cursor.execute(SQL_INSERT_WINDOW_ACTIVITY, (
+            window_obj.whichMinute,
+            window_obj.windowHwnd, window_obj.startTime, None,
+            window_obj.mainWindowTime, window_obj.mediaUseTime,
+            window_obj.microUseTime, window_obj.cameraUseTime,
+            window_obj.mediaShareTime, window_obj.microShareTime,
+            window_obj.cameraShareTime,
+            window_obj.keyboardInfo.keyPressNum, None,
+            window_obj.mouseInfo.mouseScrollNum, window_obj.mouseInfo.mouseMoveNum,
+            window_obj.mouseInfo.mouseLeftClickNum, window_obj.mouseInfo.mouseRightClickNum,
+            window_obj.mouseInfo.mouseOtherClickNum
+        ))
+
+        activity_id = cursor.lastrowid
+        # 标题只写入整数 ID, 标题字符串由维度缓存去重
+        if window_obj.windowTitles:
+            cursor.executemany(SQL_INSERT_WINDOW_ACTIVITY_TITLE, [
+                (activity_id, position, dimensions.title_id(cursor, title))
+                for position, title in enumerate(window_obj.windowTitles)
+            ])
+        # 按键直方图只写入次数不为 0 的编码
+        if window_obj.keyboardInfo.keyPressNum:
+            cursor.executemany(SQL_INSERT_KEYBOARD_KEY_COUNT, [
+                (activity_id, dimensions.key_id(cursor, name), count)
+                for name, count in _key_counts(window_obj.keyboardInfo.keyCounts)
+            ])
+
+        # --- 步骤 2: 准备并批量插入子表 (process_snapshots) ---
+        # 这是另一个性能优化点：使用 executemany()
+
+        if not window_obj.processInfos:
+            continue  # 如果没有进程信息，跳过
+
+        processes_to_insert = []
+        for pid, process_info in window_obj.processInfos.items():
+            statuses_json = json.dumps(process_info.status)
+            processes_to_insert.append((
+                activity_id, process_info.pid, dimensions.process_id(cursor, process_info), window_obj.whichMinute,
+                statuses_json, process_info.memoryUsage.avgMemoryPercent,process_info.memoryUsage.avgRss,
+
+                process_info.memoryUsage.avgVms,process_info.memoryUsage.avgPeakWSet,
+                process_info.memoryUsage.avgNumPageFault,process_info.ioUsage.totalRCallNum,
+                process_info.ioUsage.totalWCallNum,
+
+                process_info.ioUsage.totalRByteNum,process_info.ioUsage.totalWByteNum,
+
+            ))
+
+        # 使用 executemany 一次性插入所有关联的进程快照
+        cursor.executemany(SQL_INSERT_PROCESS_SNAPSHOT, processes_to_insert)
+
+    # 本周期各分钟的输入活动位图, 旧的溢出文件里是普通字典, 没有这一项
+    minute_activities = getattr(window_dict, 'minuteActivities', None)
+    if minute_activities:
+        cursor.executemany(SQL_UPSERT_MINUTE_ACTIVITY, minute_activities)
+
+
+def _count_rows(batches):
+    """记录写入 window_activity、process_snapshots 和 minute_initiativeUse 的行数"""
+    if not metrics.registry.enabled:
+        return
+    windows = processes = minutes = 0
+    for window_dict in batches:
+        windows += len(window_dict)
+        processes += sum(len(window_obj.processInfos) for window_obj in window_dict.values())
+        minutes += len(getattr(window_dict, 'minuteActivities', ()))
+    metrics.inc("rows_total", windows, labels={"table": "window_activity"})
+    metrics.inc("rows_total", processes, labels={"table": "process_snapshots"})
+    metrics.inc("rows_total", minutes, labels={"table": "minute_initiativeUse"})
+
+
+def bulk_insert_window_activities(window_dict: Dict, manager=None):
     """
     高效地批量插入多个 WindowSorted 对象到数据库。
-    所有插入操作都在一个事务中完成。
+    所有插入操作都在一个事务中完成, 使用常驻的写连接。
 
     Args:
         window_dict: 一个包含多个 WindowSorted 对象的列表。
+        manager: 连接管理器, 默认使用 get_db_manager()
     """
     logger.info(f"准备批量插入 {len(window_dict)} 条窗口活动记录...")
-    conn = get_db_connection()
-    # 使用 "with conn:" 来自动管理事务。
-    # 它会在代码块开始时自动执行 BEGIN，
-    # 如果代码成功执行，则在结束时执行 COMMIT，
-    # 如果发生异常，则执行 ROLLBACK。
-    try:
-        with conn:
-            cursor = conn.cursor()
+    manager = manager or get_db_manager()
+    with manager.writer() as conn:
+        # 使用 "with conn:" 来自动管理事务。
+        # 它会在代码块开始时自动执行 BEGIN，
+        # 如果代码成功执行，则在结束时执行 COMMIT，
+        # 如果发生异常，则执行 ROLLBACK。
+        dimensions = get_dimension_cache(manager)
+        try:
+            with metrics.timer("db_insert"), conn:
+                _insert_windows(conn.cursor(), window_dict, dimensions)
+            dimensions.commit()
+            _count_rows((window_dict,))
+            logger.info("批量插入成功！所有数据已提交。")
+
+        except sqlite3.Error as e:
+            # 如果 "with conn" 代码块中出现任何数据库错误，
+            # 事务会自动回滚，数据库将保持操作前的状态。
+            dimensions.rollback()
+            logger.warning(f"批量插入时发生数据库错误: {e}. 事务已回滚。")
+
+
+def insert_window_batches(batches, manager=None):
+    """
+    在一个事务中插入多批 WindowSorted(组提交), 失败时整体回滚并把异常抛给调用方。
+
+    Args:
+        batches: WindowSorted 字典的列表, 每个字典为一个统计周期
+        manager: 连接管理器, 默认使用 get_db_manager()
+    """
+    manager = manager or get_db_manager()
+    with manager.writer() as conn:
+        dimensions = get_dimension_cache(manager)
+        try:
+            with metrics.timer("db_insert"), conn:
+                cursor = conn.cursor()
+                for window_dict in batches:
+                    _insert_windows(cursor, window_dict, dimensions)
+        except BaseException:
+            dimensions.rollback()
+            raise
+        dimensions.commit()
+        _count_rows(batches)
+
 
-            # 遍历每一个要插入的 WindowSorted 对象
-            for window_obj in window_dict.values():
-                # --- 步骤 1: 插入主表 (window_activity) ---
-                # 因为需要获取每个父记录的 lastrowid，所以主表记录仍然需要逐条插入。
-                # 但由于它们都在同一个事务中，所以速度依然非常快。
-
-                window_titles_json = json.dumps(window_obj.windowTitles)
-                keyboard_list_json = json.dumps(window_obj.keyboardInfo.keyPressList)
-
-                cursor.execute("""
-                               INSERT INTO window_activity (which_minute,window_hwnd, start_time, window_titles, main_window_time,
-                                                            media_use_time, micro_use_time, camera_use_time,
-                                                            media_share_time, micro_share_time, camera_share_time,
-                                                            keyboard_press_num, keyboard_press_list,
-                                                            mouse_scroll_num, mouse_move_num, mouse_left_click_num,
-                                                            mouse_right_click_num, mouse_other_click_num)
-                               VALUES (?,?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                               """, (
-                                   window_obj.whichMinute,
-                                   window_obj.windowHwnd, window_obj.startTime, window_titles_json,
-                                   window_obj.mainWindowTime, window_obj.mediaUseTime,
-                                   window_obj.microUseTime, window_obj.cameraUseTime,
-                                   window_obj.mediaShareTime, window_obj.microShareTime,
-                                   window_obj.cameraShareTime,
-                                   window_obj.keyboardInfo.keyPressNum, keyboard_list_json,
-                                   window_obj.mouseInfo.mouseScrollNum, window_obj.mouseInfo.mouseMoveNum,
-                                   window_obj.mouseInfo.mouseLeftClickNum, window_obj.mouseInfo.mouseRightClickNum,
-                                   window_obj.mouseInfo.mouseOtherClickNum
-                               ))
-
-                activity_id = cursor.lastrowid
-
-                # --- 步骤 2: 准备并批量插入子表 (process_snapshots) ---
-                # 这是另一个性能优化点：使用 executemany()
-
-                if not window_obj.processInfos:
-                    continue  # 如果没有进程信息，跳过
-
-                processes_to_insert = []
-                for pid, process_info in window_obj.processInfos.items():
-                    statuses_json = json.dumps(process_info.status)
-                    processes_to_insert.append((
-                        activity_id, process_info.pid, process_info.name, window_obj.whichMinute, process_info.path,
-
-                        process_info.username, process_info.startTime,statuses_json,
-                        process_info.memoryUsage.avgMemoryPercent,process_info.memoryUsage.avgRss,
-
-                        process_info.memoryUsage.avgVms,process_info.memoryUsage.avgPeakWSet,
-                        process_info.memoryUsage.avgNumPageFault,process_info.ioUsage.totalRCallNum,
-                        process_info.ioUsage.totalWCallNum,
-
-                        process_info.ioUsage.totalRByteNum,process_info.ioUsage.totalWByteNum,
-
-                    ))
-
-                # 使用 executemany 一次性插入所有关联的进程快照
-                # 注意：为了简洁，我只写了部分字段，请补全
-                cursor.executemany("""
-                                   INSERT INTO process_snapshots (
-                                        activity_id, pid, name, which_minute,path,
-                                        username,start_time,statuses,avg_memory_percent,avg_rss,
-                                        avg_vms,avg_peak_wset,avg_num_page_fault,total_read_call,total_write_call,
-                                        total_read_bytes,total_write_bytes
-                                   )
-                                   VALUES (?, ?, ?, ?, ?,
-                                           ?, ?, ?, ?, ?, 
-                                           ?, ?, ?, ?, ?, 
-                                           ?,?)
-                                   """, processes_to_insert)
-
-        logger.info("批量插入成功！所有数据已提交。")
-
-    except sqlite3.Error as e:
-        # 如果 "with conn" 代码块中出现任何数据库错误，
-        # 事务会自动回滚，数据库将保持操作前的状态。
-        logger.warning(f"批量插入时发生数据库错误: {e}. 事务已回滚。")
-    finally:
-        conn.close()
 logger = logging.getLogger(__name__)
-config = conf.settings
-db_file_path = setup_db_file()
-create_window_activity_table()
+# 连接管理器 -> DimensionCache
+_dimension_caches = weakref.WeakKeyDictionary()
+# 数据库文件和共享的连接管理器在第一次使用时创建, 导入本模块不会读取配置或打开数据库
+_db_lock = threading.Lock()
+_db_file_path = None
+_db_manager = None
+
+
+def get_db_file_path():
+    """按配置 db.file_name 确定数据库文件路径, 文件不存在时创建"""
+    global _db_file_path
+    with _db_lock:
+        if _db_file_path is None:
+            _db_file_path = setup_db_file()
+        return _db_file_path
+
+
+def get_db_manager():
+    """进程内共享的连接管理器, 写连接常驻; 第一次调用时建表和迁移"""
+    global _db_manager
+    if _db_manager is not None:
+        return _db_manager
+    db_path = get_db_file_path()
+    with _db_lock:
+        if _db_manager is None:
+            manager = create_connection_manager(db_path)
+            create_window_activity_table(manager)
+            _db_manager = manager
+        return _db_manager
 
 
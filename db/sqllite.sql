@@ -67,6 +67,8 @@ CREATE TABLE IF NOT EXISTS minute_initiativeUse (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     which_minute TimeStamp NOT NULL,
     is_initiactiveUse NOT NULL,
+    active_bitmap INTEGER NOT NULL DEFAULT 0,
+    keyboard_bitmap INTEGER NOT NULL DEFAULT 0
 )
 -- 在 process_snapshots 表的 activity_id 列上创建索引，以加速 JOIN 查询
 CREATE INDEX IF NOT EXISTS idx_process_snapshots_activity_id ON process_snapshots (activity_id);
@@ -0,0 +1,267 @@
+"""
+异步落库
+writer.py: 把每分钟的聚合结果交给独立的写线程, 调度任务不再等待磁盘
+- StorageWriter: 有界队列 + 写线程, 积压时把多个周期合并到一个事务提交,
+  队列满时先等待(背压), 超时后溢出到磁盘文件, 空闲时再读回写入
+- 数据库暂时不可写(sqlite3.OperationalError: 被锁、忙、磁盘已满)时周期溢出到 spill-*.pkl,
+  按指数退避一直重试, 不设次数上限; 数据本身有问题或无法读取的周期改名为 spill-*.bad 隔离,
+  不再重试, 排查后改回 .pkl 即可重新写入
+"""
+import glob
+import logging
+import os
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+
+import db.sqlite
+from data import counter
+
+logger = logging.getLogger(__name__)
+
+# 通知写线程退出的哨兵, 排在它之前的批次都会被写完
+_STOP = object()
+
+
+class StorageWriter:
+    def __init__(self, manager=None, max_queue=16, max_batch=8, block_timeout=5.0, spill_dir=None,
+                 max_retry_second=300):
+        """
+        :param manager: 连接管理器, 默认使用 db.sqlite.get_db_manager()
+        :param max_queue: 队列中最多积压的周期数
+        :param max_batch: 一个事务最多合并的周期数
+        :param block_timeout: 队列满时 submit 最多等待的秒数
+        :param spill_dir: 溢出文件目录, 为 None 时等待超时后丢弃该周期
+        :param max_retry_second: 溢出文件因数据库不可写而失败后, 重试间隔翻倍增长的上限(秒)
+        """
+        self.manager = manager
+        self.maxBatch = max(max_batch, 1)
+        self.blockTimeout = block_timeout
+        self.spillDir = spill_dir
+        self.maxRetrySecond = max(max_retry_second, 1)
+        # 读回溢出文件的退避: 当前间隔(秒)和下一次允许重试的时间(time.monotonic)
+        self._retry_delay = 0
+        self._retry_at = 0.0
+        self._queue = queue.Queue(maxsize=max(max_queue, 1))
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._commits = 0
+        self._committed_batches = 0
+        self._failed_batches = 0
+        self._spilled = 0
+        self._dropped = 0
+        self._quarantined = 0
+        self._last_commit_ms = 0.0
+        self._max_commit_ms = 0.0
+        self._total_commit_ms = 0.0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, window_dict):
+        """
+        提交一个周期的 WindowSorted 字典。
+        :return: True 表示已进入队列, False 表示已溢出到磁盘或被丢弃
+        """
+        try:
+            self._queue.put(window_dict, timeout=self.blockTimeout)
+            return True
+        except queue.Full:
+            pass
+        if self.spillDir:
+            self._spill(window_dict)
+        else:
+            with self._stats_lock:
+                self._dropped += 1
+            logger.warning(f"落库队列已满, 丢弃 {len(window_dict)} 条窗口活动记录")
+        return False
+
+    def stop(self, timeout=None):
+        """
+        按顺序写完队列里的全部周期和溢出文件后退出写线程。
+        """
+        if self._thread is None:
+            return
+        # 哨兵必须进入队列, 这里不使用超时
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("落库线程未在超时时间内退出")
+            return
+        self._thread = None
+
+    def stats(self):
+        """队列深度与提交耗时"""
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "commits": self._commits,
+                "committed_batches": self._committed_batches,
+                "failed_batches": self._failed_batches,
+                "spilled_batches": self._spilled,
+                "dropped_batches": self._dropped,
+                "quarantined_batches": self._quarantined,
+                "spill_files": len(self._spill_files()),
+                "spill_retry_second": self._retry_delay,
+                "last_commit_ms": self._last_commit_ms,
+                "max_commit_ms": self._max_commit_ms,
+                "avg_commit_ms": self._total_commit_ms / self._commits if self._commits else 0.0,
+            }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                # 空闲时把溢出文件读回来
+                self._replay_spill(limit=1)
+                continue
+            batches = []
+            if item is _STOP:
+                stopping = True
+            else:
+                batches.append(item)
+                # 积压时把后面的周期一起取出, 合并为一个事务
+                while len(batches) < self.maxBatch:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batches.append(item)
+            if batches:
+                self._commit(batches)
+        # 退出前不管退避再尝试一次, 失败的文件留到下次启动
+        self._replay_spill(force=True)
+
+    def _commit(self, batches):
+        """提交队列中取出的周期, 失败时按原因溢出或隔离"""
+        try:
+            self._write(batches)
+            return True
+        except sqlite3.OperationalError as e:
+            # 数据库被锁、忙或磁盘错误, 先落到溢出文件, 稍后重试
+            logger.warning(f"组提交 {len(batches)} 个周期失败: {e}")
+            with self._stats_lock:
+                self._failed_batches += len(batches)
+            if self.spillDir:
+                for window_dict in batches:
+                    self._spill(window_dict)
+            return False
+        except Exception as e:
+            if len(batches) > 1:
+                # 逐个周期重新提交, 只隔离出错的那一个
+                for window_dict in batches:
+                    self._commit([window_dict])
+                return False
+            logger.error(f"写入周期失败, 不再重试: {e}")
+            with self._stats_lock:
+                self._failed_batches += 1
+            if self.spillDir:
+                self._spill(batches[0], quarantine=True)
+            return False
+
+    def _write(self, batches):
+        started = time.perf_counter()
+        db.sqlite.insert_window_batches(batches, self.manager)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._commits += 1
+            self._committed_batches += len(batches)
+            self._last_commit_ms = elapsed_ms
+            self._max_commit_ms = max(self._max_commit_ms, elapsed_ms)
+            self._total_commit_ms += elapsed_ms
+        logger.info(f"组提交 {len(batches)} 个周期, 耗时 {elapsed_ms:.1f} ms")
+
+    def _spill_files(self):
+        if not self.spillDir:
+            return []
+        return sorted(glob.glob(os.path.join(self.spillDir, "spill-*.pkl")))
+
+    @staticmethod
+    def _portable(window_dict):
+        """按键直方图的编码只在本进程有效, 写出前换成 {按键名称: 次数}, 重启后读回也能对上"""
+        for window_obj in window_dict.values():
+            keyboard_info = window_obj.keyboardInfo
+            if not isinstance(keyboard_info.keyCounts, dict):
+                keyboard_info.keyCounts = counter.histogram_to_dict(keyboard_info.keyCounts)
+        return window_dict
+
+    def _spill(self, window_dict, quarantine=False):
+        path = os.path.join(self.spillDir, f"spill-{time.time_ns()}.{'bad' if quarantine else 'pkl'}")
+        try:
+            with open(path + ".tmp", "wb") as file:
+                pickle.dump(self._portable(window_dict), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"写入溢出文件失败, 丢弃该周期: {e}")
+            with self._stats_lock:
+                self._dropped += 1
+            return
+        if quarantine:
+            with self._stats_lock:
+                self._quarantined += 1
+            logger.error(f"{len(window_dict)} 条窗口活动记录隔离到 {path}")
+            return
+        with self._stats_lock:
+            self._spilled += 1
+        logger.warning(f"落库积压, {len(window_dict)} 条窗口活动记录溢出到 {path}")
+
+    def _quarantine(self, path):
+        bad_path = path[:-len(".pkl")] + ".bad"
+        try:
+            os.replace(path, bad_path)
+        except OSError as e:
+            logger.warning(f"隔离溢出文件 {path} 失败: {e}")
+            return
+        with self._stats_lock:
+            self._quarantined += 1
+        logger.error(f"溢出文件隔离为 {bad_path}")
+
+    def _replay_spill(self, limit=None, force=False):
+        """
+        :param force: 忽略退避, 立即尝试
+        """
+        if not force and time.monotonic() < self._retry_at:
+            return
+        for path in self._spill_files()[:limit]:
+            try:
+                with open(path, "rb") as file:
+                    window_dict = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.warning(f"读取溢出文件 {path} 失败: {e}")
+                self._quarantine(path)
+                continue
+            try:
+                self._write([window_dict])
+            except sqlite3.OperationalError as e:
+                with self._stats_lock:
+                    self._failed_batches += 1
+                # 数据库仍不可写: 文件保持原样, 间隔翻倍后再试, 后面的文件这一轮也不再尝试
+                self._retry_delay = min(max(self._retry_delay * 2, 1), self.maxRetrySecond)
+                self._retry_at = time.monotonic() + self._retry_delay
+                logger.warning(f"溢出文件 {path} 写入失败, {self._retry_delay} 秒后重试: {e}")
+                return
+            except Exception as e:
+                with self._stats_lock:
+                    self._failed_batches += 1
+                logger.error(f"溢出文件 {path} 写入失败, 不再重试: {e}")
+                self._quarantine(path)
+                continue
+            self._retry_delay = 0
+            self._retry_at = 0.0
+            os.remove(path)
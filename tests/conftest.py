@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db.sqlite  # noqa: E402
+
+
+@pytest.fixture
+def manager(tmp_path):
+    """建好表的临时数据库"""
+    manager = db.sqlite.create_connection_manager(str(tmp_path / "test.db"))
+    db.sqlite.create_window_activity_table(manager)
+    yield manager
+    manager.close()
@@ -0,0 +1,53 @@
+from data import counter
+from data.timeline import KEYS, MOVES, ActivityTimeline
+
+
+def _slot(buf, hwnd):
+    base = buf.index[hwnd]
+    return list(buf.counts[base:base + counter.SLOT_WIDTH])
+
+
+def test_merge_adds_to_local_counts():
+    counters = counter.InputCounters(slots=1)
+    counters.add(1, counter.MOUSE_MOVE)
+    counters.add_key(1, "'x'")
+    x = counter.key_codes.code("'x'")
+    y = counter.key_codes.intern("'y'")
+    counts = [0] * counter.SLOT_WIDTH
+    counts[counter.KEY_PRESS], counts[counter.MOUSE_MOVE] = 3, 2
+    counters.merge(1, counts, [(x, 1), (y, 2)])
+    # 新的 hwnd 超出预分配的槽位时扩容
+    counters.merge(2, [0, 0, 0, 1, 0, 0])
+    assert counters.total == 8
+
+    buf, total = counters.get_and_reset()
+    assert total == 8 and buf.hwnds == [1, 2]
+    assert _slot(buf, 1)[counter.KEY_PRESS] == 4 and _slot(buf, 1)[counter.MOUSE_MOVE] == 3
+    assert _slot(buf, 2)[counter.MOUSE_LEFT_CLICK] == 1
+    assert counter.histogram_to_dict(buf.histograms[0]) == {"'x'": 2, "'y'": 2}
+
+    counters.recycle(buf)
+    assert counters.total == 0
+    buf, total = counters.get_and_reset()
+    assert total == 0 and buf.hwnds == []
+
+
+def test_merge_records_timeline_at_event_time():
+    timeline = ActivityTimeline(seconds=120)
+    counters = counter.InputCounters(timeline=timeline)
+    counts = [0] * counter.SLOT_WIDTH
+    counts[counter.KEY_PRESS], counts[counter.MOUSE_MOVE] = 2, 5
+    counters.merge(7, counts, now=1_700_000_010.5)
+    assert timeline.bucket(1_700_000_010) == (2, 0, 5, 0, 7)
+    assert timeline.bitmap(1_700_000_000, column=KEYS) == 1 << 10
+    assert timeline.bitmap(1_700_000_000, column=MOVES) == 1 << 10
+    # 只补直方图的合并不计入时间线
+    counters.merge(7, (), [(counter.key_codes.intern("'a'"), 2)], now=1_700_000_020)
+    assert timeline.bucket(1_700_000_020) is None
+
+
+def test_key_histogram_grows_for_large_codes():
+    histogram = counter.new_histogram(4)
+    counter.add_key_code(histogram, 9, 3)
+    assert len(histogram) >= 10 and histogram[9] == 3
+    assert counter.merge_histogram(counter.new_histogram(2), histogram)[9] == 3
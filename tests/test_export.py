@@ -0,0 +1,68 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+
+import db.sqlite
+from data.format import SortedPeriod, WindowSorted
+from db import export
+from db.writer import StorageWriter
+
+NOW = datetime(2026, 1, 1, 12, 0)
+
+
+def _period(minute, hwnd=1):
+    window_obj = WindowSorted()
+    window_obj.whichMinute = minute
+    window_obj.windowHwnd = hwnd
+    return SortedPeriod({hwnd: window_obj})
+
+
+@pytest.fixture
+def writer_conf(monkeypatch):
+    writer_conf = {"enabled": True, "max_queue": 4, "block_timeout_second": 5}
+    monkeypatch.setitem(export.conf.settings["db"], "writer", writer_conf)
+    return writer_conf
+
+
+def test_settled_minute_holds_back_writer_lag(manager, writer_conf):
+    # 4 个积压的周期 + 5 秒等待 + 正在整理的一分钟
+    assert export.settled_minute(manager, now=NOW) == "2026-01-01 11:54"
+    writer_conf["enabled"] = False
+    assert export.settled_minute(manager, now=NOW) == "2026-01-01 11:59"
+
+
+def test_settled_minute_stops_at_spilled_minute(manager, writer_conf, tmp_path):
+    writer = StorageWriter(manager=manager, spill_dir=str(tmp_path / "spill"))
+    writer._spill(_period("2026-01-01 10:30"))
+    assert export.settled_minute(manager, now=NOW) == "2026-01-01 10:30"
+
+
+def _exported_minutes(result):
+    if result["path"] is None:
+        return []
+    with gzip.open(result["path"], "rt", encoding="utf-8") as file:
+        return [json.loads(line)["which_minute"] for line in file]
+
+
+def test_minute_watermark_exports_late_rows(manager, writer_conf, tmp_path, monkeypatch):
+    clock = {"now": datetime(2026, 1, 1, 10, 40)}
+    settled = export.settled_minute
+    monkeypatch.setattr(export, "settled_minute", lambda manager=None: settled(manager, clock["now"]))
+    writer = StorageWriter(manager=manager, spill_dir=str(tmp_path / "spill"))
+    db.sqlite.insert_window_batches([_period("2026-01-01 10:00")], manager)
+    # 10:20 的周期因数据库被锁而溢出, 还没有写回
+    writer._spill(_period("2026-01-01 10:20"))
+    db.sqlite.insert_window_batches([_period("2026-01-01 10:25")], manager)
+
+    out = str(tmp_path / "out")
+    first = export.export("window_activity", out, fmt="ndjson", name="t", watermark="minute", manager=manager)
+    assert _exported_minutes(first) == ["2026-01-01 10:00"]
+    assert first["end"] == "2026-01-01 10:20"
+
+    writer._replay_spill(force=True)
+    clock["now"] = datetime(2026, 1, 1, 11, 0)
+    second = export.export("window_activity", out, fmt="ndjson", name="t", watermark="minute", manager=manager)
+    # 按 id 导出, 晚提交的 10:20 排在后面
+    assert _exported_minutes(second) == ["2026-01-01 10:25", "2026-01-01 10:20"]
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import db.sqlite
+from data.format import SortedPeriod, WindowSorted
+from db import query, rollup
+from db.rollup import RollupEngine
+
+
+def _insert(manager, minute, key_presses, clicks=0, hwnd=1):
+    window_obj = WindowSorted()
+    window_obj.whichMinute = minute
+    window_obj.windowHwnd = hwnd
+    window_obj.startTime = minute
+    window_obj.keyboardInfo.keyPressNum = key_presses
+    window_obj.mouseInfo.mouseLeftClickNum = clicks
+    db.sqlite.insert_window_batches([SortedPeriod({hwnd: window_obj})], manager)
+
+
+def _intensity(manager, start, end, chunk_size=None):
+    chunks = list(query.input_intensity_per_hour(start, end, chunk_size=chunk_size, manager=manager))
+    return chunks, [(row["hour"], row["minutes"], row["key_presses"], row["clicks"]) for row in query.rows(chunks)]
+
+
+def test_build_reads_rolled_up_hours_and_raw_edges():
+    watermarks = {rollup.HOUR: datetime(2026, 1, 1, 12, 0)}
+    sql, params = query.build("input_intensity_per_hour", "2026-01-01 09:30", "2026-01-01 13:00", watermarks)
+    assert sql.count("FROM input_rollup_hourly") == 1 and sql.count("FROM window_activity") == 2
+    assert params == ("2026-01-01 09:30", "2026-01-01 10:00", "2026-01-01 10", "2026-01-01 12",
+                      "2026-01-01 12:00", "2026-01-01 13:00")
+    sql, params = query.build("input_intensity_per_hour", "2026-01-01 09:30", "2026-01-01 13:00", {})
+    assert "rollup" not in sql and params == ("2026-01-01 09:30", "2026-01-01 13:00")
+
+
+def test_tiered_report_matches_raw_after_rollup(manager):
+    for minute, keys, clicks in [("2026-01-01 09:40", 5, 1), ("2026-01-01 10:10", 3, 0),
+                                 ("2026-01-01 10:11", 4, 2), ("2026-01-01 12:05", 1, 1)]:
+        _insert(manager, minute, keys, clicks)
+    start, end = "2026-01-01 09:30", "2026-01-01 13:00"
+    _, raw = _intensity(manager, start, end)
+    assert raw == [("2026-01-01 09", 1, 5, 1), ("2026-01-01 10", 2, 7, 2), ("2026-01-01 12", 1, 1, 1)]
+
+    RollupEngine(manager).rollup(now=datetime(2026, 1, 1, 12, 30))
+    chunks, tiered = _intensity(manager, start, end, chunk_size=2)
+    assert tiered == raw
+    # 按块产出
+    assert [len(chunk) for chunk in chunks] == [2, 1]
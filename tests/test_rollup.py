@@ -0,0 +1,145 @@
+from datetime import datetime
+
+import pytest
+
+import db.sqlite
+from data.collect import ProcessInfo, WindowInfo
+from data.format import SortedPeriod, WindowSorted
+from db import query, rollup
+from db.rollup import DAY, HOUR, RollupEngine
+
+
+def _process(pid, name):
+    process_info = ProcessInfo()
+    process_info.pid = pid
+    process_info.name = name
+    process_info.startTime = 1000.0 + pid
+    process_info.path = f"/usr/bin/{name}"
+    process_info.username = "user"
+    process_info.status = "running"
+    memory, io = process_info.memoryUsage, process_info.ioUsage
+    memory.rss, memory.vms, memory.peakWSet, memory.numPageFault, memory.memoryPercent = 100, 200, 0, 0, 1.0
+    io.RCallNum = io.WCallNum = io.RByteNum = io.WByteNum = 0
+    return process_info
+
+
+def _insert(manager, minute, processes, hwnd=1, title="title", key_counts=None):
+    """一分钟的前台窗口活动, processes 为 [(pid, 进程名)], 第一个是窗口的所属进程"""
+    window = WindowInfo(hwnd, title, tuple(pid for pid, _ in processes))
+    window.whichTime = datetime.strptime(minute, "%Y-%m-%d %H:%M")
+    window.startTime = 1000.0
+    window.interval = 60
+    window.isMainWindow = True
+    window.processInfos = [_process(pid, name) for pid, name in processes]
+    window_obj = WindowSorted()
+    window_obj.update(window, None)
+    if key_counts:
+        window_obj.keyboardInfo.keyCounts = dict(key_counts)
+        window_obj.keyboardInfo.keyPressNum = sum(key_counts.values())
+    period = SortedPeriod({hwnd: window_obj})
+    period.minuteActivities = [(minute, 1, 1, 0)]
+    db.sqlite.insert_window_batches([period], manager)
+
+
+def _apps(manager, start="2026-01-01 00:00", end="2026-02-01 00:00"):
+    return {row["app"]: (row["foreground_seconds"], row["active_minutes"])
+            for row in query.rows(query.time_per_app(start, end, manager=manager))}
+
+
+def _count(manager, table):
+    with manager.reader() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_multi_process_window_counts_once_for_owner(manager):
+    _insert(manager, "2026-01-01 10:05", [(10, "chrome"), (11, "chrome-gpu"), (12, "chrome-renderer")],
+            key_counts={"'a'": 2})
+    _insert(manager, "2026-01-01 10:06", [(20, "editor")], hwnd=2)
+    expected = {"chrome": (60.0, 1), "editor": (60.0, 1)}
+    assert _apps(manager) == expected
+    keys = list(query.rows(query.top_keys_per_app("2026-01-01 00:00", "2026-02-01 00:00", manager=manager)))
+    assert keys == [{"app": "chrome", "key": "'a'", "press_count": 2}]
+
+    # 汇总表与明细结果一致
+    RollupEngine(manager).rollup(now=datetime(2026, 1, 1, 12, 0))
+    with manager.reader() as conn:
+        hourly = conn.execute("SELECT app, foreground_seconds, active_minutes FROM app_rollup_hourly").fetchall()
+    assert {app: (seconds, minutes) for app, seconds, minutes in hourly} == expected
+    assert _apps(manager) == expected
+
+
+def _watermarks(manager):
+    with manager.reader() as conn:
+        return {level: rollup._format(moment) for level, moment in rollup.read_watermarks(conn).items()}
+
+
+def test_rollup_watermarks_advance_incrementally(manager):
+    engine = RollupEngine(manager, grace_minutes=10)
+    _insert(manager, "2026-01-01 10:05", [(10, "chrome")])
+    assert engine.rollup(now=datetime(2026, 1, 1, 11, 5)) == {HOUR: 0, DAY: 0}
+    assert _watermarks(manager) == {HOUR: "2026-01-01 10:00", DAY: "2026-01-01 00:00"}
+
+    assert engine.rollup(now=datetime(2026, 1, 1, 12, 0)) == {HOUR: 1, DAY: 0}
+    assert _watermarks(manager)[HOUR] == "2026-01-01 11:00"
+    # 已汇总的小时再写入的迟到明细不进入汇总表, 查询在已汇总的范围上读小时表
+    _insert(manager, "2026-01-01 10:30", [(10, "chrome")])
+    _insert(manager, "2026-01-02 09:00", [(20, "editor")], hwnd=2)
+    assert _apps(manager)["chrome"] == (60.0, 1)
+
+    assert engine.rollup(now=datetime(2026, 1, 3, 1, 0)) == {HOUR: 37, DAY: 2}
+    assert _watermarks(manager) == {HOUR: "2026-01-03 00:00", DAY: "2026-01-03 00:00"}
+    with manager.reader() as conn:
+        daily = conn.execute("SELECT period, app, foreground_seconds FROM app_rollup_daily ORDER BY period").fetchall()
+    assert daily == [("2026-01-01", "chrome", 60.0), ("2026-01-02", "editor", 60.0)]
+    # 再次执行没有新的整小时, 不会重复汇总
+    assert engine.rollup(now=datetime(2026, 1, 3, 1, 5)) == {HOUR: 0, DAY: 0}
+    assert _count(manager, "app_rollup_daily") == 2
+
+
+def test_retention_deletes_rolled_up_raw_rows_and_orphans(manager):
+    _insert(manager, "2026-01-01 10:05", [(10, "chrome")], title="old title", key_counts={"'q'": 1})
+    _insert(manager, "2026-01-02 09:00", [(20, "editor")], hwnd=2, title="new title", key_counts={"'w'": 1})
+    engine = RollupEngine(manager, raw_retention_days=1)
+    # 没有汇总过的明细不删除
+    assert engine.apply_retention(now=datetime(2026, 1, 5)) == 0
+
+    engine.rollup(now=datetime(2026, 1, 3, 1, 0))
+    assert engine.apply_retention(now=datetime(2026, 1, 3, 1, 0)) == 1
+    with manager.reader() as conn:
+        assert conn.execute("SELECT which_minute FROM window_activity").fetchall() == [("2026-01-02 09:00",)]
+        assert conn.execute("SELECT which_minute FROM minute_initiativeUse").fetchall() == [("2026-01-02 09:00",)]
+        assert conn.execute("SELECT title FROM window_title").fetchall() == [("new title",)]
+        assert conn.execute("SELECT name FROM key_name").fetchall() == [("'w'",)]
+        # 进程身份还被汇总表引用, 保留
+        assert conn.execute("SELECT COUNT(*) FROM process_identity").fetchone()[0] == 2
+    # 删除明细后整个范围仍可从汇总表读出
+    assert _apps(manager) == {"chrome": (60.0, 1), "editor": (60.0, 1)}
+
+
+def _moment(minute):
+    return datetime.strptime(minute, "%Y-%m-%d %H:%M")
+
+
+@pytest.mark.parametrize("watermarks, levels, expected", [
+    ({}, (HOUR, DAY), [(None, "2026-01-01 10:30", "2026-01-04 05:10")]),
+    ({HOUR: "2026-01-01 13:00"}, (HOUR, DAY), [
+        (None, "2026-01-01 10:30", "2026-01-01 11:00"),
+        (HOUR, "2026-01-01 11:00", "2026-01-01 13:00"),
+        (None, "2026-01-01 13:00", "2026-01-04 05:10")]),
+    ({HOUR: "2026-01-04 05:00", DAY: "2026-01-03 00:00"}, (HOUR, DAY), [
+        (None, "2026-01-01 10:30", "2026-01-01 11:00"),
+        (HOUR, "2026-01-01 11:00", "2026-01-02 00:00"),
+        (DAY, "2026-01-02 00:00", "2026-01-03 00:00"),
+        (HOUR, "2026-01-03 00:00", "2026-01-04 05:00"),
+        (None, "2026-01-04 05:00", "2026-01-04 05:10")]),
+    # 只能用小时表的报表不会读天表
+    ({HOUR: "2026-01-04 05:00", DAY: "2026-01-03 00:00"}, (HOUR,), [
+        (None, "2026-01-01 10:30", "2026-01-01 11:00"),
+        (HOUR, "2026-01-01 11:00", "2026-01-04 05:00"),
+        (None, "2026-01-04 05:00", "2026-01-04 05:10")]),
+    # 范围内没有完整的已汇总小时
+    ({HOUR: "2026-01-01 11:00"}, (HOUR, DAY), [(None, "2026-01-01 10:30", "2026-01-04 05:10")]),
+])
+def test_plan_tiers(watermarks, levels, expected):
+    watermarks = {level: _moment(minute) for level, minute in watermarks.items()}
+    assert rollup.plan("2026-01-01 10:30", "2026-01-04 05:10", watermarks, levels) == expected
@@ -0,0 +1,28 @@
+import threading
+
+from data import schedule
+
+
+def _wait_run(manager, job_id):
+    ran = threading.Event()
+    manager.add_second(1, job_id, ran.set)
+    manager.start()
+    return ran.wait(3)
+
+
+def test_shared_runtime_recreated_after_last_job_removed():
+    first = schedule.SchedulerManager()
+    assert _wait_run(first, "test_first")
+    runtime = first.runtime
+    first.shutdown()
+    assert runtime.closed and not runtime.running
+
+    second = schedule.SchedulerManager()
+    assert _wait_run(second, "test_second")
+    assert second.runtime is not runtime
+    # 先前的管理器再注册任务时也换到新的运行时
+    assert _wait_run(first, "test_first_again")
+    assert first.runtime is second.runtime
+    first.shutdown()
+    second.shutdown()
+    assert not first.running and not second.running
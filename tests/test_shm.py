@@ -0,0 +1,130 @@
+import pytest
+
+from data import counter, metrics, shm
+from data.backend import SyntheticBackend
+from data.collect import KeyMouseData, WindowInfo, WindowsData
+
+
+@pytest.fixture
+def ring():
+    ring = shm.RingBuffer.create(slots=4)
+    yield ring
+    ring.close()
+
+
+@pytest.fixture
+def collector():
+    """不启动工作进程, 由测试直接往缓冲区写入记录"""
+    backend = SyntheticBackend(windows=5, processes=20, seed=1, pids_per_window=3)
+    win_datas = WindowsData(5, backend=backend)
+    received = []
+    win_datas.set_sink(received.append)
+    km_datas = KeyMouseData(backend=backend, foreground=win_datas.foreground, timeline_seconds=0)
+    collector = shm.SharedMemoryCollector(win_datas, km_datas, settings={})
+    collector.ring = shm.RingBuffer.create(slots=64)
+    collector.received = received
+    yield collector
+    collector.ring.close()
+
+
+def test_ring_wraparound(ring):
+    records = [bytes([i]) * 8 for i in range(10)]
+    received = []
+    # 每次写 3 条读一次, 序号越过槽位数后下标回绕
+    for start in range(0, 9, 3):
+        assert ring.push(records[start:start + 3])
+        received += [record[:8] for record in ring.pop_all()]
+    assert received == records[:9]
+    assert ring.push(records[:4])
+    # 空间不足时整批都不写
+    assert not ring.push(records[:1])
+    assert ring.free() == 0
+    assert len(ring.pop_all()) == 4 and ring.free() == 4
+
+
+def test_ring_losses(ring):
+    ring.count_loss(tick=True)
+    ring.count_loss(tick=False)
+    ring.count_loss(tick=False)
+    ring.count_truncated(3)
+    assert ring.losses() == (1, 2, 3)
+
+
+def test_tick_round_trip(collector):
+    windows = collector.winDatas.snapshot_windows()
+    assert collector.ring.push(shm.encode_tick(1, windows))
+    collector.consume()
+    (decoded,) = collector.received
+    assert [w.windowId for w in decoded] == [w.windowId for w in windows]
+    for original, window in zip(windows, decoded):
+        assert window.windowTitle == original.windowTitle
+        assert window.pids == tuple(original.pids)
+        assert window.isMainWindow == original.isMainWindow
+        assert [p.pid for p in window.processInfos] == [p.pid for p in original.processInfos]
+        for process, original_process in zip(window.processInfos, original.processInfos):
+            assert process.name == original_process.name
+            assert process.memoryUsage.rss == original_process.memoryUsage.rss
+            assert process.ioUsage.RByteNum == original_process.ioUsage.RByteNum
+
+
+def test_inputs_round_trip(collector):
+    source = counter.InputCounters()
+    source.add_key(7, "Key.enter")
+    source.add_key(7, "Key.enter")
+    source.add_key(7, "'a'")
+    source.add(8, counter.MOUSE_MOVE)
+    source.add(8, counter.MOUSE_LEFT_CLICK)
+    buf, _ = source.get_and_reset()
+    records, _ = shm.encode_inputs(buf, 1_700_000_000.0)
+    assert collector.ring.push(records)
+    collector.consume()
+    windows, total = collector.kmDatas.get_and_reset()
+    assert total == 5
+    keyboard = windows[7].keyboardInfo
+    assert keyboard.keyPressNum == 3
+    assert counter.histogram_to_dict(keyboard.keyCounts) == {"Key.enter": 2, "'a'": 1}
+    assert windows[8].mouseInfo.mouseMoveNum == 1 and windows[8].mouseInfo.mouseLeftClickNum == 1
+
+
+def test_unknown_key_code_counted_as_unknown(collector):
+    source = counter.InputCounters()
+    source.add_key(7, "Key.esc")
+    buf, _ = source.get_and_reset()
+    records, _ = shm.encode_inputs(buf, 1_700_000_000.0)
+    # 模拟工作进程重启后编码表已清空: 丢掉 KEY_NAME 记录
+    records = [record for record in records if record[0] != shm.KEY_NAME]
+    assert collector.ring.push(records)
+    collector.consume()
+    windows, _ = collector.kmDatas.get_and_reset()
+    assert counter.histogram_to_dict(windows[7].keyboardInfo.keyCounts) == {"?": 1}
+
+
+def test_bad_record_does_not_drop_the_batch(collector):
+    # 条目数超过 MAX_KEY_PAIRS 的损坏记录
+    padding = [0] * shm.MAX_KEY_PAIRS
+    records = [shm._KEYS.pack(shm.KEYS, shm.MAX_KEY_PAIRS + 1, 7, *padding, *padding)]
+    records += shm.encode_tick(1, collector.winDatas.snapshot_windows())
+    assert collector.ring.push(records)
+    assert collector.consume() == len(records)
+    assert len(collector.received) == 1
+
+
+def _truncated_metric():
+    return metrics.snapshot()["counters"].get("shm_truncated_total", {}).get("", 0)
+
+
+def test_truncation_counted(collector, monkeypatch):
+    monkeypatch.setattr(metrics.registry, "enabled", True)
+    counted = _truncated_metric()
+    window = WindowInfo(1, "标题" * 100, list(range(1, shm.MAX_WINDOW_PIDS + 5)))
+    before = shm._truncated
+    records = shm.encode_tick(1, [window])
+    assert shm._truncated - before == 2
+    collector.ring.count_truncated(shm._truncated - before)
+    assert collector.ring.push(records)
+    collector.consume()
+    (decoded,) = collector.received
+    assert len(decoded[0].pids) == shm.MAX_WINDOW_PIDS
+    # 截断落在多字节字符中间时丢弃残缺的部分
+    assert decoded[0].windowTitle == "标题" * 42 + "标"
+    assert _truncated_metric() - counted == 2
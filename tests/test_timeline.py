@@ -0,0 +1,111 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from data.timeline import MINUTE_BITS, ActivityTimeline, IdleRuns, idle_runs
+from db import query
+
+ORIGIN = datetime(2026, 1, 1, 8, 0)
+
+
+def _brute_runs(seconds, min_length):
+    """逐秒扫描: seconds 为 {秒: 是否空闲}, 没有的秒视为没有记录"""
+    runs = []
+    start = None
+    for second in range(max(seconds, default=0) + 2):
+        if seconds.get(second):
+            if start is None:
+                start = second
+            continue
+        if start is not None and second - start >= min_length:
+            runs.append((start, second - start))
+        start = None
+    return runs
+
+
+def _random_minutes(seed, count=90):
+    """随机的分钟位图, 中间留出没有记录的分钟; 多数秒空闲, 以便产生跨分钟的长空闲"""
+    rng = random.Random(seed)
+    minutes = {}
+    for minute in range(count):
+        if rng.random() < 0.15:
+            continue
+        if rng.random() < 0.4:
+            active = 0
+        else:
+            active = sum(1 << bit for bit in range(MINUTE_BITS) if rng.random() < 0.05)
+        keyboard = active & rng.getrandbits(MINUTE_BITS)
+        minutes[minute] = (active, keyboard)
+    return minutes
+
+
+def _per_second(minutes):
+    seconds = {}
+    for minute, (active, _) in minutes.items():
+        for bit in range(MINUTE_BITS):
+            seconds[minute * MINUTE_BITS + bit] = not active >> bit & 1
+    return seconds
+
+
+@pytest.mark.parametrize("idle", [0, 1, 0b1011, (1 << MINUTE_BITS) - 1, 0b111000111 << 50])
+def test_idle_runs_single_word(idle):
+    seconds = {bit: bool(idle >> bit & 1) for bit in range(MINUTE_BITS)}
+    assert idle_runs(idle) == _brute_runs(seconds, 1)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("min_length", [1, 30, 300])
+def test_idle_runs_join_adjacent_minutes(seed, min_length):
+    minutes = _random_minutes(seed)
+    runs = IdleRuns(min_length)
+    for minute in sorted(minutes):
+        runs.add(minute * MINUTE_BITS, ~minutes[minute][0])
+    assert runs.finish() == _brute_runs(_per_second(minutes), min_length)
+
+
+def test_idle_run_cut_by_missing_minute():
+    runs = IdleRuns()
+    runs.add(0, (1 << MINUTE_BITS) - 1)
+    runs.add(120, (1 << MINUTE_BITS) - 1)
+    assert runs.finish() == [(0, 60), (120, 60)]
+
+
+def _store(manager, minutes):
+    with manager.writer() as conn, conn:
+        conn.executemany(
+            "INSERT INTO minute_initiativeUse (which_minute, is_initiative_use, active_bitmap, keyboard_bitmap) "
+            "VALUES (?, ?, ?, ?)",
+            [((ORIGIN + timedelta(minutes=minute)).strftime(query.MINUTE_FORMAT), int(bool(active)), active, keyboard)
+             for minute, (active, keyboard) in minutes.items()])
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_active_time_and_idle_gaps_match_per_second_scan(manager, seed):
+    minutes = _random_minutes(seed)
+    _store(manager, minutes)
+    end = ORIGIN + timedelta(minutes=max(minutes) + 1)
+
+    result = query.active_time(ORIGIN, end, manager=manager)
+    assert result == {
+        "recorded_seconds": len(minutes) * MINUTE_BITS,
+        "active_seconds": sum(bin(active).count("1") for active, _ in minutes.values()),
+        "keyboard_seconds": sum(bin(keyboard).count("1") for _, keyboard in minutes.values()),
+        "active_minutes": sum(1 for active, _ in minutes.values() if active),
+    }
+
+    expected = [{"start": (ORIGIN + timedelta(seconds=start)).strftime("%Y-%m-%d %H:%M:%S"), "seconds": length}
+                for start, length in _brute_runs(_per_second(minutes), 120)]
+    assert query.idle_gaps(ORIGIN, end, min_seconds=120, manager=manager) == expected
+
+
+def test_timeline_bitmap_and_wraparound():
+    timeline = ActivityTimeline(seconds=60)
+    base = 1_700_000_040
+    timeline.record(1, 0, now=base + 3)
+    assert timeline.bitmap(base) == 1 << 3
+    # 一圈之后同一个桶被新的秒覆盖, 旧的秒读不到
+    timeline.record(2, 0, now=base + 63)
+    assert timeline.bucket(base + 3) is None
+    assert timeline.bitmap(base + 60) == 1 << 3
+    assert timeline.bucket(base + 63)[-1] == 2
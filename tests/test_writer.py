@@ -0,0 +1,58 @@
+import os
+import sqlite3
+
+from data.format import SortedPeriod, WindowSorted
+from db.writer import StorageWriter
+
+
+def _period(minute="2026-01-01 00:00", hwnd=1):
+    window_obj = WindowSorted()
+    window_obj.whichMinute = minute
+    window_obj.windowHwnd = hwnd
+    return SortedPeriod({hwnd: window_obj})
+
+
+def _spill_names(writer):
+    return sorted(os.path.splitext(name)[1] for name in os.listdir(writer.spillDir))
+
+
+def test_locked_database_keeps_spill_file_and_backs_off(manager, tmp_path):
+    writer = StorageWriter(manager=manager, spill_dir=str(tmp_path / "spill"), max_retry_second=4)
+    writer._spill(_period())
+    write = writer._write
+
+    def locked(batches):
+        raise sqlite3.OperationalError("database is locked")
+
+    writer._write = locked
+    delays = []
+    for _ in range(5):
+        writer._replay_spill(force=True)
+        delays.append(writer._retry_delay)
+    assert delays == [1, 2, 4, 4, 4]
+    # 没有次数上限, 文件一直保持 .pkl
+    assert _spill_names(writer) == [".pkl"]
+    # 退避期间空闲重放不会尝试
+    writer._write = write
+    writer._replay_spill()
+    assert _spill_names(writer) == [".pkl"]
+
+    writer._replay_spill(force=True)
+    assert _spill_names(writer) == []
+    assert writer._retry_delay == 0
+    assert writer.stats()["quarantined_batches"] == 0
+
+
+def test_data_error_and_unreadable_file_are_quarantined(manager, tmp_path):
+    writer = StorageWriter(manager=manager, spill_dir=str(tmp_path / "spill"))
+    writer._spill(_period())
+    with open(os.path.join(writer.spillDir, "spill-0.pkl"), "wb") as file:
+        file.write(b"not a pickle")
+
+    def broken(batches):
+        raise ValueError("bad row")
+
+    writer._write = broken
+    writer._replay_spill()
+    assert _spill_names(writer) == [".bad", ".bad"]
+    assert writer.stats()["quarantined_batches"] == 2